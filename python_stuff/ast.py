@@ -1,5 +1,7 @@
 # AST Node classes
 from lexer import *
+from diagnostics import *
+from itertools import chain, repeat
 
 class ASTNode:
     def __init__(self, source):
@@ -14,18 +16,70 @@ class ASTNode:
 
 
 class Program(ASTNode):
-    def __init__(self, metadata, macros, tracks, source,idents,error_list):
+    def __init__(self, metadata, macros, tracks, source,idents,error_list,index=None,deps=None):
         super().__init__(source)
         self.metadata = metadata
         self.macros = macros
         self.tracks = tracks
         self.ident_dic = idents
         self.err_list = error_list
+        self.index = index # TokenIndex of the source, if the parser had one
+        self.deps = deps if deps is not None else DependencyGraph() # identifiers used by macros and movements
 
     def __str__(self):
         return f"Program(metadata={self.metadata}, macros={self.macros},tracks={self.tracks})"
 
 
+# Which identifiers every macro and movement uses, filled by the parser. The
+# names are the ones written in the source, they may not be macros (the
+# parameters of a macro are left out). Used to find what has to be compiled
+# again when a macro changes.
+class DependencyGraph:
+    def __init__(self):
+        self.macros = {}    # macro name -> names used in its body
+        self.movements = {} # (track index, movement index) -> names used in it
+
+    def add_macro(self, name, uses):
+        self.macros[name] = list(uses)
+
+    def add_movement(self, t_id, m_id, uses):
+        self.movements[(t_id, m_id)] = list(uses)
+
+    # every name reached from names, through the macros using other macros
+    def closure(self, names):
+        found = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name not in found:
+                found.add(name)
+                stack.extend(self.macros.get(name, ()))
+        return found
+
+    # the macros and the movements that use name, directly or through other
+    # macros. They are the ones to compile again when name changes.
+    def dependents(self, name):
+        users = {}
+        for macro, uses in self.macros.items():
+            for used in uses:
+                users.setdefault(used, []).append(macro)
+
+        macros = set()
+        stack = [name]
+        while stack:
+            for macro in users.get(stack.pop(), ()):
+                if macro not in macros:
+                    macros.add(macro)
+                    stack.append(macro)
+
+        names = macros | {name}
+        movements = [key for key, uses in self.movements.items() if not names.isdisjoint(uses)]
+        return macros, movements
+
+    def __str__(self):
+        return f"DependencyGraph(macros={self.macros}, movements={self.movements})"
+
+
 class Metadata(ASTNode):
     def __init__(self, title,source):
         super().__init__(source)
@@ -222,6 +276,18 @@ class ExprGroup(ASTNode):
     def __str__(self):
         return f"exprGroup{{ {self.exprs} }}"
 
+# X*N after resolving repeats, the body is played times times but stored
+# once. Loops and everything in them are shared and never modified, passes
+# that change a body build a new Loop instead.
+class Loop(ASTNode):
+    def __init__(self,exprs,times,source):
+        super().__init__(source)
+        self.exprs = exprs
+        self.times = times
+
+    def __str__(self):
+        return f"Loop*{self.times}{self.exprs}"
+
 ### errors
 
 class errExpr(ASTNode):
@@ -234,6 +300,39 @@ class errExpr(ASTNode):
 
 
 
+# Iterates over an expression list with the loops unrolled on the fly, so the
+# played sequence never has to exist as a list
+def unroll(exprs):
+    stack = [iter(exprs)]
+    while stack:
+        for expr in stack[-1]:
+            if isinstance(expr, Loop):
+                stack.append(chain.from_iterable(repeat(expr.exprs, expr.times)))
+                break
+            yield expr
+        else:
+            stack.pop()
+
+# Number of nodes in the tree under node, a node reached twice (a macro body
+# spliced in several places) is counted every time
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, ASTNode):
+            count += 1
+            for name, value in vars(node).items():
+                if name not in SKIPPED_FIELDS and isinstance(value, (list, ASTNode)):
+                    stack.append(value)
+    return count
+
+# fields of the nodes that aren't children
+SKIPPED_FIELDS = {"source", "ident_dic", "err_list", "index", "deps"}
+
+
 def traverse_ast(node, indent):
     prefix = "  " * indent
     result = []
@@ -317,6 +416,14 @@ def traverse_ast(node, indent):
 
         result.append(f"{prefix}]")
 
+    elif isinstance(node, Loop):
+        result.append(f"{prefix}Loop*{node.times}[")
+
+        for expr in node.exprs:
+            result.append(traverse_ast(expr,indent+2))
+
+        result.append(f"{prefix}]")
+
     elif isinstance(node, Chord):
         result.append(f"{prefix}Chord:")
         for note in node.notes:
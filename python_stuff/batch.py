@@ -0,0 +1,184 @@
+# Compiles every .mtex file of a directory (or matching a glob) in worker
+# processes, run with: python batch.py <directory or glob> [-o out_dir] [-j N]
+#
+# Files are sent to the workers in chunks, results are printed as soon as a
+# chunk is done. The content hash of every file compiled without errors is
+# kept in a manifest next to the outputs, with the compiler version and the
+# output options it was built with. A file with the same hash as its last
+# successful build, built by the same compiler with the same options (and
+# its .mid still there) is skipped. With
+# --cache-dir the workers share a BuildCache, so a file that changed back to
+# something built before (here or in another tree) is copied from the cache.
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from compiler import compile_file, OUTPUT_OPTIONS
+from buildcache import BuildCache, DEFAULT_MAX_BYTES, compiler_version
+from diagnostics import Diagnostic
+
+MANIFEST = ".mtex-build.json"
+
+# Returns (root, files): the sorted .mtex files of pattern, and the directory
+# their outputs are placed relative to
+def find_sources(pattern):
+    if os.path.isdir(pattern):
+        root = pattern
+        files = glob.glob(os.path.join(pattern, "**", "*.mtex"), recursive=True)
+    else:
+        files = glob.glob(pattern, recursive=True)
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files]) if files else "."
+    return root, sorted(files)
+
+def content_hash(file_name):
+    with open(file_name, "rb") as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+def output_path(file_name, root, out_dir):
+    name = os.path.splitext(file_name)[0] + ".mid"
+    if out_dir is None:
+        return name
+    return os.path.join(out_dir, os.path.relpath(os.path.abspath(name), os.path.abspath(root)))
+
+def load_manifest(path):
+    try:
+        with open(path) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+# the last build of a file is still good for this source and compiler
+def up_to_date(entry, source_hash, output):
+    return (entry is not None
+            and entry["hash"] == source_hash
+            and entry.get("compiler") == compiler_version()
+            and entry.get("options") == OUTPUT_OPTIONS
+            and os.path.exists(output))
+
+def save_manifest(path, manifest):
+    # written aside then renamed, an interrupted build keeps the old one
+    with open(path + ".tmp", "w") as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+# the BuildCache of a worker process, kept between its chunks
+worker_cache = None
+
+# Runs in a worker: compiles the (file, output) pairs of a chunk, returns a
+# (file, output, errors, seconds) for each
+def compile_chunk(jobs, cache_dir=None, cache_bytes=DEFAULT_MAX_BYTES):
+    global worker_cache
+    cache = None
+    if cache_dir is not None:
+        if worker_cache is None or worker_cache.directory != cache_dir:
+            worker_cache = BuildCache(cache_dir, cache_bytes)
+        cache = worker_cache
+
+    results = []
+    for file_name, output in jobs:
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        try:
+            errors = compile_file(file_name, output, cache=cache)
+        except Exception as error:
+            errors = [Diagnostic.from_exception(error)]
+        results.append((file_name, output, [str(err).rstrip() for err in errors], time.perf_counter() - start))
+    return results
+
+# Compiles the files of pattern, report(file, status, message) is called for
+# every file as soon as it is done. Returns the summary.
+def compile_batch(pattern, out_dir=None, workers=None, chunk_size=None, force=False, report=None,
+                  cache_dir=None, cache_bytes=DEFAULT_MAX_BYTES):
+    start = time.perf_counter()
+    root, files = find_sources(pattern)
+    manifest_path = os.path.join(out_dir if out_dir is not None else root, MANIFEST)
+    manifest = load_manifest(manifest_path)
+    summary = {"files": len(files), "compiled": 0, "skipped": 0, "failed": 0, "errors": {}}
+
+    todo = []
+    hashes = {}
+    for file_name in files:
+        key = os.path.relpath(file_name, root)
+        output = output_path(file_name, root, out_dir)
+        hashes[file_name] = content_hash(file_name)
+        entry = manifest.get(key)
+        if not force and up_to_date(entry, hashes[file_name], output):
+            summary["skipped"] += 1
+            if report is not None:
+                report(file_name, "skipped", None)
+            continue
+        todo.append((file_name, output))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        # small enough to keep every worker busy until the end, big enough
+        # that the process round trips don't matter
+        chunk_size = max(1, min(32, len(todo) // (workers * 4)))
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    if chunks:
+        with ProcessPoolExecutor(min(workers, len(chunks))) as pool:
+            futures = [pool.submit(compile_chunk, chunk, cache_dir, cache_bytes) for chunk in chunks]
+            for future in as_completed(futures):
+                for file_name, output, errors, seconds in future.result():
+                    key = os.path.relpath(file_name, root)
+                    if errors:
+                        summary["failed"] += 1
+                        summary["errors"][key] = errors
+                        manifest.pop(key, None)
+                        if report is not None:
+                            report(file_name, "failed", "\n".join(errors))
+                    else:
+                        summary["compiled"] += 1
+                        manifest[key] = {"hash": hashes[file_name], "output": output,
+                                         "compiler": compiler_version(), "options": OUTPUT_OPTIONS}
+                        if report is not None:
+                            report(file_name, "ok", f"{output} ({seconds:.2f}s)")
+
+        os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+        save_manifest(manifest_path, manifest)
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+def print_report(file_name, status, message):
+    if status == "skipped":
+        print(f"skip {file_name}")
+    elif status == "ok":
+        print(f"ok   {file_name} -> {message}")
+    else:
+        print(f"FAIL {file_name}")
+        for line in message.split("\n"):
+            print(f"     {line}")
+    sys.stdout.flush()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compile many .mtex files at once")
+    arg_parser.add_argument("pattern", help="directory (searched recursively) or glob of .mtex files")
+    arg_parser.add_argument("-o", "--out-dir", default=None, help="put the .mid files here instead of next to the sources")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: one per cpu)")
+    arg_parser.add_argument("--chunk-size", type=int, default=None, help="files sent to a worker at once")
+    arg_parser.add_argument("--force", action="store_true", help="compile the files that didn't change too")
+    arg_parser.add_argument("--cache-dir", default=None, help="build cache shared by the workers")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help="size of the build cache in MB")
+    arg_parser.add_argument("--summary", default=None, help="also write the summary to this JSON file")
+    args = arg_parser.parse_args()
+
+    summary = compile_batch(args.pattern, args.out_dir, args.jobs, args.chunk_size, args.force, print_report,
+                            args.cache_dir, args.cache_size * 1024 * 1024)
+    print(f"{summary['files']} files: {summary['compiled']} compiled, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed in {summary['seconds']}s")
+    if args.summary is not None:
+        with open(args.summary, "w") as out:
+            json.dump(summary, out, indent=1)
+    if summary["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
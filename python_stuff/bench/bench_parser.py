@@ -0,0 +1,48 @@
+# Expression throughput of the parser, in notes per second.
+# run with: python bench/bench_parser.py [notes]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexer import Tokenizer
+from new_parser import Parser
+
+NOTES = ["do", "re", "mi", "fa", "sol", "la", "si"]
+
+
+# one movement per line, bars every 4 notes, a few settings sprinkled in
+def gen_source(n_notes, per_line=64):
+    lines = []
+    for start in range(0, n_notes, per_line):
+        exprs = []
+        for i in range(start, min(start + per_line, n_notes)):
+            exprs.append(NOTES[i % len(NOTES)])
+            if i % 4 == 3:
+                exprs.append("|")
+        lines.append(f"piano \"m{start}\": !4/4 :1/4 " + " ".join(exprs))
+    return "\n".join(lines) + "\n"
+
+
+def bench(n_notes, repeat=5):
+    tokens = Tokenizer(gen_source(n_notes)).tokenize()
+
+    best = None
+    for _ in range(repeat):
+        parser = Parser(tokens)
+        start = time.perf_counter()
+        parser.parse()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    elapsed = bench(n_notes)
+    print(f"parsed {n_notes} notes in {elapsed:.3f}s, {n_notes / elapsed:,.0f} notes/s")
+
+
+if __name__ == "__main__":
+    main()
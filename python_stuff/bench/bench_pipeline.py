@@ -0,0 +1,206 @@
+# Benchmark of the whole compiler, stage by stage, on generated scores.
+#
+# Every scenario generates a .mtex source of a given size (notes, movements,
+# macros, macro nesting depth, *N repeats, [ ] nesting) at a few sizes, and
+# compiles it with compile_file, recording each stage with a PipelineProfile.
+# For every stage it reports the best time, the throughput, the peak memory
+# (in a separate run, tracemalloc slows everything down) and the exponent k of
+# time ~ size^k fitted over the sizes. Exits with code 1 when a stage looks
+# quadratic, or is clearly slower than in the baseline.
+#
+# run with: python bench/bench_pipeline.py [--scale 1] [--only notes,macros]
+#           [--save-baseline bench/baseline.json] [--baseline bench/baseline.json]
+import os
+import sys
+import json
+import math
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiler import compile_file
+from pipeline_profile import PipelineProfile
+
+NOTES = ["do", "re", "mi", "fa", "sol", "la", "si"]
+HEADER = "!4/4 :1/4 "
+
+
+# n notes in one movement, bars every 4 notes, 64 notes per line
+def gen_notes(n):
+    lines = []
+    for start in range(0, n, 64):
+        exprs = []
+        for i in range(start, min(start + 64, n)):
+            exprs.append(NOTES[i % len(NOTES)])
+            if i % 4 == 3:
+                exprs.append("|")
+        lines.append("\t" + " ".join(exprs))
+    return "piano: " + HEADER + "[\n" + "\n".join(lines) + "\n]\n"
+
+# n movements of 16 notes, 8 per track. There are only 15 midi channels for
+# them, so past that the file is not written (no write stage)
+def gen_movements(n):
+    lines = []
+    for i in range(n):
+        if i % 8 == 0:
+            lines.append(f"track \"t{i // 8}\":")
+        bars = " | ".join(" ".join(NOTES[(i + j + k) % len(NOTES)] for k in range(4)) for j in range(4))
+        lines.append(f"piano \"m{i}\": {HEADER}{bars} |")
+    return "\n".join(lines) + "\n"
+
+# n macros of a bar each, all used once
+def gen_macros(n):
+    lines = [f"m{i} = " + " ".join(NOTES[(i + k) % len(NOTES)] for k in range(4)) + " |" for i in range(n)]
+    uses = [" ".join(f"m{i}" for i in range(start, min(start + 32, n))) for start in range(0, n, 32)]
+    return "\n".join(lines) + "\npiano: " + HEADER + "[\n" + "\n".join(uses) + "\n]\n"
+
+# a chain of n macros, each one is the previous one and a note
+def gen_macro_depth(n):
+    lines = ["m0 = do"]
+    lines += [f"m{i} = m{i - 1} {NOTES[i % len(NOTES)]}" for i in range(1, n)]
+    return "\n".join(lines) + f"\npiano: :1/4 m{n - 1}\n"
+
+# a bar repeated n times
+def gen_repeats(n):
+    return "piano: " + HEADER + f"[ do re mi fa | ]*{n}\n"
+
+# [ ] groups nested n deep, a note in each
+def gen_nesting(n):
+    return "piano: " + HEADER + "[ " * n + "do" + " ] re" * n + "\n"
+
+# name -> (generator, sizes at scale 1), the sizes double so the fit is even
+SCENARIOS = {
+    "notes": (gen_notes, [2000, 4000, 8000]),
+    "movements": (gen_movements, [40, 80, 160]),
+    "macros": (gen_macros, [250, 500, 1000]),
+    "macro_depth": (gen_macro_depth, [100, 200, 400]),
+    "repeats": (gen_repeats, [500, 1000, 2000]),
+    "nesting": (gen_nesting, [50, 100, 200]),
+}
+
+# the unit the throughput of a stage is counted in, from its record
+UNITS = {"tokenize": "tokens", "parse": "nodes_after", "generate": "events", "write": "events"}
+
+
+# Compiles source once, returns the stage records of the profile
+def profile_source(path, source, memory=False):
+    with open(path, "w") as f:
+        f.write(source)
+    profile = PipelineProfile(memory=memory)
+    compile_file(path, path + ".mid", profile=profile)
+    profile.stop()
+    return profile.stages
+
+# best time of every stage over repeat runs, and the peak memory of a last
+# run with tracemalloc on
+def measure(path, source, repeat):
+    runs = [profile_source(path, source) for _ in range(repeat)]
+    memory = {record["stage"]: record["peak_bytes"] for record in profile_source(path, source, memory=True)}
+
+    stages = {}
+    for records in runs:
+        for record in records:
+            best = stages.get(record["stage"])
+            if best is None or record["seconds"] < best["seconds"]:
+                stages[record["stage"]] = dict(record)
+    if "write" in stages:
+        stages["write"]["events"] = stages["generate"]["events"]
+    for name, record in stages.items():
+        record["peak_bytes"] = memory.get(name)
+        unit = UNITS.get(name, "nodes_before")
+        if record.get(unit) and record["seconds"] > 0:
+            record["per_second"] = record[unit] / record["seconds"]
+    return stages
+
+# least squares fit of log(time) = k log(size) + c, returns k
+def fit_exponent(sizes, times):
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(time, 1e-9)) for time in times]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+def run(names, scale, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            generate, sizes = SCENARIOS[name]
+            sizes = [max(1, int(size * scale)) for size in sizes]
+            path = os.path.join(directory, name + ".mtex")
+            results[name] = {"sizes": sizes, "runs": [measure(path, generate(size), repeat) for size in sizes]}
+    return results
+
+def report(results, baseline, max_exponent, max_slowdown, min_seconds):
+    failed = False
+    for name, result in results.items():
+        sizes, runs = result["sizes"], result["runs"]
+        print(f"{name} (sizes {', '.join(map(str, sizes))})")
+        print(f"  {'stage':<20}{'ms':>10}{'per s':>12}{'peak KB':>10}{'~n^k':>7}{'vs base':>9}")
+        for stage in runs[-1]:
+            if not all(stage in stages for stages in runs):
+                continue
+            times = [stages[stage]["seconds"] for stages in runs]
+            last = runs[-1][stage]
+            notes = []
+
+            k = None
+            if times[-1] >= min_seconds: # shorter ones are mostly noise
+                k = fit_exponent(sizes, times)
+                if k > max_exponent:
+                    notes.append("looks quadratic")
+                    failed = True
+
+            ratio = None
+            base = baseline.get(name, {}).get(stage, {}).get(str(sizes[-1])) if baseline else None
+            if base and times[-1] >= min_seconds:
+                ratio = times[-1] / base
+                if ratio > max_slowdown:
+                    notes.append("slower than baseline")
+                    failed = True
+
+            per_second = f"{last['per_second']:,.0f}" if last.get("per_second") else ""
+            peak = f"{last['peak_bytes'] / 1024:.0f}" if last.get("peak_bytes") is not None else ""
+            print(f"  {stage:<20}{times[-1] * 1000:>10.2f}{per_second:>12}{peak:>10}"
+                  f"{'' if k is None else f'{k:.2f}':>7}{'' if ratio is None else f'{ratio:.2f}x':>9}"
+                  + ("  " + ", ".join(notes) if notes else ""))
+    return failed
+
+# scenario -> stage -> size -> best seconds
+def to_baseline(results):
+    baseline = {}
+    for name, result in results.items():
+        stages = baseline[name] = {}
+        for size, runs in zip(result["sizes"], result["runs"]):
+            for stage, record in runs.items():
+                stages.setdefault(stage, {})[str(size)] = record["seconds"]
+    return baseline
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark every stage of the compiler on generated scores")
+    arg_parser.add_argument("--scale", type=float, default=1, help="multiply the sizes of every scenario")
+    arg_parser.add_argument("--only", default=None, help="comma separated scenarios, of: " + ", ".join(SCENARIOS))
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per size, the best one counts")
+    arg_parser.add_argument("--baseline", default=None, help="compare with the times saved in this file")
+    arg_parser.add_argument("--save-baseline", default=None, help="save the times to this file")
+    arg_parser.add_argument("--max-exponent", type=float, default=1.5, help="flag stages growing faster than n^k")
+    arg_parser.add_argument("--max-slowdown", type=float, default=1.25, help="flag stages this much slower than the baseline")
+    arg_parser.add_argument("--min-ms", type=float, default=1, help="don't judge stages faster than this")
+    args = arg_parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    results = run(names, args.scale, args.repeat)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failed = report(results, baseline, args.max_exponent, args.max_slowdown, args.min_ms / 1000)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(to_baseline(results), f, indent=1)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Scaling benchmark for the simplify passes, fails (exit code 1) when a pass
+# grows clearly worse than linearly with the size of the input.
+# run with: python bench/bench_simplify.py [size]
+import os
+import sys
+import math
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexer import Token, TokenType
+from ast import *
+from simplify import flatten_expr_group
+
+
+def note(i):
+    return Note(Token("do", 1, i, TokenType.do), 0, -1, -1)
+
+
+def program_with(exprs):
+    movement = Movement(Token("piano", 1, 0, TokenType.ALPHANUM), "", exprs)
+    return Program([], [], [Track("global", [movement], None)], None, {}, [])
+
+
+# [ [ [ ... do ... ] do ] do ]
+def deep_groups(n):
+    group = [note(0)]
+    for i in range(n):
+        group = [ExprGroup(group, None), note(i)]
+    return program_with(group)
+
+
+# [ do re ] [ do re ] ... at the top level and inside a few levels
+def wide_groups(n):
+    exprs = []
+    for i in range(n):
+        exprs.append(ExprGroup([note(i), ExprGroup([note(i), note(i)], None)], None))
+    return program_with(exprs)
+
+
+def time_pass(build, n, run, repeat=3):
+    best = None
+    for _ in range(repeat):
+        program = build(n)
+        start = time.perf_counter()
+        run(program)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# exponent k of time ~ n^k, from the smallest and the largest size
+def scaling(times, sizes):
+    return math.log(times[-1] / times[0]) / math.log(sizes[-1] / sizes[0])
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    sizes = [size, size * 2, size * 4]
+    failed = False
+
+    for name, build in [("deep groups", deep_groups), ("wide groups", wide_groups)]:
+        times = [time_pass(build, n, flatten_expr_group) for n in sizes]
+        k = scaling(times, sizes)
+        report = ", ".join(f"n={n}: {t * 1000:.1f}ms" for n, t in zip(sizes, times))
+        print(f"flatten_expr_group {name}: {report}, ~n^{k:.2f}")
+        if k > 1.5:
+            print(f"  looks quadratic")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
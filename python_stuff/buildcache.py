@@ -0,0 +1,148 @@
+# Content-addressed build cache on disk
+#
+# An entry is keyed by the hash of the source, the compiler version (a hash
+# of all the compiler's modules, so any change to them starts a new cache)
+# and the options that change the output. It holds the .mid bytes and
+# optionally the pickled EventTable. Files are written to a temporary file
+# then renamed, so processes sharing the directory never read half written
+# entries. When the directory grows over max_bytes the least recently used
+# files are removed (a hit updates the file's modification time).
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# the compiler's own modules, every .py file next to this one. Any of them
+# can change the output, so they are all hashed instead of keeping a list.
+COMPILER_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+_versions = {} # directory -> version
+
+def compiler_version(directory=COMPILER_DIRECTORY):
+    version = _versions.get(directory)
+    if version is None:
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".py"):
+                continue
+            digest.update(name.encode() + b"\0")
+            with open(os.path.join(directory, name), "rb") as module:
+                digest.update(module.read())
+        version = _versions[directory] = digest.hexdigest()[:16]
+    return version
+
+class BuildCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, store_events=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.store_events = store_events
+        self.size = None # bytes in the directory, scanned on the first put
+        self.hits = 0
+        self.misses = 0
+
+    # source is the bytes of the .mtex file
+    def key(self, source, options=None):
+        digest = hashlib.sha256()
+        digest.update(compiler_version().encode())
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        digest.update(b"\0")
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    # returns the stored bytes of the midi file, or None
+    def get(self, key):
+        data = self.read(self.path(key, ".mid"))
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    # returns the stored EventTable, or None
+    def get_events(self, key):
+        data = self.read(self.path(key, ".events"))
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def put(self, key, midi, events=None):
+        self.write(self.path(key, ".mid"), bytes(midi))
+        if events is not None and self.store_events:
+            self.write(self.path(key, ".events"), pickle.dumps(events, pickle.HIGHEST_PROTOCOL))
+
+    def read(self, path):
+        try:
+            with open(path, "rb") as entry:
+                data = entry.read()
+            os.utime(path) # most recently used
+        except FileNotFoundError:
+            return None # never stored, or evicted by another process
+        return data
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as entry:
+                entry.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    # (modification time, size, path) of every file of the cache
+    def entries(self):
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp") and stat.st_mtime > time.time() - 3600:
+                    continue # still being written by someone
+                found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    # removes the least recently used files until the cache is down to 90%
+    # of max_bytes, so it doesn't run again on the next put
+    def evict(self):
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass # another process evicted it first
+            self.size -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.size = 0
+
+    def __repr__(self):
+        return f"BuildCache({self.directory!r}, hits={self.hits}, misses={self.misses})"
@@ -1,21 +1,94 @@
-from new_parser import Parser
-from lexer import Tokenizer
+from new_parser import Parser, TokenStream, TraceLevel
+from lexer import Tokenizer, MappedSource, load_source
 from simplify import * 
 from ast import traverse_ast
+from diagnostics import Diagnostic, Code
 from midigen import *
+from midiwriter import write_smf
+from buildcache import BuildCache, DEFAULT_MAX_BYTES
+from pipeline_profile import PipelineProfile
+import argparse
+import os
 import sys
 
-def main():
-    file_name = sys.argv[1]
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(description="Compile a .mtex file to midi")
+    arg_parser.add_argument("input", help="path to the .mtex file")
+    arg_parser.add_argument("output", nargs="?", default=None, help="path of the .mid file to write")
+    arg_parser.add_argument("--mmap", action="store_true",
+                            help="memory map the input file, for very large generated scores")
+    arg_parser.add_argument("--trace", choices=["off", "error", "info", "debug"], default="off",
+                            help="keep a parser trace, printed on internal parser errors")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="render the tracks of a multi-track score in this many processes")
+    arg_parser.add_argument("--cache-dir", default=None,
+                            help="reuse the midi file of a previous build of the same source from this directory")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                            help="size of the cache directory in MB, least recently used builds are removed")
+    arg_parser.add_argument("--check", action="store_true",
+                            help="only look for errors, without generating the midi file")
+    arg_parser.add_argument("--dump-ast", action="store_true",
+                            help="print the ast after every simplify pass")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="print the time, peak memory and sizes of every compiler stage")
+    arg_parser.add_argument("--profile-json", default=None, metavar="FILE",
+                            help="write the --profile numbers to FILE as JSON")
+    return arg_parser.parse_intermixed_args(argv)
+
+EMPTY_ERROR = Diagnostic(Code.EMPTY)
+
+# options that change the midi file, the others (mmap, trace, jobs) don't.
+# The ticks per quarter note aren't one: they are derived from the durations
+# of the lowered score (ticks_per_quarter_for), so the source and the
+# compiler version already decide them.
+OUTPUT_OPTIONS = {"format": 1}
+
+# Compiles file_name to output (next to it by default), returns the
+# compilation errors, the file is only written if there are none. With a
+# BuildCache, a source compiled before is not compiled again. verbose prints
+# the ast after every simplify pass, profile is a PipelineProfile the stages
+# are recorded in. With check, the program is only validated and nothing is
+# written.
+def compile_file(file_name, output=None, mapped=False, trace=TraceLevel.OFF, jobs=1, verbose=False, cache=None,
+                 profile=None, check=False):
+    if profile is None:
+        profile = PipelineProfile(enabled=False)
+    if output is None:
+        output = os.path.splitext(file_name)[0] + ".mid"
 
-    with open(file_name) as f:
-        source = f.read()
+    if cache is not None and not check:
+        with profile.stage("cache"):
+            with open(file_name, "rb") as f:
+                key = cache.key(f.read(), OUTPUT_OPTIONS)
+            midi = cache.get(key)
+        if midi is not None:
+            with open(output, "wb") as f:
+                f.write(midi)
+            return []
 
-    tokenizer = Tokenizer(source)
-    tokens = tokenizer.tokenize()
+    with profile.stage("read"):
+        source = load_source(file_name, mapped=mapped)
+        tokenizer = Tokenizer(source)
 
-    parser = Parser(tokens)
-    ast = parser.parse()
+    with profile.stage("tokenize") as record:
+        if isinstance(source, MappedSource):
+            # tokens are only offsets into the map, values are decoded on access
+            tokens = tokenizer.tokenize_compact()
+        elif profile.enabled:
+            # lexed up front, so lexing and parsing are timed apart
+            tokens = tokenizer.tokenize()
+        else:
+            # lex lazily, the parser pulls tokens as it goes
+            tokens = TokenStream(tokenizer.iter_tokens())
+    if profile.enabled:
+        record["tokens"] = len(tokens)
+
+    with profile.stage("parse") as record:
+        parser = Parser(tokens, trace, index=tokenizer.index)
+        ast = parser.parse()
+    record["nodes_after"] = profile.nodes(ast)
+    if isinstance(source, MappedSource):
+        source.close()
 
 
 
@@ -26,41 +99,63 @@ def main():
             count += len(mov.expressions)
 
     if count == 0:
-        print("""Compilation error: All tracks cannot be empty.
-|
-| Tip: write the name of an instruments, ":" then the notes you want to play in the same line
-|
-| Example: 
-|
-| piano: do re mi fa sol la si do
-
-""")
-        return
-
-    resolve_repeats(ast)
-    print(traverse_ast(ast,0))
-    flatten_expr_group(ast)
-    print(traverse_ast(ast,0))
-    resolve_macros(ast)
-    print(traverse_ast(ast,0))
-    
-    output = ""
-    try:
-        output = sys.argv[2]
-    except:
-        output = file_name.split(".")[-2] + ".mid"
-        print(output)
-        # files are in the form ./twinkle.midi , after splitting /twinkle, skip / with [1:]
-    gen_midi(ast,output)
+        return [EMPTY_ERROR]
+
+    for simplify in (resolve_repeats, flatten_expr_group, resolve_macros):
+        with profile.stage(simplify.__name__, nodes_before=profile.nodes(ast)) as record:
+            simplify(ast)
+        record["nodes_after"] = profile.nodes(ast)
+        if verbose:
+            print(traverse_ast(ast,0))
+
+    if check:
+        with profile.stage("validate"):
+            ast.err_list.extend(check_program(ast))
+        return ast.err_list
+
+    with profile.stage("generate") as record:
+        events = gen_events(ast,jobs)
+    record["events"] = len(events)
+
+    if len(ast.err_list) == 0:
+        with profile.stage("write"):
+            midi = write_smf(events)
+            with open(output, "wb") as f:
+                f.write(midi)
+        if cache is not None:
+            cache.put(key, midi, events)
+
+    return ast.err_list
+
+def main():
+    args = parse_args(sys.argv[1:])
+    trace = getattr(TraceLevel, args.trace.upper())
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = BuildCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    profile = None
+    if args.profile or args.profile_json is not None:
+        profile = PipelineProfile()
+
+    errors = compile_file(args.input, args.output, args.mmap, trace, args.jobs, args.dump_ast, cache, profile, args.check)
 
     # error checking
-    if len(ast.err_list) > 0:
+    if errors == [EMPTY_ERROR]:
+        print(EMPTY_ERROR)
+    elif len(errors) > 0:
         print("Compilation errors:")
-        for err in ast.err_list:
+        for err in errors:
             print(err)
-        return
 
-    pass
+    if profile is not None:
+        profile.stop()
+        if args.profile:
+            print(profile.table())
+        if args.profile_json is not None:
+            with open(args.profile_json, "w") as f:
+                f.write(profile.to_json())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,284 @@
+# Errors found while compiling a program
+#
+# A Diagnostic only keeps a code, where it is and the values that go in its
+# message, the text is put together when it's read (str(), message(),
+# to_dict()). Building one is cheap, so the parser can report errors inside
+# its recovery loops. The compile server sends them as to_dict(), clients get
+# the line and column without parsing the message.
+from lexer import TokenType, UnrecognizedCharacter
+
+# errors kept per file, after that a single TOO_MANY_ERRORS is added and the
+# rest are dropped (the parser stops there)
+MAX_ERRORS = 100
+
+class Severity:
+    ERROR = "error"
+    WARNING = "warning"
+
+class Code:
+    # syntax
+    NOTE_STATEMENT = "note-statement"
+    STATEMENT_START = "statement-start"
+    TITLE_COLON = "title-colon"
+    TITLE_STRING = "title-string"
+    ALPHANUM_TOKEN = "alphanum-token"
+    TRACK_COLON = "track-colon"
+    MOVEMENT_COLON = "movement-colon"
+    MACRO_TRAILING_COMMA = "macro-trailing-comma"
+    MACRO_PARAMETER = "macro-parameter"
+    MACRO_PARAMETER_END = "macro-parameter-end"
+    MACRO_ARGUMENTS = "macro-arguments"
+    MACRO_EQUALS = "macro-equals"
+    VOLUME_EQUALS = "volume-equals"
+    VOLUME_NUMBER = "volume-number"
+    SHARP_NOTE = "sharp-note"
+    FLAT_NOTE = "flat-note"
+    DURATION_NUMBER = "duration-number"
+    MEASURE_SLASH = "measure-slash"
+    MEASURE_NUMBER = "measure-number"
+    MEASURE_BANG = "measure-bang"
+    TEMPO_NUMBER = "tempo-number"
+    CHORD_NOTE = "chord-note"
+    SLASH_NUMBER = "slash-number"
+    NOTE_DURATION = "note-duration"
+    HOLD_NOTE = "hold-note"
+    ARGUMENT_LIST = "argument-list"
+    IDENT_TOKEN = "ident-token"
+    EXPRESSION_TOKEN = "expression-token"
+    UNRECOGNIZED_CHARACTER = "unrecognized-character"
+    REPETITION_START = "repetition-start"
+    # identifiers
+    REDEFINITION = "redefinition"
+    TAG_EXISTS = "tag-exists"
+    INSTRUMENT_REUSED = "instrument-reused"
+    UNKNOWN_IDENTIFIER = "unknown-identifier"
+    # macros
+    MACRO_CYCLE = "macro-cycle"
+    MACRO_ARITY = "macro-arity"
+    # compilation
+    EMPTY = "empty"
+    UNKNOWN_INSTRUMENT = "unknown-instrument"
+    TOO_MANY_MOVEMENTS = "too-many-movements"
+    BAR_LENGTH = "bar-length"
+    PITCH_RANGE = "pitch-range"
+    VOLUME_RANGE = "volume-range"
+    TOO_MANY_ERRORS = "too-many-errors"
+    INTERNAL = "internal"
+
+SYNTAX = "Syntax Error"
+IDENTIFIER = "Identifier Error"
+COMPILATION = "Compilation error"
+MEASURE = "Measure error"
+MACRO = "Macro error"
+INTERNAL = "Internal error"
+
+GOT = ", got token \"{}\" instead"
+
+NOTE_STATEMENT_TIP = """|
+| Tip: To write notes or expressions over multiple lines use an exression group by enclosing them in []
+|
+|   Example:
+|   X piano:
+|           do re mi
+|
+|   V piano: [
+|           do re mi
+|   ]
+|
+"""
+
+STATEMENT_START_TIP = """| Tip: The supported types of statements are:
+| 1. Metadata statements
+|   example: title = "my title"
+|
+| 2. Track start statements
+|   example: track "my track":
+|   Note: a track end when either the file ends or another track is defined
+|         also, if no track is defined, the entire file is treated as the track
+|
+| 3. Movements
+|   example: piano "melodi": do re mi
+|
+| 4. Macros
+|   example: my_macro = do re mi
+|            my_macro_with_arguments (arg1,arg2) = arg1 do re mi arg2
+|
+"""
+
+INSTRUMENT_REUSED_TIP = """| Tip: to have the same instrument playing twice in a movement, use a tag to differentiate it:
+| x piano : do re mi
+|   piano : fa sol la
+|
+| v piano : do re mi
+|   piano "another" : fa sol la
+"""
+
+UNKNOWN_INSTRUMENT_TIP = """| Tip: You can choose instruments like piano,guitar etc.
+| Tip: All the midi instruments are supported
+"""
+
+EMPTY_TIP = """|
+| Tip: write the name of an instruments, ":" then the notes you want to play in the same line
+|
+| Example:
+|
+| piano: do re mi fa sol la si do
+"""
+
+# code -> (kind, message, tip), the message is formatted with the args
+MESSAGES = {
+    Code.NOTE_STATEMENT: (SYNTAX, "Statements cannot start with a note literal.", NOTE_STATEMENT_TIP),
+    Code.STATEMENT_START: (SYNTAX, "Unexpected token \"{}\" for begining of new statement", STATEMENT_START_TIP),
+    Code.TITLE_COLON: (SYNTAX, "Expected colon after keyword title" + GOT, None),
+    Code.TITLE_STRING: (SYNTAX, "Expected string after title definiton" + GOT, None),
+    Code.ALPHANUM_TOKEN: (SYNTAX, "Unexpected token after alphanum: {}", None),
+    Code.TRACK_COLON: (SYNTAX, "Expected colon or string after \"track\"" + GOT, None),
+    Code.MOVEMENT_COLON: (SYNTAX, "Expected colon after movement {}" + GOT, None),
+    Code.MACRO_TRAILING_COMMA: (SYNTAX, "Trailing comma in macro definition arguments: \"{}\"", None),
+    Code.MACRO_PARAMETER: (SYNTAX, "Expected parameter type, got \"{}\" instead of an identifier", None),
+    Code.MACRO_PARAMETER_END: (SYNTAX, "Macro parameter must be fallowed by comma or closed parenthesi" + GOT, None),
+    Code.MACRO_ARGUMENTS: (SYNTAX, "Expected identifier in arguments body" + GOT, None),
+    Code.MACRO_EQUALS: (SYNTAX, "Expected equals sign after macro name or arguments" + GOT, None),
+    Code.VOLUME_EQUALS: (SYNTAX, "Expected equals sign after keyword {}" + GOT, None),
+    Code.VOLUME_NUMBER: (SYNTAX, "Expected a number after \"{}=\"" + GOT, None),
+    Code.SHARP_NOTE: (SYNTAX, "Expected note literal after plus" + GOT,
+                      "| Tip: '+' increase the pitch of a note by a semitone for the entire movement"),
+    Code.FLAT_NOTE: (SYNTAX, "Expected note literal after dash" + GOT,
+                     "| Tip: '-' lowers the pitch of a note by a semitone for the entire movement"),
+    Code.DURATION_NUMBER: (SYNTAX, "After colon expression expected number" + GOT,
+                           "| Tip: ':' fallowed directly by a number is used to set the duration of a single note for the given track"),
+    Code.MEASURE_SLASH: (SYNTAX, "Measures are defined as number/number, after number got \"{}\" instead of \"/\"", None),
+    Code.MEASURE_NUMBER: (SYNTAX, "Expected number after defining measure" + GOT, None),
+    Code.MEASURE_BANG: (SYNTAX, "Expected a number after \"!\"" + GOT, None),
+    Code.TEMPO_NUMBER: (SYNTAX, "Expected number after '^'" + GOT, None),
+    Code.CHORD_NOTE: (SYNTAX, "Chords can only be formed from notes, using {} is not valid", None),
+    Code.SLASH_NUMBER: (SYNTAX, "After slash expected a number" + GOT, None),
+    Code.NOTE_DURATION: (SYNTAX, "After colon in note definition expected a number" + GOT, None),
+    Code.HOLD_NOTE: (SYNTAX, "Expected note or identifier after open parenthesis" + GOT, None),
+    Code.ARGUMENT_LIST: (SYNTAX, "Expected comma or close parenthesis after expression in argument list" + GOT, None),
+    Code.IDENT_TOKEN: (SYNTAX, "Unexpected token after identifier: \"{}\"", None),
+    Code.EXPRESSION_TOKEN: (SYNTAX, "Unexpected token while parsing expressions: \"{}\"", None),
+    Code.UNRECOGNIZED_CHARACTER: (SYNTAX, "Unrecognized character '{}'", None),
+    Code.REPETITION_START: (SYNTAX, "Nothing to repeat before \"*{}\"", None),
+    Code.REDEFINITION: (IDENTIFIER, "Identifier {} is already used here:{}, redefinitions are not allowed", None),
+    Code.TAG_EXISTS: (IDENTIFIER, "Tag {} already exits {}", None),
+    Code.INSTRUMENT_REUSED: (IDENTIFIER, "Instrument {} was already used in this track:{}", INSTRUMENT_REUSED_TIP),
+    Code.UNKNOWN_IDENTIFIER: (IDENTIFIER, "Unknown identifier \"{}\", it is not a macro or a parameter", None),
+    Code.MACRO_CYCLE: (MACRO, "macro \"{}\" is defined in terms of itself: {}", None),
+    Code.MACRO_ARITY: (MACRO, "macro \"{}\" takes {} arguments, got {}", None),
+    Code.EMPTY: (COMPILATION, "All tracks cannot be empty.", EMPTY_TIP),
+    Code.UNKNOWN_INSTRUMENT: (COMPILATION, "instrument \"{}\" is not supported", UNKNOWN_INSTRUMENT_TIP),
+    Code.TOO_MANY_MOVEMENTS: (COMPILATION, "there are {} movements, a midi file only has {} channels for instruments", None),
+    Code.BAR_LENGTH: (MEASURE, "The measure is {}/{}, for this bar got {} notes instead", None),
+    Code.PITCH_RANGE: (COMPILATION, "note \"{}\" has pitch {}, midi pitches go from 0 to 127",
+                       "| Tip: the octave is 4 by default, every '>' raises it and every '<' lowers it"),
+    Code.VOLUME_RANGE: (COMPILATION, "volume {} is out of range, it goes from 0 to 127", None),
+    Code.TOO_MANY_ERRORS: (COMPILATION, "stopped after {} errors", None),
+    Code.INTERNAL: (INTERNAL, "{}: {}", None),
+}
+
+
+class Diagnostic:
+    __slots__ = ("code", "severity", "line", "column", "span", "args")
+
+    # line and column are None for errors about the whole program, span is
+    # the number of characters to underline
+    def __init__(self, code, line=None, column=None, span=0, args=(), severity=Severity.ERROR):
+        self.code = code
+        self.severity = severity
+        self.line = line
+        self.column = column
+        self.span = span
+        self.args = args
+
+    # error at a token, args are kept as they are until the message is read
+    @classmethod
+    def at(cls, code, token, *args):
+        if token is None:
+            return cls(code, args=args)
+        span = 0 if token.type in (TokenType.NL, TokenType.EOF) else len(token.value)
+        return cls(code, token.line, token.column, span, args)
+
+    def kind(self):
+        return MESSAGES[self.code][0]
+
+    def message(self):
+        return MESSAGES[self.code][1].format(*self.args)
+
+    def tip(self):
+        return MESSAGES[self.code][2]
+
+    def location(self):
+        if self.line is None:
+            return self.kind()
+        return f"{self.kind()}({self.line},{self.column})"
+
+    # args as they can go in JSON
+    def plain_args(self):
+        return [arg if isinstance(arg, (int, float, str)) else str(arg) for arg in self.args]
+
+    def to_dict(self):
+        return {
+            "code": self.code,
+            "severity": self.severity,
+            "line": self.line,
+            "column": self.column,
+            "span": self.span,
+            "args": self.plain_args(),
+            "message": self.message(),
+            "tip": self.tip(),
+        }
+
+    def __str__(self):
+        tip = self.tip()
+        text = f"{self.location()}: {self.message()}"
+        return text if tip is None else text + "\n" + tip
+
+    def __repr__(self):
+        return f"Diagnostic({self.code}, {self.line}, {self.column})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Diagnostic):
+            return NotImplemented
+        return (self.code, self.severity, self.line, self.column, self.span, self.plain_args()) == \
+               (other.code, other.severity, other.line, other.column, other.span, other.plain_args())
+
+    __hash__ = None
+
+    # the error for an exception raised while compiling, only the tokenizer
+    # raises for mistakes in the program, anything else is a compiler bug
+    @classmethod
+    def from_exception(cls, error):
+        if isinstance(error, UnrecognizedCharacter):
+            return cls(Code.UNRECOGNIZED_CHARACTER, error.line, error.column, 1, (error.char,))
+        return cls(Code.INTERNAL, args=(type(error).__name__, str(error)))
+
+
+# The errors of a file, keeps the first limit of them
+class DiagnosticList(list):
+    limit = MAX_ERRORS
+    dropped = 0
+
+    def __init__(self, diagnostics=(), limit=MAX_ERRORS):
+        super().__init__()
+        self.limit = limit
+        self.dropped = 0
+        self.extend(diagnostics)
+
+    def append(self, diagnostic):
+        if len(self) < self.limit:
+            super().append(diagnostic)
+            return
+        if self.dropped == 0:
+            super().append(Diagnostic(Code.TOO_MANY_ERRORS, args=(self.limit,)))
+        self.dropped += 1
+
+    def extend(self, diagnostics):
+        for diagnostic in diagnostics:
+            self.append(diagnostic)
+
+    def full(self):
+        return self.dropped > 0
+
+    def to_json(self):
+        return [diagnostic.to_dict() for diagnostic in self]
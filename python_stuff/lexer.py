@@ -1,296 +1,524 @@
-class TokenType:
-    OPEN_BRACE = "OPEN_BRACE"
-    CLOSE_BRACE = "CLOSE_BRACE"
-    OPEN_PAREN = "OPEN_PAREN"
-    CLOSE_PAREN = "CLOSE_PAREN"
-    OPEN_BRACKET = "OPEN_BRACKET"
-    CLOSE_BRACKET = "CLOSE_BRACKET"
-    COLON = "COLON"
-    DOUBLE_QUOTE = "DOUBLE_QUOTE"
-    COMMA = "COMMA"
-    PIPE = "PIPE"
-    SLASH = "SLASH"
-    BANG = "BANG"
-    EQUAL = "EQUAL"
-    NL = "NL"
-    SINGLE_QUOTE = "SINGLE_QUOTE"
-    DOT = "DOT"
-    DASH = "DASH"
-    PLUS = "PLUS"
-    GREATER_THAN = "GREATER_THAN"
-    LESS_THAN = "LESS_THAN"
-    CARROT = "CARROT"
-    ASTERISK = "ASTERISK"
-    SEMICOLON = "SEMICOLON"
-    SPACE = "SPACE"
-
-    # Literals
-    ALPHANUM = "ALPHANUM"
-    NUM = "NUM"
-    STRING = "STRING"
-
-    # Keywords
-    KW_MACRO = 'KW_MACRO'
-    KW_TRACK = 'TRACK'
-    KW_TITLE = "KW_TITLE"
-    KW_CR = "KW_CR"
-    KW_R = "KW_R"
-    V = "V" # volume
-
-    EOF = "EOF"
-
-    # notes
-    do = "do"
-    re = "re"
-    mi = "mi"
-    fa = "fa"
-    sol = "sol"
-    la = "la"
-    si = "si"
-
-
-
-class Token:
-    def __init__(self, value, line, column, token_type):
-        self.value = value
-        self.line = line
-        self.column = column
-        self.type = token_type
-
-    def __repr__(self):
-        return f"<Token {self.type} '{self.value}' at {self.line}:{self.column}>"
-
-
-class Tokenizer:
-    def __init__(self, source):
-        self.source = source
-        self.pos = 0
-        self.line = 1
-        self.column = 0
-        self.tokens = []
-
-    def tokenize(self):
-
-        while self.pos < len(self.source) -1:
-            self.tokenize_next()
-
-        # Add extra newline token for parsing reasons
-        self.tokens.append(Token("ln",self.line,self.column,TokenType.NL))
-        # Add EOF token
-        self.tokens.append(Token("eof", self.line, self.column, TokenType.EOF))
-        return self.tokens
-
-    # It peeks char
-    def peek(self, offset=0):
-        pos = self.pos + offset
-        if pos >= len(self.source):
-            return None
-        return self.source[pos]
-
-    #Increases position after taking the token
-    def advance(self):
-        char = self.source[self.pos]
-        self.pos += 1
-        self.column += 1
-
-        if char == '\n':
-            self.line += 1
-            self.column = 0
-
-        return char
-
-    def tokenize_next(self):
-        char = self.peek()
-
-        # Skip whitespace except newlines
-        if char in ' \t':
-            self.tokens.append(Token(char, self.line, self.column, TokenType.SPACE))
-            while char in ' \t':
-                self.advance()
-                char = self.peek()
-            return
-
-        # Handle newlines
-        if char == '\n':
-            self.tokens.append(Token(char, self.line, self.column, TokenType.NL))
-            self.advance()
-            return
-
-        # Handle comments
-        if char == '#':
-            self.tokenize_comment()
-            return
-
-        # Handle identifiers and keywords
-        if char.isalpha() or char == '_':
-            self.tokenize_identifier()
-            return
-
-        # Handle numbers
-        if char.isdigit():
-            self.tokenize_number()
-            return
-
-        # Handle strings
-        if char == '"':
-
-            self.tokenize_string()
-            return
-
-        # Handle delimiters
-        if self.is_delimiter(char):
-            self.tokenize_delimiter()
-            return
-
-        # If we get here, we have an unrecognized character
-        raise SyntaxError(f"Unrecognized character '{char}' at line {self.line}, column {self.column}")
-
-    # Comments are not added to token stream
-    def tokenize_comment(self):
-        self.advance()
-
-        while True:
-            if self.peek() in '\r\n':
-                return
-            self.advance()
-
-
-
-    def tokenize_identifier(self):
-
-        start_pos = self.pos
-        start_line = self.line
-        start_column = self.column
-
-        # Read all alphanumeric characters
-        while self.peek() is not None and (self.peek().isalnum() or self.peek() == '_'):
-            self.advance()
-
-        # Extract the identifier
-        identifier = self.source[start_pos:self.pos]
-
-        # Check if it's a keyword
-        token_type = self.get_keyword_type(identifier)
-        if token_type:
-            self.tokens.append(Token(identifier, start_line, start_column, token_type))
-        else:
-            self.tokens.append(Token(identifier, start_line, start_column, TokenType.ALPHANUM))
-
-    def tokenize_number(self):
-        start_pos = self.pos
-        start_line = self.line
-        start_column = self.column
-
-        # Read all digits
-        while self.peek() is not None and self.peek().isdigit():
-            self.advance()
-
-        # Check for 'ms' suffix
-        if self.peek() == 'm' and self.peek(1) == 's':
-            self.advance()  # Skip 'm'
-            self.advance()  # Skip 's'
-
-        # Extract the number
-        number = self.source[start_pos:self.pos]
-        self.tokens.append(Token(number, start_line, start_column, TokenType.NUM))
-
-    def tokenize_string(self):
-
-        start_pos = self.pos
-        start_line = self.line
-        start_column = self.column
-
-        self.advance()  # Skip opening quote
-
-        # i don't understand this
-        escaped = False
-        while self.peek() is not None:
-            if self.peek() == '\\':
-                escaped = True
-                self.advance()
-                continue
-
-            if self.peek() == '"' and not escaped:
-                self.advance()  # Skip closing quote
-                break
-
-            escaped = False
-            self.advance()
-
-        # Extract the string including quotes
-        string = self.source[start_pos:self.pos]
-        self.tokens.append(Token(string, start_line, start_column, TokenType.STRING))
-
-    def tokenize_delimiter(self):
-        char = self.peek()
-        token_type = None
-
-        if char == '{':
-            token_type = TokenType.OPEN_BRACE
-        elif char == '}':
-            token_type = TokenType.CLOSE_BRACE
-        elif char == '(':
-            token_type = TokenType.OPEN_PAREN
-        elif char == ')':
-            token_type = TokenType.CLOSE_PAREN
-        elif char == '[':
-            token_type = TokenType.OPEN_BRACKET
-        elif char == ']':
-            token_type = TokenType.CLOSE_BRACKET
-        elif char == ':':
-            token_type = TokenType.COLON
-        elif char == '"':
-            token_type = TokenType.DOUBLE_QUOTE
-        elif char == ',':
-            token_type = TokenType.COMMA
-        elif char == '|':
-            token_type = TokenType.PIPE
-        elif char == '/':
-            token_type = TokenType.SLASH
-        elif char == '!':
-            token_type = TokenType.BANG
-        elif char == '=':
-            token_type = TokenType.EQUAL
-        elif char == "'":
-            token_type = TokenType.SINGLE_QUOTE
-        elif char == '.':
-            token_type = TokenType.DOT
-        elif char == '-':
-            token_type = TokenType.DASH
-        elif char == '>':
-            token_type = TokenType.GREATER_THAN
-        elif char == '<':
-            token_type = TokenType.LESS_THAN
-        elif char == '^':
-            token_type = TokenType.CARROT
-        elif char == '*':
-            token_type = TokenType.ASTERISK
-        elif char == ';':
-            token_type = TokenType.SEMICOLON
-        elif char == '+':
-            token_type = TokenType.PLUS
-
-        self.tokens.append(Token(char, self.line, self.column, token_type))
-        self.advance()
-
-    def is_delimiter(self, char):
-        return char in "{}()[]:\",/='.-><*;+|!^"
-
-    def get_keyword_type(self, word):
-        keywords = {
-            "title": TokenType.KW_TITLE,
-            "copy_right": TokenType.KW_CR,
-            "r": TokenType.KW_R,
-            "track": TokenType.KW_TRACK,
-            "do":TokenType.do ,
-            "re":TokenType.re ,
-            "mi":TokenType.mi ,
-            "fa":TokenType.fa ,
-            "sol":TokenType.sol ,
-            "la":TokenType.la ,
-            "si":TokenType.si ,
-            "vol":TokenType.V,
-            "v":TokenType.V,
-            "volume":TokenType.V,
-        }
-        return keywords.get(word)
+import re
+import mmap
+from array import array
+
+# token types are small ints so the parser can index tables with them, their
+# names are in TOKEN_NAMES for printing
+class TokenType:
+    OPEN_BRACE = 0
+    CLOSE_BRACE = 1
+    OPEN_PAREN = 2
+    CLOSE_PAREN = 3
+    OPEN_BRACKET = 4
+    CLOSE_BRACKET = 5
+    COLON = 6
+    DOUBLE_QUOTE = 7
+    COMMA = 8
+    PIPE = 9
+    SLASH = 10
+    BANG = 11
+    EQUAL = 12
+    NL = 13
+    SINGLE_QUOTE = 14
+    DOT = 15
+    DASH = 16
+    PLUS = 17
+    GREATER_THAN = 18
+    LESS_THAN = 19
+    CARROT = 20
+    ASTERISK = 21
+    SEMICOLON = 22
+    SPACE = 23
+
+    # Literals
+    ALPHANUM = 24
+    NUM = 25
+    STRING = 26
+
+    # Keywords
+    KW_MACRO = 27
+    KW_TRACK = 28
+    KW_TITLE = 29
+    KW_CR = 30
+    KW_R = 31
+    V = 32 # volume
+
+    EOF = 33
+
+    # notes
+    do = 34
+    re = 35
+    mi = 36
+    fa = 37
+    sol = 38
+    la = 39
+    si = 40
+
+
+TOKEN_NAMES = {
+    TokenType.OPEN_BRACE: "OPEN_BRACE",
+    TokenType.CLOSE_BRACE: "CLOSE_BRACE",
+    TokenType.OPEN_PAREN: "OPEN_PAREN",
+    TokenType.CLOSE_PAREN: "CLOSE_PAREN",
+    TokenType.OPEN_BRACKET: "OPEN_BRACKET",
+    TokenType.CLOSE_BRACKET: "CLOSE_BRACKET",
+    TokenType.COLON: "COLON",
+    TokenType.DOUBLE_QUOTE: "DOUBLE_QUOTE",
+    TokenType.COMMA: "COMMA",
+    TokenType.PIPE: "PIPE",
+    TokenType.SLASH: "SLASH",
+    TokenType.BANG: "BANG",
+    TokenType.EQUAL: "EQUAL",
+    TokenType.NL: "NL",
+    TokenType.SINGLE_QUOTE: "SINGLE_QUOTE",
+    TokenType.DOT: "DOT",
+    TokenType.DASH: "DASH",
+    TokenType.PLUS: "PLUS",
+    TokenType.GREATER_THAN: "GREATER_THAN",
+    TokenType.LESS_THAN: "LESS_THAN",
+    TokenType.CARROT: "CARROT",
+    TokenType.ASTERISK: "ASTERISK",
+    TokenType.SEMICOLON: "SEMICOLON",
+    TokenType.SPACE: "SPACE",
+    TokenType.ALPHANUM: "ALPHANUM",
+    TokenType.NUM: "NUM",
+    TokenType.STRING: "STRING",
+    TokenType.KW_MACRO: "KW_MACRO",
+    TokenType.KW_TRACK: "TRACK",
+    TokenType.KW_TITLE: "KW_TITLE",
+    TokenType.KW_CR: "KW_CR",
+    TokenType.KW_R: "KW_R",
+    TokenType.V: "V",
+    TokenType.EOF: "EOF",
+    TokenType.do: "do",
+    TokenType.re: "re",
+    TokenType.mi: "mi",
+    TokenType.fa: "fa",
+    TokenType.sol: "sol",
+    TokenType.la: "la",
+    TokenType.si: "si",
+}
+
+
+class Token:
+    __slots__ = ("value", "line", "column", "type")
+
+    def __init__(self, value, line, column, token_type):
+        self.value = value
+        self.line = line
+        self.column = column
+        self.type = token_type
+
+    def __repr__(self):
+        return f"<Token {TOKEN_NAMES[self.type]} '{self.value}' at {self.line}:{self.column}>"
+
+
+# A character that can't start any token, the compile server and batch turn it
+# into a Diagnostic with its position
+class UnrecognizedCharacter(SyntaxError):
+    def __init__(self, char, line, column):
+        super().__init__(f"Unrecognized character '{char}' at line {line}, column {column}")
+        self.char = char
+        self.line = line
+        self.column = column
+
+    # exceptions are pickled with their args, a worker process can raise it
+    def __reduce__(self):
+        return UnrecognizedCharacter, (self.char, self.line, self.column)
+
+
+# Struct of arrays token store, one entry is 17 bytes instead of a Token
+# object plus a str for its value. Indexing it gives back normal Token
+# objects (built on access, the value is sliced from the source) so it can be
+# handed to the Parser like the token list.
+class TokenBuffer:
+    def __init__(self, source):
+        self.source = source
+        self.types = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.lines = array("I")
+        self.columns = array("I")
+        self.last = (-1, None) # (index, token) of the last token built
+
+    def append(self, token_type, start, end, line, column):
+        self.types.append(token_type)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+        self.columns.append(column)
+
+    # the extra NL and EOF tokens at the end don't come from the source, they
+    # are stored as empty ranges and get their value in token()
+    def append_end(self, line, column):
+        end = len(self.source)
+        self.append(TokenType.NL, end, end, line, column)
+        self.append(TokenType.EOF, end, end, line, column)
+
+    def __len__(self):
+        return len(self.types)
+
+    def type_at(self, index):
+        return self.types[index]
+
+    def value_at(self, index):
+        start = self.starts[index]
+        end = self.ends[index]
+        if start == end:
+            return "eof" if self.types[index] == TokenType.EOF else "ln"
+        return self.source[start:end]
+
+    def token(self, index):
+        if index < 0:
+            index += len(self.types)
+
+        # the parser peeks the same token a lot, keep the last one around
+        last_index, last_token = self.last
+        if index == last_index:
+            return last_token
+
+        token = Token(self.value_at(index), self.lines[index], self.columns[index], self.types[index])
+        self.last = (index, token)
+        return token
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.token(i) for i in range(*index.indices(len(self.types)))]
+        if index >= len(self.types) or index < -len(self.types):
+            raise IndexError("token buffer index out of range")
+        return self.token(index)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self.token(index)
+
+
+# keyword table, built once instead of on every identifier
+KEYWORDS = {
+    "title": TokenType.KW_TITLE,
+    "copy_right": TokenType.KW_CR,
+    "r": TokenType.KW_R,
+    "track": TokenType.KW_TRACK,
+    "do":TokenType.do ,
+    "re":TokenType.re ,
+    "mi":TokenType.mi ,
+    "fa":TokenType.fa ,
+    "sol":TokenType.sol ,
+    "la":TokenType.la ,
+    "si":TokenType.si ,
+    "vol":TokenType.V,
+    "v":TokenType.V,
+    "volume":TokenType.V,
+}
+
+# single character delimiters
+DELIMITERS = {
+    '{': TokenType.OPEN_BRACE,
+    '}': TokenType.CLOSE_BRACE,
+    '(': TokenType.OPEN_PAREN,
+    ')': TokenType.CLOSE_PAREN,
+    '[': TokenType.OPEN_BRACKET,
+    ']': TokenType.CLOSE_BRACKET,
+    ':': TokenType.COLON,
+    '"': TokenType.DOUBLE_QUOTE,
+    ',': TokenType.COMMA,
+    '|': TokenType.PIPE,
+    '/': TokenType.SLASH,
+    '!': TokenType.BANG,
+    '=': TokenType.EQUAL,
+    "'": TokenType.SINGLE_QUOTE,
+    '.': TokenType.DOT,
+    '-': TokenType.DASH,
+    '>': TokenType.GREATER_THAN,
+    '<': TokenType.LESS_THAN,
+    '^': TokenType.CARROT,
+    '*': TokenType.ASTERISK,
+    ';': TokenType.SEMICOLON,
+    '+': TokenType.PLUS,
+}
+
+
+# kinds of the master regex, in the order of its groups (match.lastindex)
+SCAN_SPACE = 1
+SCAN_NL = 2
+SCAN_COMMENT = 3
+SCAN_IDENT = 4
+SCAN_NUM = 5
+SCAN_STRING = 6
+SCAN_DELIM = 7
+
+# one compiled regex for the whole language, the character classes are ascii
+# only, everything else goes through Tokenizer.scan_unicode
+MASTER_PATTERN = r"""
+    ([ \t]+)                                   # SPACE
+  | (%s)                                       # NL
+  | (\#[^\r\n]*)                               # comment
+  | ([A-Za-z_]\w*)                             # identifier or keyword
+  | ([0-9]+(?:ms)?)                            # number, optional ms suffix
+  | ("(?:[^"\\]|\\+[^\\])*(?:"|\\*\Z))          # string, with the quotes
+  | ([{}()\[\]:,/='.\-><*;+|!^])               # delimiter
+"""
+MASTER_RE = re.compile(MASTER_PATTERN % r"\n", re.VERBOSE)
+
+# memory mapped sources are scanned as bytes, without the newline
+# translation that reading in text mode does
+MASTER_BYTES_RE = re.compile((MASTER_PATTERN % r"\r\n?|\n").encode("ascii"), re.VERBOSE)
+KEYWORD_BYTES = {word.encode("ascii"): token_type for word, token_type in KEYWORDS.items()}
+DELIMITER_CODES = {ord(char): token_type for char, token_type in DELIMITERS.items()}
+
+WORD_RE = re.compile(r"\w*")
+
+
+# Token positions of the structural parts of a file, built by the Tokenizer
+# while it scans so the parser (and tools) never have to walk the tokens to
+# find them. Only statements at the start of a line and outside of [...]
+# groups count. When the tokens are streamed the index fills up as the
+# parser pulls tokens, complete is set once the whole source was scanned.
+class TokenIndex:
+    def __init__(self):
+        self.tracks = [] # track keywords
+        self.titles = [] # title keywords
+        self.macros = [] # names of macro definitions
+        self.brackets = {} # open bracket -> matching close bracket
+        self.open_brackets = [] # open brackets not closed (yet)
+        self.complete = False
+
+    def has_track(self):
+        return len(self.tracks) > 0
+
+    def matching_bracket(self, pos):
+        return self.brackets.get(pos)
+
+
+# Table driven scanner, one regex match per token instead of one
+# peek()/advance() pair per character
+class Tokenizer:
+    def __init__(self, source):
+        self.source = source
+        self.pos = 0
+        self.line = 1
+        self.column = 0
+        self.tokens = []
+        self.index = TokenIndex()
+
+    def tokenize(self):
+        self.tokens.extend(self.iter_tokens())
+        return self.tokens
+
+    # Generator mode, yields the same tokens as tokenize() one at a time so
+    # the parser can start before the whole file is scanned (see TokenStream)
+    def iter_tokens(self):
+        source = self.source
+        for token_type, start, end, line, column in self.scan():
+            yield Token(source[start:end], line, column, token_type)
+
+        # Add extra newline token for parsing reasons
+        yield Token("ln", self.line, self.column, TokenType.NL)
+        # Add EOF token
+        yield Token("eof", self.line, self.column, TokenType.EOF)
+
+    # Compact mode, same token stream stored as a TokenBuffer
+    def tokenize_compact(self):
+        buffer = TokenBuffer(self.source)
+        append = buffer.append
+        for token_type, start, end, line, column in self.scan():
+            append(token_type, start, end, line, column)
+
+        buffer.append_end(self.line, self.column)
+        return buffer
+
+    # The scanner itself, yields (type, start, end, line, column) for every
+    # token of the source, the value of the token is source[start:end]
+    def scan(self):
+        source = self.source
+        if isinstance(source, MappedSource):
+            data = source.map
+            match = MASTER_BYTES_RE.match
+            keywords = KEYWORD_BYTES
+            delimiters = DELIMITER_CODES
+            newline = b"\n"
+            cr = b"\r" # a lone \r is a newline too, like in text mode
+            # a \r\n at the end is the trailing newline, skip both chars
+            last = len(data) - (2 if data[-2:] == b"\r\n" else 1)
+        else:
+            data = source
+            match = MASTER_RE.match
+            keywords = KEYWORDS
+            delimiters = DELIMITERS
+            newline = "\n"
+            cr = None
+            # the last character of the source is never the start of a token
+            # (it's the trailing newline), same as the char-by-char tokenizer
+            last = len(source) - 1
+
+        pos = self.pos
+        line = self.line
+        line_start = pos - self.column
+
+        # structural index, filled as tokens go by (see TokenIndex)
+        index = self.index
+        open_brackets = index.open_brackets
+        count = 0 # position of the next token
+        line_head = True # nothing but spaces yet on this line
+        head = -1 # identifier starting the current line, maybe a macro name
+
+        while pos < last:
+            m = match(data, pos)
+
+            if m is None:
+                kind, end = self.scan_unicode(pos, line, pos - line_start)
+            else:
+                kind = m.lastindex
+                end = m.end()
+
+            if kind == SCAN_DELIM:
+                token_type = delimiters[data[pos]]
+                if token_type == TokenType.OPEN_BRACKET:
+                    open_brackets.append(count)
+                elif token_type == TokenType.CLOSE_BRACKET:
+                    if open_brackets:
+                        index.brackets[open_brackets.pop()] = count
+                elif head >= 0 and (token_type == TokenType.EQUAL or token_type == TokenType.OPEN_PAREN):
+                    index.macros.append(head)
+                head = -1
+                line_head = False
+
+                yield token_type, pos, end, line, pos - line_start
+                count += 1
+            elif kind == SCAN_IDENT:
+                token_type = keywords.get(data[pos:end], TokenType.ALPHANUM)
+                head = -1
+                if line_head and not open_brackets:
+                    if token_type == TokenType.ALPHANUM:
+                        head = count
+                    elif token_type == TokenType.KW_TRACK:
+                        index.tracks.append(count)
+                    elif token_type == TokenType.KW_TITLE:
+                        index.titles.append(count)
+                line_head = False
+
+                yield token_type, pos, end, line, pos - line_start
+                count += 1
+            elif kind == SCAN_SPACE:
+                # a run of spaces is one token, its value is the first char
+                yield TokenType.SPACE, pos, pos + 1, line, pos - line_start
+                count += 1
+            elif kind == SCAN_NL:
+                head = -1
+                line_head = True
+
+                # the value is just the \n, even when it's a \r\n (a lone \r
+                # reads as \n)
+                yield TokenType.NL, end - 1, end, line, pos - line_start
+                count += 1
+                line += 1
+                line_start = end
+            elif kind == SCAN_NUM:
+                head = -1
+                line_head = False
+
+                end = self.scan_digits(end)
+                yield TokenType.NUM, pos, end, line, pos - line_start
+                count += 1
+            elif kind == SCAN_STRING:
+                head = -1
+                line_head = False
+
+                yield TokenType.STRING, pos, end, line, pos - line_start
+                count += 1
+                # strings can span over multiple lines
+                string = data[pos:end]
+                newlines = string.count(newline)
+                last_newline = string.rfind(newline)
+                if cr is not None and cr in string:
+                    newlines += string.count(cr) - string.count(cr + newline)
+                    last_newline = max(last_newline, string.rfind(cr))
+                if newlines:
+                    line += newlines
+                    line_start = pos + last_newline + 1
+            # comments are not added to token stream
+
+            pos = end
+
+        self.pos = pos
+        self.line = line
+        self.column = pos - line_start
+        index.complete = True
+
+    # numbers followed by non ascii digits, the regex only knows about 0-9
+    def scan_digits(self, end):
+        source = self.source
+        if not isinstance(source, str) or end >= len(source) or source[end] < '\x80' or source[end - 1] == 's':
+            return end
+
+        while end < len(source) and source[end].isdigit():
+            end += 1
+
+        if source[end:end + 2] == 'ms':
+            end += 2
+        return end
+
+    # slow path for characters outside the ascii tables
+    def scan_unicode(self, pos, line, column):
+        source = self.source
+        char = source[pos]
+
+        if char.isalpha():
+            return SCAN_IDENT, WORD_RE.match(source, pos + 1).end()
+
+        if char.isdigit():
+            end = pos
+            while end < len(source) and source[end].isdigit():
+                end += 1
+            if source[end:end + 2] == 'ms':
+                end += 2
+            return SCAN_NUM, end
+
+        raise UnrecognizedCharacter(char, line, column)
+
+
+# Read only memory map of a source file, for big generated scores. The
+# tokenizer scans the mapped bytes directly and tokens only keep offsets into
+# the map (see Tokenizer.tokenize_compact), text is decoded when a token's
+# value is actually needed. Slicing it gives str, like slicing the source.
+class MappedSource:
+    def __init__(self, file_name):
+        with open(file_name, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.map)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # same newlines as reading the file in text mode
+            return self.map[index].decode("ascii").replace("\r\n", "\n").replace("\r", "\n")
+        return chr(self.map[index])
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Returns the source of a file, memory mapped if asked to. Only pure ascii
+# files are mapped so that columns (which count characters) stay the same,
+# anything else (and empty files, which can't be mapped) is read as text.
+def load_source(file_name, mapped=False):
+    if mapped:
+        try:
+            source = MappedSource(file_name)
+        except ValueError:
+            source = None
+
+        if source is not None:
+            if re.search(rb"[^\x00-\x7f]", source.map) is None:
+                return source
+            source.close()
+
+    with open(file_name) as f:
+        return f.read()
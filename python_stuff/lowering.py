@@ -0,0 +1,289 @@
+# Lowering of the movements to note arrays, between the resolved ast and the
+# event table
+#
+# Every note of a movement is resolved to its midi pitch, start tick, length
+# in ticks and velocity, kept in one NumPy array per field. The expressions
+# are walked once with the loops unrolled. Plain notes are gathered in runs
+# and resolved together, a run ends where the state the notes depend on
+# changes (octave, semitones, default duration, volume).
+#
+# Times are whole numbers of ticks. Every duration of the program is turned
+# into ticks once, with exact fractions, at a resolution where all of them
+# are whole (see ticks_per_quarter_for), so there is no rounding and the
+# start of a note is the sum of the ticks of the notes before it.
+import fractions
+from math import lcm
+from numeric import np
+from ast import *
+from midi_ir import TICKS_PER_QUARTER
+
+# the header of a midi file has 15 bits for the ticks per quarter note
+MAX_TICKS_PER_QUARTER = 0x7fff
+# pitches and velocities are data bytes, 7 bits
+MAX_DATA = 127
+
+class gen_state:
+    def __init__(self):
+        self.oct = 4
+        self.tempo = 60
+        self.meas = (4,4)
+        self.counter = 0
+        self.dur = 1
+        self.track = 0
+        self.channel = 0
+        self.volume = 100
+
+        self.semitone_dict = {
+            'r': 0,
+            'c': 0, 'do': 0,
+            'd': 0, 're': 0,
+            'e': 0, 'mi': 0,
+            'f': 0, 'fa': 0,
+            'g': 0, 'sol':0,
+            'a': 0, 'la': 0,
+            'b': 0, 'si': 0
+        }
+
+        self.time = 0
+
+        pass
+
+note_to_midi = {
+    'r':0, #rest is just a silent note
+    'c': 0, 'do': 0,
+    'd': 2, 're': 2,
+    'e': 4, 'mi': 4,
+    'f': 5, 'fa': 5,
+    'g': 7, 'sol': 7,
+    'a': 9, 'la': 9,
+    'b': 11, 'si': 11
+}
+
+# notes are numbered in the runs, NOTE_PITCHES[i] is the pitch of note i
+NOTE_NAMES = list(note_to_midi)
+NOTE_INDEX = {name: i for i, name in enumerate(NOTE_NAMES)}
+NOTE_PITCHES = np.array([note_to_midi[name] for name in NOTE_NAMES])
+REST = NOTE_INDEX['r']
+
+# the next expression of the notes of a chord but the last, they all start
+# together like note 0 note 0 ...
+CHORD_INTERVAL = SetInterval(Token("0",0,0,TokenType.NUM))
+
+# exact length of a duration of the ast in quarter notes, None for the
+# default duration (-1)
+def quarters(duration):
+    if isinstance(duration,Fraction):
+        return fractions.Fraction(duration.x) / fractions.Fraction(duration.over) * 4
+    elif isinstance(duration,(int,float)):
+        if duration == -1:
+            return None
+        # durations written x/over are Fractions, floats are whole numbers
+        return fractions.Fraction(duration).limit_denominator(1 << 16) * 4
+    raise ValueError(f"duration should be numeric, {duration} is {type(duration)} instead")
+
+# Smallest multiple of TICKS_PER_QUARTER where every duration of the program
+# is a whole number of ticks (only tuplets that don't divide 960 make it
+# bigger). If that doesn't fit in a midi file, TICKS_PER_QUARTER and the
+# durations are rounded to the nearest tick.
+def ticks_per_quarter_for(ast):
+    denominators = set()
+    for track in ast.tracks:
+        for movement in track.movements:
+            stack = list(movement.expressions)
+            while stack:
+                expr = stack.pop()
+                if isinstance(expr,Note):
+                    length = quarters(expr.duration)
+                    if length is not None:
+                        denominators.add(length.denominator)
+                elif isinstance(expr,SetDuration):
+                    denominators.add(quarters(expr.dur).denominator)
+                elif isinstance(expr,Chord):
+                    stack.extend(expr.notes)
+                elif isinstance(expr,(Loop,ExprGroup)):
+                    stack.extend(expr.exprs)
+
+    ticks = lcm(TICKS_PER_QUARTER, *denominators)
+    return ticks if ticks <= MAX_TICKS_PER_QUARTER else TICKS_PER_QUARTER
+
+def with_next(events):
+    events = iter(events)
+    event = next(events, None)
+    while event is not None:
+        next_event = next(events, None)
+        yield event, event if next_event is None else next_event
+        event = next_event
+
+
+class LoweredMovement:
+    def __init__(self, ticks_per_quarter=TICKS_PER_QUARTER):
+        self.ticks_per_quarter = ticks_per_quarter
+        self.pitches = np.zeros(0, np.int32)
+        self.starts = np.zeros(0, np.int64)     # ticks
+        self.durations = np.zeros(0, np.int64)  # ticks
+        self.velocities = np.zeros(0, np.int32)
+        self.deltas = np.zeros(0, np.int64)     # ticks from the start of a note to the next one
+        # for every bar: the number of notes before it, the measure (x, over)
+        # it is in and its token
+        self.bar_ends = np.zeros(0, np.int64)
+        self.bar_measures = np.zeros((0, 2), np.int64)
+        self.bar_sources = []
+        # pitches and volumes out of the midi range, the movement can't be
+        # written
+        self.errors = []
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def __repr__(self):
+        return f"LoweredMovement({len(self)} notes, {len(self.bar_sources)} bars)"
+
+
+# The plain notes since the last state change, as they are in the ast with
+# their durations in ticks
+class NoteRun:
+    def __init__(self, ticks):
+        self.ticks = ticks # converts the durations to ticks
+        self.names = []
+        self.sources = []
+        self.semitones = []
+        self.octaves = []
+        self.durations = [] # -1 for the default duration
+        self.intervals = [] # ticks to the next note, -1 to wait for the note to end
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, note, next_event):
+        self.names.append(NOTE_INDEX[note.value.value.lower()])
+        self.sources.append(note.value)
+        self.semitones.append(note.semitone)
+        self.octaves.append(note.octave)
+        self.durations.append(self.ticks.of(note.duration))
+
+        if isinstance(next_event, SetInterval):
+            self.intervals.append(int(next_event.time.value) * self.ticks.per_quarter)
+        else:
+            self.intervals.append(-1)
+
+    # pitch, duration, velocity and delta arrays of the notes with the
+    # current state, notes out of the midi range are added to errors
+    def resolve(self, state, errors):
+        names = np.array(self.names, np.intp)
+        semitones = np.array(self.semitones)
+        octaves = np.array(self.octaves)
+        state_semitones = np.array([state.semitone_dict[name] for name in NOTE_NAMES])
+
+        pitches = NOTE_PITCHES[names] \
+                + np.where(semitones == 0, state_semitones[names], semitones) \
+                + 12 * np.where(octaves == -1, state.oct, octaves)
+        outside = (pitches < 0) | (pitches > MAX_DATA)
+        if outside.any():
+            for i in np.flatnonzero(outside & (names != REST)).tolist():
+                source = self.sources[i]
+                errors.append(Diagnostic.at(Code.PITCH_RANGE, source, source.value, int(pitches[i])))
+            pitches = np.clip(pitches, 0, MAX_DATA) # rests only need a valid byte
+
+        durations = np.array(self.durations, np.int64)
+        durations = np.where(durations == -1, state.dur, durations)
+
+        velocities = np.where(names == REST, 0, state.volume) # rests are silent notes
+
+        intervals = np.array(self.intervals, np.int64)
+        deltas = np.where(intervals == -1, durations, intervals)
+
+        return pitches, durations, velocities, deltas
+
+# durations of the ast to ticks, each different one is converted once
+class Ticks:
+    def __init__(self, per_quarter):
+        self.per_quarter = per_quarter
+        self.cache = {}
+
+    # -1 stays -1 (the default duration)
+    def of(self, duration):
+        key = (duration.x, duration.over) if isinstance(duration, Fraction) else duration
+        ticks = self.cache.get(key)
+        if ticks is None:
+            length = quarters(duration)
+            ticks = -1 if length is None else round(length * self.per_quarter)
+            self.cache[key] = ticks
+        return ticks
+
+
+# Returns the LoweredMovement of a movement with its macros and groups
+# resolved
+def lower_movement(movement, ticks_per_quarter=TICKS_PER_QUARTER):
+    state = gen_state()
+    ticks = Ticks(ticks_per_quarter)
+    state.dur = ticks.of(state.dur)
+    lowered = LoweredMovement(ticks_per_quarter)
+    run = NoteRun(ticks)
+    chunks = [] # resolved runs
+    resolved = 0 # notes in the chunks
+    bar_ends = []
+    bar_measures = []
+
+    for event,next_event in with_next(unroll(movement.expressions)):
+        if isinstance(event, Note):
+            run.add(event,next_event)
+
+        elif isinstance(event,Chord):
+            for note_e in event.notes[:-1]:
+                run.add(note_e,CHORD_INTERVAL)
+            run.add(event.notes[-1],next_event)
+
+        elif isinstance(event,SetInterval):
+            # the note before it already used it
+            pass
+
+        elif isinstance(event,Bar):
+            bar_ends.append(resolved + len(run))
+            bar_measures.append(state.meas)
+            lowered.bar_sources.append(event.source)
+
+        elif isinstance(event,SetMeasure):
+            state.meas = (int(event.x),int(event.over))
+        elif isinstance(event,SetTempo):
+            state.tempo = event.n
+
+        elif isinstance(event,(SetTone,SetVolume,SetOctave,SetDuration)):
+            # the notes before were played with the old state
+            if len(run):
+                resolved += len(run)
+                chunks.append(run.resolve(state, lowered.errors))
+                run = NoteRun(ticks)
+
+            if isinstance(event,SetTone):
+                state.semitone_dict[event.note.value.lower()] += int(event.n)
+            elif isinstance(event,SetVolume):
+                if not 0 <= event.vol <= MAX_DATA:
+                    lowered.errors.append(Diagnostic.at(Code.VOLUME_RANGE, event.source, event.vol))
+                state.volume = event.vol
+            elif isinstance(event,SetOctave):
+                state.oct += event.n * event.dir
+            else:
+                state.dur = ticks.of(event.dur)
+
+        elif isinstance(event, errExpr):
+            pass
+        else:
+            raise ValueError(f"	Unhandled event type in movement:{event}")
+
+    if len(run):
+        chunks.append(run.resolve(state, lowered.errors))
+    if bar_ends:
+        lowered.bar_ends = np.array(bar_ends, np.int64)
+        lowered.bar_measures = np.array(bar_measures, np.int64)
+    if not chunks:
+        return lowered
+
+    pitches, durations, velocities, deltas = (np.concatenate(column) for column in zip(*chunks))
+
+    lowered.pitches = pitches.astype(np.int32)
+    # the first note starts at 0, every other one delta after the one before
+    lowered.starts = np.concatenate(([0], np.cumsum(deltas)[:-1])).astype(np.int64)
+    lowered.durations = durations
+    lowered.velocities = velocities.astype(np.int32)
+    lowered.deltas = deltas
+    return lowered
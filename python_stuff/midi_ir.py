@@ -0,0 +1,150 @@
+# Flat event table between the AST and the midi file, see grammar/midi_ir.md
+#
+# Every event is a row (tick, track, channel, kind, data1, data2), stored in
+# one array per column. Ticks are absolute, the table is kept sorted by time
+# so serializers, analyzers and previews can read it front to back.
+from array import array
+from numeric import np
+
+TICKS_PER_QUARTER = 960 # same default as midiutil
+
+class EventKind:
+    # events on the same tick are ordered by kind, note offs before note ons
+    TRACK_NAME = 0      # data1: index in EventTable.texts
+    TEMPO = 1           # data1: microseconds per quarter note
+    PROGRAM_CHANGE = 2  # data1: program
+    NOTE_OFF = 3        # data1: pitch, data2: velocity
+    NOTE_ON = 4         # data1: pitch, data2: velocity
+
+KIND_NAMES = {value: name for name, value in vars(EventKind).items() if not name.startswith("_")}
+
+class EventTable:
+    def __init__(self, ticks_per_quarter=TICKS_PER_QUARTER):
+        self.ticks_per_quarter = ticks_per_quarter
+        self.ticks = array('I')
+        self.tracks = array('H')
+        self.channels = array('B')
+        self.kinds = array('B')
+        self.data1 = array('I')
+        self.data2 = array('H')
+        self.texts = [] # strings of the meta events
+
+    def add(self, tick, track, channel, kind, data1=0, data2=0):
+        self.ticks.append(tick)
+        self.tracks.append(track)
+        self.channels.append(channel)
+        self.kinds.append(kind)
+        self.data1.append(data1)
+        self.data2.append(data2)
+
+    def add_text(self, tick, track, kind, text):
+        self.add(tick, track, 0, kind, len(self.texts))
+        self.texts.append(text)
+
+    def add_note(self, tick, duration, track, channel, pitch, velocity):
+        self.add(tick, track, channel, EventKind.NOTE_ON, pitch, velocity)
+        self.add(tick + duration, track, channel, EventKind.NOTE_OFF, pitch, velocity)
+
+    # a note on and a note off for every note of the arrays, the note offs
+    # come after all the note ons, sort() puts them in place
+    def add_notes(self, starts, durations, track, channel, pitches, velocities):
+        n = len(starts)
+        ends = np.asarray(starts) + np.asarray(durations)
+        self.extend_column(self.ticks, np.concatenate((starts, ends)))
+        self.extend_column(self.tracks, np.full(2 * n, track))
+        self.extend_column(self.channels, np.full(2 * n, channel))
+        self.extend_column(self.kinds, np.repeat([EventKind.NOTE_ON, EventKind.NOTE_OFF], n))
+        self.extend_column(self.data1, np.concatenate((pitches, pitches)))
+        self.extend_column(self.data2, np.concatenate((velocities, velocities)))
+
+    @staticmethod
+    def extend_column(column, values):
+        column.frombytes(np.asarray(values, dtype=column.typecode).tobytes())
+
+    # appends the events of other, channel_map[c] is the new channel of the
+    # events on channel c
+    def extend(self, other, channel_map=None):
+        texts = len(self.texts)
+        self.ticks.extend(other.ticks)
+        self.tracks.extend(other.tracks)
+        self.kinds.extend(other.kinds)
+        self.data2.extend(other.data2)
+        self.data1.extend(data1 + texts if kind == EventKind.TRACK_NAME else data1
+                          for kind, data1 in zip(other.kinds, other.data1))
+        if channel_map is None:
+            self.channels.extend(other.channels)
+        else:
+            self.channels.extend(channel if kind <= EventKind.TEMPO else channel_map[channel]
+                                 for kind, channel in zip(other.kinds, other.channels))
+        self.texts.extend(other.texts)
+
+    # stable, so events of the same kind on the same tick keep the order
+    # they were added in
+    def sort(self):
+        keys = list(zip(self.ticks, self.tracks, self.kinds))
+        self.select(sorted(range(len(keys)), key=keys.__getitem__))
+
+    # keeps only the rows at the given indexes, in that order
+    def select(self, rows):
+        for name in ("ticks", "tracks", "channels", "kinds", "data1", "data2"):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[i] for i in rows]))
+
+    # Drops notes started twice on the same tick, and ends a note early when
+    # its pitch is played again on the same channel before it ended, like
+    # midiutil does when writing. A midi note off can't tell which of two
+    # notes of the same pitch it ends. The table must be sorted.
+    def remove_overlaps(self):
+        ticks, kinds, pitches = self.ticks, self.kinds, self.data1
+        rows = []
+        seen = set()
+        playing = {} # (track, channel, pitch) -> ticks of the notes started
+        moved = False
+        for i, (tick, track, channel, kind) in enumerate(zip(ticks, self.tracks, self.channels, kinds)):
+            if kind != EventKind.NOTE_ON and kind != EventKind.NOTE_OFF:
+                rows.append(i)
+                continue
+
+            key = (track, channel, pitches[i])
+            if (tick, kind, key) in seen:
+                continue
+            seen.add((tick, kind, key))
+
+            starts = playing.setdefault(key, [])
+            if kind == EventKind.NOTE_ON:
+                starts.append(tick)
+            elif len(starts) > 1:
+                # the note ends when the last one of the same pitch starts
+                ticks[i] = starts.pop()
+                moved = True
+            elif starts:
+                starts.pop()
+            else:
+                continue # its note on was a duplicate
+            rows.append(i)
+
+        if len(rows) != len(ticks):
+            self.select(rows)
+        if moved:
+            self.sort()
+
+    def track_count(self):
+        return max(self.tracks) + 1 if self.tracks else 0
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __getitem__(self, i):
+        return (self.ticks[i], self.tracks[i], self.channels[i],
+                self.kinds[i], self.data1[i], self.data2[i])
+
+    def __iter__(self):
+        return zip(self.ticks, self.tracks, self.channels, self.kinds, self.data1, self.data2)
+
+    def __repr__(self):
+        lines = []
+        for tick, track, channel, kind, data1, data2 in self:
+            if kind == EventKind.TRACK_NAME:
+                data1 = repr(self.texts[data1])
+            lines.append(f"{tick:>8} {track:>3} {channel:>3} {KIND_NAMES[kind]:<15} {data1} {data2}")
+        return "\n".join(lines)
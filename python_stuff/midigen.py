@@ -1,355 +1,144 @@
 from new_parser import *
 from ast import *
+from midi_ir import *
+from lowering import *
+from validate import validate, validate_bars, instrument_error
+from instruments import midi_instruments
+from midiwriter import write_smf_file
 from midiutil import MIDIFile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-class gen_state:
-    def __init__(self):
-        self.oct = 4
-        self.tempo = 60
-        self.meas = (4,4)
-        self.counter = 0 
-        self.dur = 1
-        self.channel = 0
-        self.volume = 100
-
-        self.semitone_dict = {
-            'r': 0,
-            'c': 0, 'do': 0,
-            'd': 0, 're': 0,
-            'e': 0, 'mi': 0,
-            'f': 0, 'fa': 0,
-            'g': 0, 'sol':0,
-            'a': 0, 'la': 0,
-            'b': 0, 'si': 0
-        }
-
-        self.time = 0
-
-        pass
-
-
-def gen_midi(ast,output):
+def gen_midi(ast,output,workers=1):
     if len(ast.tracks) == 1:
         gen_mono_track(ast,output)
     else:
-        gen_multi_track(ast.tracks,ast.metadata)
+        gen_multi_track(ast,output,workers)
     pass
 
 
 def gen_mono_track(ast,output):
-    track = ast.tracks[0]
-    meta = ast.metadata
-
-    midi = MIDIFile(1,True,True,False,1) # default values for 1 track
-    midi.addTempo(0,0,120) #default values
-
-    midi.addTrackName(0,0,track.name) # add the name of the track
-
-    for m_id,movement in enumerate(track.movements):
-
-        if movement.instrument.value in midi_instruments.keys():
-            program = midi_instruments[movement.instrument.value]
-        else:
-            ast.err_list.append(f"""Compilation error({movement.instrument.line},{movement.instrument.column}): instrument \"{movement.instrument.value}\" is not supported
-| Tip: You can choose instruments like piano,guitar etc.
-| Tip: All the midi instruments are supported
-
-""")
-
-        midi.addProgramChange(0,m_id,0,program)
-
-        state = gen_state()
-
-        for e_id,event in enumerate(movement.expressions):
-            if isinstance(event, Note):
-                try:
-                    next_state = movement.expressions[e_id+1]
-                except:
-                    next_state = event
-
-
-                add_note(state,next_state,event,m_id,midi)
-
-                pass
-
-
-            elif isinstance(event,SetInterval):
-                #this is already handled
-                pass
-
-            elif isinstance(event,SetMeasure):
-                state.meas = (int(event.x),int(event.over))
-                pass
-
-            elif isinstance(event,SetTone):
-                state.semitone_dict[event.note.value.lower()] += int(event.n)
-            elif isinstance(event,SetVolume):
-                state.volume = event.vol
-            elif isinstance(event,SetTempo):
-                state.tempo = event.n
-            elif isinstance(event,SetOctave):
-                state.oct += event.n * event.dir
-            elif isinstance(event,SetDuration):
-                duration = event.dur 
-                if isinstance(duration,Fraction):
-                    duration = duration.x / duration.over
-
-                state.dur = duration
-
-            elif isinstance(event,Bar):
-
-                if state.counter != state.meas[0]:
-                    ast.err_list.append(f"Measure error({event.source.line},{event.source.column}): The measure is {state.meas[0]}/{state.meas[1]}, for this bar got {state.counter} notes instead")
-
-                print("Current measure:",state.counter)
-                state.counter = 0
-
-                pass
-
-            elif isinstance(event,Chord):
-                try:
-                    next_state = movement.expressions[e_id+1]
-                except:
-                    next_state = event
-
-
-                for note_e in event.notes[:-1]:
-                    # treat the next state as being interval 0
-                    # this way note/note/... is completly equivalent to note 0 note 0 ...
-                    interv_0 = SetInterval(Token("0",0,0,TokenType.NUM))
-                    add_note(state,interv_0,note_e,m_id,midi)
-                    continue
-
-                add_note(state,next_state,event.notes[-1],m_id,midi)
-                pass
-
-            elif isinstance(event, errExpr):
-                pass
-            else:
-                raise ValueError(f"	Unhandled event type in movement:{event}")
-
+    events = gen_events(ast)
 
     if len(ast.err_list) == 0:
-        with open(output, "wb") as output_file:
-            midi.writeFile(output_file)    
+        write_smf_file(events,output)
 
     pass
 
-def add_note(state,next_state,event,m_id,midi):
-
-    note = event.value.value.lower()
-
-    if isinstance(next_state,ReleaseNote):
-        release_note(state,note,midi,m_id)
-        return
-
-    volume = state.volume
-
-    if event.value.value.lower() == 'r':
-        #handle rests
-        volume = 0
-
-    note_n = note_to_midi[note]
-
-    semitone = state.semitone_dict[note] if event.semitone == 0 else event.semitone
+# format 1 file with a chunk per track, with workers > 1 the tracks are
+# rendered in that many processes
+def gen_multi_track(ast,output,workers=1):
+    events = gen_events(ast,workers)
 
-    octave = state.oct if event.octave == -1 else event.octave
-
-    pitch = note_n + semitone + 12*octave
-    print("pitch:",pitch)
-
-    duration = state.dur if event.duration == -1 else event.duration
-    if isinstance(duration,Fraction):
-        duration = duration.x / duration.over
-    elif not (isinstance(duration,int) or isinstance(duration,float)):
-        raise ValueError(f"duration should be numeric, {duration} is {type(duration)} instead")
-
-    duration *= 4
-
-    midi.addNote(0,m_id,pitch,state.time,duration, volume)
-    
-    delta =  duration \
-        if not isinstance(next_state,SetInterval) \
-        else int(next_state.time.value)
-
-    state.counter += delta
-    state.time += delta
+    if len(ast.err_list) == 0:
+        write_smf_file(events,output)
 
     pass
 
-note_to_midi = {
-    'r':0, #rest is just a silent note
-    'c': 0, 'do': 0,
-    'd': 2, 're': 2,
-    'e': 4, 'mi': 4,
-    'f': 5, 'fa': 5,
-    'g': 7, 'sol': 7,
-    'a': 9, 'la': 9,
-    'b': 11, 'si': 11
-}
-
-midi_instruments = {
-    # Piano (0-7)
-    'piano' : 0, #default piano
-    'acoustic_grand_piano': 0,
-    'bright_acoustic_piano': 1,
-    'electric_grand_piano': 2,
-    'honkytonk_piano': 3,
-    'electric_piano_1': 4,
-    'electric_piano_2': 5,
-    'harpsichord': 6,
-    'clavinet': 7,
-
-    # Chromatic Percussion (8-15)
-    'celesta': 8,
-    'glockenspiel': 9,
-    'music_box': 10,
-    'vibraphone': 11,
-    'marimba': 12,
-    'xylophone': 13,
-    'tubular_bells': 14,
-    'dulcimer': 15,
-
-    # Organ (16-23)
-    'organ' :16,
-    'drawbar_organ': 16,
-    'percussive_organ': 17,
-    'rock_organ': 18,
-    'church_organ': 19,
-    'reed_organ': 20,
-    'accordion': 21,
-    'harmonica': 22,
-    'tango_accordion': 23,
-
-    # Guitar (24-31)
-    'guitar':24,
-    'acoustic_guitar_nylon': 24,
-    'acoustic_guitar_steel': 25,
-    'electric_guitar_jazz': 26,
-    'electric_guitar_clean': 27,
-    'electric_guitar_muted': 28,
-    'overdriven_guitar': 29,
-    'distortion_guitar': 30,
-    'guitar_harmonics': 31,
-
-    # Bass (32-39)
-    'bass':32,
-    'acoustic_bass': 32,
-    'electric_bass_finger': 33,
-    'electric_bass_pick': 34,
-    'fretless_bass': 35,
-    'slap_bass_1': 36,
-    'slap_bass_2': 37,
-    'synth_bass_1': 38,
-    'synth_bass_2': 39,
-
-    # Strings (40-47)
-    'violin': 40,
-    'viola': 41,
-    'cello': 42,
-    'contrabass': 43,
-    'tremolo_strings': 44,
-    'pizzicato_strings': 45,
-    'orchestral_harp': 46,
-    'timpani': 47,
-
-    # Ensemble (48-55)
-    'string_ensemble_1': 48,
-    'string_ensemble_2': 49,
-    'synth_strings_1': 50,
-    'synth_strings_2': 51,
-    'choir_aahs': 52,
-    'voice_oohs': 53,
-    'synth_choir': 54,
-    'orchestra_hit': 55,
-
-    # Brass (56-63)
-    'trumpet': 56,
-    'trombone': 57,
-    'tuba': 58,
-    'muted_trumpet': 59,
-    'french_horn': 60,
-    'brass_section': 61,
-    'synth_brass_1': 62,
-    'synth_brass_2': 63,
-
-    # Reed (64-71)
-    'soprano_sax': 64,
-    'alto_sax': 65,
-    'tenor_sax': 66,
-    'baritone_sax': 67,
-    'oboe': 68,
-    'english_horn': 69,
-    'bassoon': 70,
-    'clarinet': 71,
-
-    # Pipe (72-79)
-    'piccolo': 72,
-    'flute': 73,
-    'recorder': 74,
-    'pan_flute': 75,
-    'blown_bottle': 76,
-    'shakuhachi': 77,
-    'whistle': 78,
-    'ocarina': 79,
-
-    # Synth Lead (80-87)
-    'lead_1_square': 80,
-    'lead_2_sawtooth': 81,
-    'lead_3_calliope': 82,
-    'lead_4_chiff': 83,
-    'lead_5_charang': 84,
-    'lead_6_voice': 85,
-    'lead_7_fifths': 86,
-    'lead_8_bass_lead': 87,
-
-    # Synth Pad (88-95)
-    'pad_1_new_age': 88,
-    'pad_2_warm': 89,
-    'pad_3_polysynth': 90,
-    'pad_4_choir': 91,
-    'pad_5_bowed': 92,
-    'pad_6_metallic': 93,
-    'pad_7_halo': 94,
-    'pad_8_sweep': 95,
+# Walks the resolved ast once and returns its events as a sorted EventTable,
+# every track of the program is a track of the table. Errors are added to
+# ast.err_list.
+def gen_events(ast,workers=1):
+    ticks_per_quarter = ticks_per_quarter_for(ast) # the same for every track
+    if workers > 1 and len(ast.tracks) > 1:
+        with ProcessPoolExecutor(min(workers,len(ast.tracks))) as pool:
+            rendered = list(pool.map(render_track,ast.tracks,range(len(ast.tracks)),
+                                     [ticks_per_quarter] * len(ast.tracks)))
+    else:
+        rendered = [render_track(track,t_id,ticks_per_quarter) for t_id,track in enumerate(ast.tracks)]
+
+    return merge_tracks(ast,rendered)
+
+# Events of one track on their own, every movement on the channel of its
+# index. Returns the sorted events and the errors found.
+def render_track(track,t_id,ticks_per_quarter=TICKS_PER_QUARTER):
+    events = EventTable(ticks_per_quarter)
+    errors = []
+    events.add_text(0,t_id,EventKind.TRACK_NAME,track.name) # add the name of the track
+    gen_track_events(track,t_id,events,errors)
+    events.sort()
+    events.remove_overlaps() # notes only overlap in their own track
+    return events,errors
+
+def merge_tracks(ast,rendered):
+    events = EventTable(rendered[0][0].ticks_per_quarter if rendered else TICKS_PER_QUARTER)
+    events.add(0,0,0,EventKind.TEMPO,60000000 // 120) #default values
+
+    channels = assign_channels(ast)
+    for t_id,(track_events,errors) in enumerate(rendered):
+        ast.err_list.extend(errors)
+        events.extend(track_events,channels[t_id])
+
+    events.sort()
+    return events
+
+# channel 10 (9 counting from 0) plays percussion in general midi
+MIDI_CHANNELS = [channel for channel in range(16) if channel != 9]
+
+# midi channel of every movement, for each track. The channels are numbered
+# across the tracks since they all share the 16 channels of the file.
+def assign_channels(ast):
+    channels = []
+    count = 0
+    for track in ast.tracks:
+        channels.append([MIDI_CHANNELS[(count + m_id) % len(MIDI_CHANNELS)] for m_id in range(len(track.movements))])
+        count += len(track.movements)
+
+    if count > len(MIDI_CHANNELS):
+        ast.err_list.append(Diagnostic(Code.TOO_MANY_MOVEMENTS, args=(count, len(MIDI_CHANNELS))))
+
+    return channels
+
+def gen_track_events(track,t_id,events,errors):
+    for m_id,movement in enumerate(track.movements):
 
-    # Synth Effects (96-103)
-    'fx_1_rain': 96,
-    'fx_2_soundtrack': 97,
-    'fx_3_crystal': 98,
-    'fx_4_atmosphere': 99,
-    'fx_5_brightness': 100,
-    'fx_6_goblins': 101,
-    'fx_7_echoes': 102,
-    'fx_8_scifi': 103,
+        if movement.instrument.value in midi_instruments.keys():
+            program = midi_instruments[movement.instrument.value]
+            events.add(0,t_id,m_id,EventKind.PROGRAM_CHANGE,program)
+        else:
+            errors.append(instrument_error(movement))
 
-    # Ethnic (104-111)
-    'sitar': 104,
-    'banjo': 105,
-    'shamisen': 106,
-    'koto': 107,
-    'kalimba': 108,
-    'bagpipe': 109,
-    'fiddle': 110,
-    'shanai': 111,
+        lowered = lower_movement(movement,events.ticks_per_quarter)
+        events.add_notes(lowered.starts,lowered.durations,t_id,m_id,lowered.pitches,lowered.velocities)
+        errors.extend(lowered.errors)
+        errors.extend(validate_bars(lowered))
 
-    # Percussive (112-119)
-    'tinkle_bell': 112,
-    'agogo': 113,
-    'steel_drums': 114,
-    'woodblock': 115,
-    'taiko_drum': 116,
-    'melodic_tom': 117,
-    'synth_drum': 118,
-    'reverse_cymbal': 119,
+    pass
 
-    # Sound Effects (120-127)
-    'guitar_fret_noise': 120,
-    'breath_noise': 121,
-    'seashore': 122,
-    'bird_tweet': 123,
-    'telephone_ring': 124,
-    'helicopter': 125,
-    'applause': 126,
-    'gunshot': 127
-}
+# The errors gen_events would find, without generating the events. Like
+# gen_events, too many movements for the channels is added to ast.err_list
+def check_program(ast):
+    assign_channels(ast)
+    return validate(ast)
+
+# Writes the events with midiutil, as a format 1 file with the tempo in its
+# own track. midiwriter does the same faster, this is kept as the reference.
+def write_midiutil(events,output):
+    midi = MIDIFile(events.track_count(),True,True,False,1,
+                    ticks_per_quarternote=events.ticks_per_quarter,eventtime_is_ticks=True)
+
+    # midiutil wants notes with a duration, match every note off with the
+    # first note on still playing the same pitch
+    notes = []
+    playing = {}
+    for i,(tick,track,channel,kind,data1,data2) in enumerate(events):
+        if kind == EventKind.NOTE_ON:
+            playing.setdefault((track,channel,data1),deque()).append(i)
+        elif kind == EventKind.NOTE_OFF:
+            on = playing[(track,channel,data1)].popleft()
+            notes.append((events.tracks[on],events.channels[on],events.ticks[on],on,tick))
+        elif kind == EventKind.PROGRAM_CHANGE:
+            midi.addProgramChange(track,channel,tick,data1)
+        elif kind == EventKind.TRACK_NAME:
+            midi.addTrackName(track,tick,events.texts[data1])
+        elif kind == EventKind.TEMPO:
+            midi.addTempo(track,tick,60000000 // data1)
+
+    # midiutil orders note offs on the same tick by when their note was
+    # added, so add them channel by channel like they were generated
+    notes.sort()
+    for track,channel,tick,on,off in notes:
+        midi.addNote(track,channel,events.data1[on],tick,off - tick,events.data2[on])
+
+    with open(output, "wb") as output_file:
+        midi.writeFile(output_file)
@@ -0,0 +1,117 @@
+# Standard MIDI File writer for the event table of midi_ir, without midiutil
+#
+# The whole file is serialized into one preallocated bytearray and written
+# at once. Delta times are variable length quantities and channel messages
+# use running status.
+import struct
+from midi_ir import *
+
+HEADER = struct.Struct(">4sLHHH")
+CHUNK = struct.Struct(">4sL")
+END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+# most delta times fit in one or two bytes, those are precomputed
+VLQ_TABLE = [bytes([value]) for value in range(0x80)] + \
+            [bytes([0x80 | (value >> 7), value & 0x7f]) for value in range(0x80, 0x4000)]
+
+def vlq(value):
+    if value < 0x4000:
+        return VLQ_TABLE[value]
+    out = bytearray([value & 0x7f])
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7f))
+        value >>= 7
+    out.reverse()
+    return bytes(out)
+
+STATUS = {
+    EventKind.NOTE_OFF: 0x80,
+    EventKind.NOTE_ON: 0x90,
+    EventKind.PROGRAM_CHANGE: 0xc0,
+}
+
+# Returns the bytes of a midi file with the events. Format 1 files have a
+# tempo track followed by one chunk per track of the table, format 0 files
+# have every event in a single chunk.
+def write_smf(events, format=1):
+    if format == 1:
+        chunks = [[] for _ in range(events.track_count() + 1)]
+        for i, (track, kind) in enumerate(zip(events.tracks, events.kinds)):
+            chunks[0 if kind == EventKind.TEMPO else track + 1].append(i)
+    elif format == 0:
+        chunks = [range(len(events))]
+    else:
+        raise ValueError(f"Unsupported midi file format {format}, only 0 and 1 are")
+
+    texts = [text.encode("ISO-8859-1") for text in events.texts]
+
+    # upper bound of the size: a 5 bytes delta and 6 bytes of event per row,
+    # plus the texts and the chunk headers
+    size = HEADER.size + len(chunks) * (CHUNK.size + len(END_OF_TRACK)) \
+         + 11 * len(events) + sum(len(text) + 4 for text in texts)
+    buf = bytearray(size)
+
+    HEADER.pack_into(buf, 0, b"MThd", 6, format, len(chunks), events.ticks_per_quarter)
+    pos = HEADER.size
+    for rows in chunks:
+        start = pos + CHUNK.size
+        pos = write_track(events, rows, texts, buf, start)
+        buf[pos:pos + 4] = END_OF_TRACK
+        pos += 4
+        CHUNK.pack_into(buf, start - CHUNK.size, b"MTrk", pos - start)
+
+    del buf[pos:]
+    return buf
+
+# serializes the rows of a chunk at buf[pos:], returns the end position
+def write_track(events, rows, texts, buf, pos):
+    ticks, channels, kinds = events.ticks, events.channels, events.kinds
+    data1, data2 = events.data1, events.data2
+
+    last_tick = 0
+    running = None # status byte that can be left out
+    for i in rows:
+        tick = ticks[i]
+        delta = VLQ_TABLE[tick - last_tick] if tick - last_tick < 0x4000 else vlq(tick - last_tick)
+        last_tick = tick
+        buf[pos:pos + len(delta)] = delta
+        pos += len(delta)
+
+        kind = kinds[i]
+        if kind == EventKind.NOTE_ON or kind == EventKind.NOTE_OFF:
+            status = STATUS[kind] | channels[i]
+            if status != running:
+                buf[pos] = status
+                pos += 1
+                running = status
+            buf[pos] = data1[i]
+            buf[pos + 1] = data2[i]
+            pos += 2
+        elif kind == EventKind.PROGRAM_CHANGE:
+            status = STATUS[kind] | channels[i]
+            if status != running:
+                buf[pos] = status
+                pos += 1
+                running = status
+            buf[pos] = data1[i]
+            pos += 1
+        elif kind == EventKind.TEMPO:
+            buf[pos:pos + 6] = b"\xff\x51\x03" + data1[i].to_bytes(3, "big")
+            pos += 6
+            running = None # meta events cancel running status
+        elif kind == EventKind.TRACK_NAME:
+            text = texts[data1[i]]
+            meta = b"\xff\x03" + vlq(len(text)) + text
+            buf[pos:pos + len(meta)] = meta
+            pos += len(meta)
+            running = None
+        else:
+            raise ValueError(f"Can't write events of kind {kind}")
+
+    return pos
+
+def write_smf_file(events, output, format=1):
+    data = write_smf(events, format)
+    with open(output, "wb") as output_file:
+        output_file.write(data)
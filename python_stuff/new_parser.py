@@ -1,4 +1,5 @@
 from ast import *
+from collections import deque
 
 NOTES = [TokenType.do,TokenType.re,TokenType.mi,TokenType.fa,TokenType.sol,TokenType.la,TokenType.si, TokenType.KW_R]
 END_STATEMENT = [TokenType.NL, TokenType.SEMICOLON, TokenType.EOF]
@@ -10,30 +11,167 @@ class ParseState:
     
     EXPR = "EXPR"
 
+# Levels for the parser trace, messages above the parser's level are dropped
+class TraceLevel:
+    OFF = 0
+    ERROR = 1 # error recovery
+    INFO = 2 # statements
+    DEBUG = 3 # everything
+
+
+# Lazy token source for the parser, wraps Tokenizer.iter_tokens() and only
+# keeps the last `window` tokens around. It's indexed by absolute token
+# position like the token list, the parser never looks further than a couple
+# of tokens behind or ahead of its position so a small ring buffer is enough.
+class TokenStream:
+    def __init__(self, tokens, window=64):
+        self.tokens = iter(tokens)
+        self.window = deque(maxlen=window)
+        self.start = 0 # absolute position of window[0]
+        self.end = 0 # absolute position after the last buffered token
+        self.done = False
+
+    # pull tokens from the generator until index is buffered
+    def fill(self, index):
+        window = self.window
+        while self.end <= index and not self.done:
+            token = next(self.tokens, None)
+            if token is None:
+                self.done = True
+                break
+
+            if len(window) == window.maxlen:
+                self.start += 1
+            window.append(token)
+            self.end += 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # only what is still in the window, used for dumping state
+            start = max(index.start or 0, self.start)
+            stop = min(self.end, self.start + len(self.window) if index.stop is None else index.stop)
+            return [self.window[i - self.start] for i in range(start, stop)]
+
+        if index < 0:
+            # negative indexes are relative to the end of the stream
+            self.fill(float("inf"))
+            index += self.end
+
+        if index >= self.end:
+            self.fill(index)
+            if index >= self.end:
+                raise IndexError("token stream index out of range")
+
+        if index < self.start:
+            raise ValueError(f"Internal error: token {index} already left the lookahead window (starts at {self.start})")
+
+        return self.window[index - self.start]
+
+    def __contains__(self, item):
+        # only the buffered tokens are searched, it never consumes the stream
+        return item in self.window
+
 
 class Parser:
-    def __init__(self, tokens):
+    # tracing is off by default, when on the last trace_size messages are kept
+    # (unformatted) and printed by dump_state() on internal errors
+    # index is the TokenIndex built by the Tokenizer for these tokens, if any
+    def __init__(self, tokens, trace=TraceLevel.OFF, trace_size=256, index=None):
         self.tokens = tokens
+        self.index = index
         self.pos = 0
         self.stack = []
         self.tracks = []
         self.macros = []
         self.metadata = []
         self.idents = {}
-        self.err_list = []
-        self.log_list = []
+        self.err_list = DiagnosticList()
+        self.deps = DependencyGraph()
+        self.used = {} # identifiers used by the current statement, in order
+        self.trace_level = trace
+        self.log_list = deque(maxlen=trace_size)
+
+        # sub-parser for every token an expression can start with
+        self.expr_table = [self.parse_unexpected] * len(TOKEN_NAMES)
+        for note in NOTES:
+            self.expr_table[note] = self.parse_note
+        self.expr_table[TokenType.V] = self.parse_volume
+        self.expr_table[TokenType.PLUS] = self.parse_sharp
+        self.expr_table[TokenType.DASH] = self.parse_flat
+        self.expr_table[TokenType.GREATER_THAN] = self.parse_octave_up
+        self.expr_table[TokenType.LESS_THAN] = self.parse_octave_down
+        self.expr_table[TokenType.COLON] = self.parse_duration
+        self.expr_table[TokenType.BANG] = self.parse_measure
+        self.expr_table[TokenType.CARROT] = self.parse_tempo
+        self.expr_table[TokenType.PIPE] = self.parse_bar
+        self.expr_table[TokenType.NUM] = self.parse_interval
+        self.expr_table[TokenType.ASTERISK] = self.parse_repetition
+        self.expr_table[TokenType.CLOSE_PAREN] = self.parse_release
+        self.expr_table[TokenType.OPEN_PAREN] = self.parse_hold
+        self.expr_table[TokenType.OPEN_BRACKET] = self.parse_group
+        self.expr_table[TokenType.ALPHANUM] = self.parse_ident
+        self.expr_table[TokenType.EOF] = self.parse_eof
+
+    # The statements are added to the program with these, they also check the
+    # names across statements. CompileSession uses them to put together
+    # statements it parsed on their own.
+
+    def declare_macro(self, ident):
+        if ident.value in self.idents.keys():
+            self.log("adding macro %s to ident list", ident)
+
+            if not isinstance(self.idents[ident.value],Token) :
+                self.log("idents already defined error", level=TraceLevel.ERROR)
+                self.error(Code.REDEFINITION, ident, ident.value, self.idents[ident.value])
+        self.log("register ident for macro %s", ident)
+        self.idents[ident.value] = ident
+
+    def add_macro(self, macro, uses=()):
+        self.log("append macro %s", macro)
+        self.macros.append(macro)
+
+        self.log("assign index of macro to the map")
+        self.idents[macro.name.value] = len(self.macros)
+
+        params = set(param.value for param in macro.parameters)
+        self.deps.add_macro(macro.name.value, [name for name in uses if name not in params])
+
+    def add_movement(self, movement, uses=()):
+        if not self.tracks:
+            # movements before any track statement (or in a file
+            # without tracks) go to the global track
+            self.log("Added global track")
+            self.tracks.append(Track("global",[],movement.instrument))
+
+        self.log("append to the last defined track")
+        self.tracks[-1].movements.append(movement)
+
+        self.deps.add_movement(len(self.tracks) - 1, len(self.tracks[-1].movements) - 1, uses)
+
+        self.log("add the identifier for the movement to the list")
+        m_ident = f"{movement.instrument.value}{movement.tag if movement.tag == "" else movement.tag.value}"
+        if (m_ident not in self.idents.keys()  # if the movement isn't defined already
+            or self.idents[m_ident][0] != len(self.tracks) # or if defined, doesn't belong to the same track
+        ):
+            self.log("added new ident for movement")
+            self.idents[m_ident] = (len(self.tracks), len(self.tracks[-1].movements))
+        elif movement.tag == "":
+            self.error(Code.INSTRUMENT_REUSED, movement.instrument, movement.instrument, self.idents[m_ident])
+        else:
+            self.error(Code.TAG_EXISTS, movement.tag, m_ident, self.idents[m_ident])
 
     def advance(self):
         self.pos += 1
-        if self.pos < len(self.tokens):
+        try:
             return self.tokens[self.pos - 1]
-        return self.tokens[-1]  # Return EOF token
+        except IndexError:
+            return self.tokens[-1]  # Return EOF token
 
     def peek(self, offset):
-        pos = self.pos + offset
-        if pos < len(self.tokens):
-            return self.tokens[pos]
-        return self.tokens[-1]  # Return EOF token
+        try:
+            return self.tokens[self.pos + offset]
+        except IndexError:
+            return self.tokens[-1]  # Return EOF token
 
     def match(self, token_type):
         curr = self.peek(0).type
@@ -48,42 +186,38 @@ class Parser:
         else:
             return None
 
-    def log(self,msg):
-        self.log_list.append(msg)
+    # msg is only formatted with args when the trace is read. The calls on the
+    # hot paths (per token or expression) check self.trace_level first, so
+    # with tracing off their args (often a peek) aren't even evaluated.
+    def log(self, msg, *args, level=TraceLevel.DEBUG):
+        if level <= self.trace_level:
+            self.log_list.append((msg, args))
+
+    def format_logs(self):
+        return [msg % args if args else msg for msg, args in self.log_list]
+
+    # errors are kept as Diagnostics and only formatted when they're read
+    def error(self, code, token, *args):
+        self.err_list.append(Diagnostic.at(code, token, *args))
 
 
     def parse(self):
         # Create program node (root of AST)
         #update metadata if you want to add for example
 
-        if TokenType.KW_TRACK not in self.tokens:
-            self.log("Added global track")
-            self.tracks.append(Track("global",[],self.peek(0)))
-            pass
-
         # Skip initial newlines
         self.skip_whitespace()
         
         # Continue parsing until we reach EOF
-        while self.peek(0).type != TokenType.EOF:
-            self.log(f"new iteration of statement loop at {self.peek(0)}")
+        # after too many errors the rest of the file isn't worth reading
+        while self.peek(0).type != TokenType.EOF and not self.err_list.full():
+            if self.trace_level >= TraceLevel.INFO:
+                self.log("new iteration of statement loop at %s", self.peek(0), level=TraceLevel.INFO)
 
             # Handle expected error cases:
             if self.peek(0).type in NOTES:
-                self.log(f"Error: note literal as statement")
-                self.err_list.append(f"""{SyntaxErr(self.peek(0))}Statements cannot start with a note literal.
-|
-| Tip: To write notes or expressions over multiple lines use an exression group by enclosing them in []
-|
-|   Example:
-|   X piano: 
-|           do re mi
-|
-|   V piano: [
-|           do re mi
-|   ]
-|
-""")
+                self.log("Error: note literal as statement", level=TraceLevel.ERROR)
+                self.error(Code.NOTE_STATEMENT, self.peek(0))
                 self.restore_stmt()
                 continue
 
@@ -95,8 +229,9 @@ class Parser:
                 self.skip_space()
 
                 if self.expect(TokenType.COLON) is None:
-                    self.log(f"expected colon but found {self.peek(0)}")
-                    self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected colon after keyword title, got token \"{self.peek(0).value}\" intead\n" )
+                    if self.trace_level >= TraceLevel.ERROR:
+                        self.log("expected colon but found %s", self.peek(0), level=TraceLevel.ERROR)
+                    self.error(Code.TITLE_COLON, self.peek(0), self.peek(0).value)
                     self.restore_stmt()
                 else:
                     self.log("found colon in metadata")
@@ -104,17 +239,18 @@ class Parser:
                     name = self.expect(TokenType.STRING)
 
                     if name is not None:
-                        self.log(f"found name for title {name}")
+                        self.log("found name for title %s", name)
                         self.metadata.append(Metadata(name.value,name))
                     else:
-                        self.log(f"title error")
-                        self.err_list.append(f"{SyntaxErr(name)}Expected string after title definiton, got token \"{name.value}\" instead\n")
+                        self.log("title error", level=TraceLevel.ERROR)
+                        self.error(Code.TITLE_STRING, self.peek(0), self.peek(0).value)
                         self.restore_stmt()
 
 
             # Handle macro definition or movement
             elif self.peek(0).type == TokenType.ALPHANUM:
-                self.log(f"found alphanum:{self.peek(0)}")
+                if self.trace_level >= TraceLevel.DEBUG:
+                    self.log("found alphanum:%s", self.peek(0))
                 ident = self.advance()
                 self.skip_space()
                 # parse macros
@@ -122,75 +258,44 @@ class Parser:
                     self.log("parsing macros")
                     
                     # if it's a macro, it needs to be added to ident list
-                    if ident.value in self.idents.keys():
-                        self.log(f"adding macro {ident} to ident list")
+                    self.declare_macro(ident)
 
-                        if not isinstance(self.idents[ident.value],Token) :
-                            self.log(f"idents already defined error")
-                            self.err_list.append(f"{Ident_err(ident)}Identifier {ident.value} is already used here:{self.idents[ident.value]}, redefinitions are not allowed")
-                    self.log(f"register ident for macro {ident}")
-                    self.idents[ident.value] = ident
-
-                    self.log(f"push macro state")
+                    self.log("push macro state")
                     self.stack.append(ParseState.MACRO)
-                    self.log(f"call parse macro")
+                    self.log("call parse macro")
+                    self.used = {}
                     macro = self.parse_macro(ident)
-                    self.log(f"append macro {macro}")
-                    self.macros.append(macro)
-                    
-                    self.log(f"assign index of macro to the map")
-                    self.idents[ident.value] = len(self.macros)
+                    self.add_macro(macro, self.used)
 
-                    self.log(f"pop macro from stack")
+                    self.log("pop macro from stack")
                     top = self.stack.pop()
                     if top != ParseState.MACRO:
-                        self.log(f"top of stack wasnt macro")
+                        self.log("top of stack wasnt macro", level=TraceLevel.ERROR)
                         self.dump_state()
                         raise ValueError(f"Internal error: Expected Macro state on top of the stack, got {top} intead")
 
                 # parse movements
                 elif self.peek(0).type in [TokenType.STRING , TokenType.COLON]:
-                    self.log(f"push MOVEMENT to stack")
+                    self.log("push MOVEMENT to stack")
                     self.stack.append(ParseState.MOVEMENT)
-                    self.log(f"call parse movemet")
+                    self.log("call parse movemet")
+                    self.used = {}
                     movement = self.parse_movement(ident)
-                    self.log("append to the last defined track")
-                    self.tracks[-1].movements.append(movement)
+                    self.add_movement(movement, self.used)
                     self.skip_whitespace()
                     self.skip_space()
 
-
-                    self.log("add the identifier for the movement to the list")
-                    m_ident = f"{movement.instrument.value}{movement.tag if movement.tag == "" else movement.tag.value}"
-                    if (m_ident not in self.idents.keys()  # if the movement isn't defined already
-                        or self.idents[m_ident][0] != len(self.tracks) # or if defined, doesn't belong to the same track
-                    ):
-                        self.log("added new ident for movement")
-                        self.idents[m_ident] = (len(self.tracks), len(self.tracks[-1].movements))
-                    else:
-                        tag_already_exists = f'''Tag {m_ident} already exits {self.idents[m_ident]}'''
-                        instrument_already_used = f'''Instrument {movement.instrument} was already used in this track:{self.idents[m_ident]} 
-| Tip: to have the same instrument playing twice in a movement, use a tag to differentiate it:
-| x piano : do re mi
-|   piano : fa sol la
-|
-| v piano : do re mi
-|   piano "another" : fa sol la
-'''
-                        self.err_list.append(f"{instrument_already_used if movement.tag == "" else tag_already_exists }")
-                        pass
-
                     self.log("pop from stack movement")
                     top = self.stack.pop()
                     if top != ParseState.MOVEMENT:
-                        self.log(f"expected to pop movemnt, got {top} instead")
+                        self.log("expected to pop movemnt, got %s instead", top, level=TraceLevel.ERROR)
                         self.dump_state()
                         raise ValueError(f"Compiler error: Expected Movement state on top of the stack, got {top} intead")
                     pass
 
                 else:
                     self.log("192: token error") # there is no standard way to create log messeges, i kinda wing them
-                    self.err_list.append(f"{SyntaxErr(self.peek(0))}Unexpected token after alphanum: {self.peek(0)}")
+                    self.error(Code.ALPHANUM_TOKEN, self.peek(0), self.peek(0))
                     self.restore_stmt()
 
             elif self.peek(0).type == TokenType.KW_TRACK:
@@ -202,7 +307,10 @@ class Parser:
                 if self.match(TokenType.STRING):
                     name = self.advance()
                     self.skip_space()
-                    self.log(f"found name for track {name}")
+                    self.log("found name for track %s", name)
+                    name = name.value.strip('"')
+
+                self.tracks.append(Track(name,[],source))
 
                 if self.match(TokenType.COLON):
                     self.log("found colon after track kw")
@@ -210,39 +318,26 @@ class Parser:
                     self.skip_whitespace()
 
                 else :
-                    self.log(f"213: token error")
-                    self.err_list.append(f"{SyntaxErr(self.peek(1))} Expected colon or string after \"track\" , got token \"{self.peek(1).value}\" instead")
+                    self.log("213: token error", level=TraceLevel.ERROR)
+                    self.error(Code.TRACK_COLON, self.peek(0), self.peek(0).value)
                     self.restore_to(TokenType.NL)
 
 
-            elif self.peek(0).type == TokenType.NL:
+            elif self.peek(0).type in (TokenType.NL, TokenType.SPACE):
                 self.log("Skip newlines between statements")
-                self.advance()
+                # and the indentation of the next one, wherever the
+                # statement before stopped
+                self.skip_whitespace()
             else:
-                self.log("Handle unexpected tokens for start of statements")
-                self.err_list.append(
-                    f"{SyntaxErr(self.peek(0))}Unexpected token \"{self.peek(0)}\" for begining of new statement \n") + '''
-| Tip: The supported types of statements are:
-| 1. Metadata statements
-|   example: title = "my title"
-|
-| 2. Track start statements
-|   example: track "my track":
-|   Note: a track end when either the file ends or another track is defined
-|         also, if no track is defined, the entire file is treated as the track
-|
-| 3. Movements
-|   example: piano "melodi": do re mi
-|
-| 4. Macros
-|   example: my_macro = do re mi
-|            my_macro_with_arguments (arg1,arg2) = arg1 do re mi arg2
-|
-'''
+                self.log("Handle unexpected tokens for start of statements", level=TraceLevel.ERROR)
+                self.error(Code.STATEMENT_START, self.peek(0), self.peek(0))
                 self.restore_stmt()
 
-        self.log(f"finished parsing program")
-        return Program(self.metadata,self.macros,self.tracks, self.tokens[self.pos],self.idents,self.err_list)
+        if not self.tracks:
+            self.tracks.append(Track("global",[],self.peek(0)))
+
+        self.log("finished parsing program", level=TraceLevel.INFO)
+        return Program(self.metadata,self.macros,self.tracks, self.peek(0),self.idents,self.err_list,self.index,self.deps)
 
     def parse_movement(self,instr):
         
@@ -251,19 +346,22 @@ class Parser:
 
         if self.match(TokenType.STRING):
             tag = self.advance()
-            self.log(f"found tag {tag} for movement {instr}")
+            self.log("found tag %s for movement %s", tag, instr)
             self.skip_space()
 
         if self.expect(TokenType.COLON) is None:
-            self.log(f"258: token error")
-            self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected colon after movement {instr} {self.log_tk()}")
+            self.log("258: token error", level=TraceLevel.ERROR)
+            self.error(Code.MOVEMENT_COLON, self.peek(0), instr.value, self.peek(0).value)
 
         while self.peek(0).type not in END_STATEMENT:
-            self.log("iterating movement body")
+            if self.trace_level >= TraceLevel.DEBUG:
+                self.log("iterating movement body")
             self.skip_space()
-            self.log("calling parse expr")
+            if self.trace_level >= TraceLevel.DEBUG:
+                self.log("calling parse expr")
             new_expr = self.parse_expr()
-            self.log(f"appending new_expr to body")
+            if self.trace_level >= TraceLevel.DEBUG:
+                self.log("appending new_expr to body")
             body.append(new_expr)
             self.skip_space()
         self.log("iteration of movemnt stoped")
@@ -280,7 +378,8 @@ class Parser:
             self.skip_space()
 
             while True:
-                self.log("iteration of arguments for macro")
+                if self.trace_level >= TraceLevel.DEBUG:
+                    self.log("iteration of arguments for macro")
                 if self.match(TokenType.CLOSE_PAREN):
                     self.log("found close paren while parsing arguments")
                     self.advance()
@@ -291,7 +390,7 @@ class Parser:
                     param = self.advance()
                     parameters.append(param) 
                     self.idents[param.value] = param
-                    self.log(f"got some parameters that are alphanum:{param}")
+                    self.log("got some parameters that are alphanum:%s", param)
 
                     self.skip_space()
 
@@ -302,19 +401,19 @@ class Parser:
                         self.skip_space()
 
                         if self.peek(0).type == TokenType.ALPHANUM:
-                            self.log(f"next parameter is alphanum, continuing")
+                            self.log("next parameter is alphanum, continuing")
                             continue
 
                         elif self.peek(0).type == TokenType.CLOSE_PAREN:
-                            self.log(f"309: token err")
-                            self.err_list.append(f"{SyntaxErr(self.peek(0))}Trailing comma in macro definition arguments: \"{self.peek(0).value}\"")
-                            self.log("restoer by skipping close paren token")
+                            self.log("309: token err", level=TraceLevel.ERROR)
+                            self.error(Code.MACRO_TRAILING_COMMA, self.peek(0), self.peek(0).value)
+                            self.log("restore by closing the parameters")
                             self.advance()
+                            break
                         else:
-                            self.log("314: token err")
-                            self.err_list.append(
-                                f"{SyntaxErr(self.peek(0))}Expected parameter type, got \"{self.peek(0)}\" instead of an identifier")
-                            self.log("restore by skipping that token")
+                            self.log("314: token err", level=TraceLevel.ERROR)
+                            self.error(Code.MACRO_PARAMETER, self.peek(0), self.peek(0))
+                            self.log("restore by skipping that token", level=TraceLevel.ERROR)
                             self.advance()
                             pass
                         pass
@@ -324,13 +423,17 @@ class Parser:
                         self.advance()
                         break
                     else:
-                        self.log("327: token err")
-                        self.err_list.append(f"{SyntaxErr(self.peek(0))}Macro parameter must be fallowed by comma or closed parenthesi, got token \"{self.peek(0).value}\" instead")
+                        self.log("327: token err", level=TraceLevel.ERROR)
+                        self.error(Code.MACRO_PARAMETER_END, self.peek(0), self.peek(0).value)
                         self.restore_to(TokenType.NL,TokenType.CLOSE_PAREN)
                     pass
                 else:
-                    self.log("332: token err")
-                    self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected identifier in arguments body, got token \"{self.peek(0).value}\" instead")
+                    self.log("332: token err", level=TraceLevel.ERROR)
+                    self.error(Code.MACRO_ARGUMENTS, self.peek(0), self.peek(0).value)
+                    # skip to the end of the parameters, or give up on them
+                    self.restore_to(TokenType.NL,TokenType.CLOSE_PAREN)
+                    if not self.match(TokenType.CLOSE_PAREN):
+                        break
                 pass
 
         self.log("end of parsing parameters")
@@ -338,9 +441,12 @@ class Parser:
         self.skip_space()
             
         if not self.match(TokenType.EQUAL):
-            self.log("341: token err")
-            self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected equals sign after macro name or arguments",self.log_tk())
+            self.log("341: token err", level=TraceLevel.ERROR)
+            self.error(Code.MACRO_EQUALS, self.peek(0), self.peek(0).value)
             self.restore_stmt()
+            if self.peek(0).type in (TokenType.NL, TokenType.EOF):
+                # no body on this line, don't take the next one for it
+                return Macro(name, parameters, body)
 
         self.advance() # skip equal token
         self.skip_space()
@@ -349,7 +455,8 @@ class Parser:
 
         while self.peek(0).type not in END_STATEMENT:
             self.skip_space()
-            self.log("Parse expr in macro body")
+            if self.trace_level >= TraceLevel.DEBUG:
+                self.log("Parse expr in macro body")
             body.append(self.parse_expr())
     
 
@@ -360,383 +467,386 @@ class Parser:
         return Macro(name, parameters, body) 
 
 
+    # Expressions are parsed through a dispatch table indexed by the type of
+    # the first token, see expr_table in __init__. Only the expressions that
+    # parse other expressions (groups, holds, chords, macro calls) push EXPR
+    # on the parse stack, simple ones like notes don't touch it.
     def parse_expr(self):
-        self.log("push expr to stack")
+        expression = self.expr_table[self.peek(0).type]()
+
+        if expression is None:
+            self.dump_state()
+            raise ValueError(f"Expression must not be none, at token {self.peek(0)}")
+
+        return expression
+
+    def push_expr(self):
+        if self.trace_level >= TraceLevel.DEBUG:
+            self.log("push expr to stack")
         self.stack.append(ParseState.EXPR)
-        expression = None
 
-        if False:
-            todo("remove this branch later")
+    def pop_expr(self):
+        if self.trace_level >= TraceLevel.DEBUG:
+            self.log("pop expr from stack")
+        top = self.stack.pop()
+        if top != ParseState.EXPR:
+            self.log("not expr on top, %s", top, level=TraceLevel.ERROR)
+            self.dump_state()
+            raise ValueError(f"Expected expr on top of the stack, got {top} instead")
 
 
 # simple expressions
 
-        
-        elif self.match(TokenType.V):
+    def parse_volume(self):
+        if self.trace_level >= TraceLevel.DEBUG:
             self.log("Parse SetVolume")
-            source = self.advance()
+        source = self.advance()
 
-            self.skip_space()
+        self.skip_space()
 
-            if self.expect(TokenType.EQUAL) is None:
-                err_source = self.peek(0)
-                self.log("380: token err")
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected colon after keyword {source.value}{self.log_tk()}")
-                self.restore_to(TokenType.SPACE)
-                expression = errExpr(err_source) 
+        if self.expect(TokenType.EQUAL) is None:
+            err_source = self.peek(0)
+            self.log("380: token err", level=TraceLevel.ERROR)
+            self.error(Code.VOLUME_EQUALS, self.peek(0), source.value, self.peek(0).value)
+            self.restore_to(TokenType.SPACE)
+            return errExpr(err_source)
 
-                self.log("pop expr from stack")
-                top = self.stack.pop()
-                if top != ParseState.EXPR:
-                    self.log(f"not expr on top, {top}")
-                    self.dump_state()
-                    raise ValueError(f"Expected expr on top of the stack, got {top} instead")
+        if self.match(TokenType.NUM):
+            return SetVolume(int(self.advance().value),source)
 
-                return expression
-            
-            if self.match(TokenType.NUM):
-                expression = SetVolume(int(self.advance().value),source)
-            else:
-                err_source = self.peek(0)
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected note literal after plus{self.log_tk()}")
-                self.restore_to(TokenType.SPACE)
-                expression = errExpr(err_source)
-        # Parse SetTone
-        elif self.match(TokenType.PLUS):
-            source = self.advance()
-            if self.peek(0).type in NOTES:
-                note = self.advance()
-                expression = SetTone(1,note,source)
-            else:
-                self.err_list.append(f"""{SyntaxErr(self.peek(0))}Expected note literal after plus \"{self.source.value}\" {self.log_tk}
-| Tip: '+' increase the pitch of a note by a semitone for the entire movement""")                
-                expression = errExpr(self.peek(0))
-        
-        elif self.match(TokenType.DASH):
-            source = self.advance()
-            if self.peek(0).type in NOTES:
-                note = self.advance()
-                expression = SetTone(-1,note,source)
-            else:
-                self.err_list.append(f"""{SyntaxErr(self.peek(0))}Expected note literal after dash \"{self.source.value}\" {self.log_tk}
-| Tip: '-' lowers the pitch of a note by a semitone for the entire movement""")
-                expression =  errExpr(self.peek(0))
-
-        # Parse SetOctave
-        elif self.match(TokenType.GREATER_THAN):
-            source = self.advance()
-            oct = 0
-            if self.match(TokenType.NUM):
-                oct = int(self.advance().value)
+        err_source = self.peek(0)
+        self.error(Code.VOLUME_NUMBER, self.peek(0), source.value, self.peek(0).value)
+        self.restore_to(TokenType.SPACE)
+        return errExpr(err_source)
 
-            expression =SetOctave(1,oct,source)
+    # Parse SetTone
+    def parse_sharp(self):
+        source = self.advance()
+        if self.peek(0).type in NOTES:
+            note = self.advance()
+            return SetTone(1,note,source)
 
-        # Parse SetOctave        
-        elif self.match(TokenType.LESS_THAN):
-            source = self.advance()
-            oct = 0
-            if self.match(TokenType.NUM):
-                oct = int(self.advance().value)
+        self.error(Code.SHARP_NOTE, self.peek(0), self.peek(0).value)
+        return errExpr(self.peek(0))
 
-            expression = SetOctave(-1,oct,source)
+    def parse_flat(self):
+        source = self.advance()
+        if self.peek(0).type in NOTES:
+            note = self.advance()
+            return SetTone(-1,note,source)
 
-        # Parse SetDuration
-        elif self.match(TokenType.COLON):
-            source = self.advance()
-            
-            if self.match(TokenType.NUM):
-                x = self.advance()
-                over = None
-                if self.expect(TokenType.SLASH):
-                    over = self.expect(TokenType.NUM)
-                
-                duration = int(x.value) if over is None else Fraction(int(x.value),int(over.value))
+        self.error(Code.FLAT_NOTE, self.peek(0), self.peek(0).value)
+        return errExpr(self.peek(0))
 
-                expression = SetDuration(duration,source)
-            else:
-                self.err_list.append(f"""{SyntaxErr(self.peek(0))}After colon expression expected number{self.log_tk()}
-| Tip: ':' fallowed directly by a number is used to set the duration of a single note for the given track""")
-                expression = errExpr(self.peek(0))
+    # Parse SetOctave
+    def parse_octave_up(self):
+        source = self.advance()
+        oct = 0
+        if self.match(TokenType.NUM):
+            oct = int(self.advance().value)
 
-        # Parse SetMeasure
-        elif self.match(TokenType.BANG):
-            source = self.advance()
+        return SetOctave(1,oct,source)
 
-            if self.match(TokenType.NUM):
-                x = int(self.advance().value)
+    # Parse SetOctave
+    def parse_octave_down(self):
+        source = self.advance()
+        oct = 0
+        if self.match(TokenType.NUM):
+            oct = int(self.advance().value)
 
-                if self.expect(TokenType.SLASH) is None:
-                    err_source = self.peek(-1)
-                    self.err_list.append(f"{SyntaxErr(self.peek(-1))}Measures are defined as number/number, after number got {self.peek(-1)} instead of \"/\"  ")
-                    self.restore_to(TokenType.SPACE)
-                    expression = errExpr(err_source)
+        return SetOctave(-1,oct,source)
 
-                if self.match(TokenType.NUM):
-                    over = int(self.advance().value)
-                else:
-                    self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected number after defining measure{self.log_tk()}")
-                    self.restore_to(TokenType.SPACE)
+    # Parse SetDuration
+    def parse_duration(self):
+        source = self.advance()
 
-                expression = SetMeasure(x,over,source)
-            else:
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected a number after \"!\"{self.log_tk()} ")
-                self.restore_to(TokenType.SPACE)
+        if self.match(TokenType.NUM):
+            x = self.advance()
+            over = None
+            if self.expect(TokenType.SLASH):
+                over = self.expect(TokenType.NUM)
 
+            duration = int(x.value) if over is None else Fraction(int(x.value),int(over.value))
 
-        # Parse SetTempo
-        elif self.match(TokenType.CARROT):
-            source = self.advance()
+            return SetDuration(duration,source)
 
-            if self.match(TokenType.NUM):
-                x = int(self.advance().value)
+        self.error(Code.DURATION_NUMBER, self.peek(0), self.peek(0).value)
+        return errExpr(self.peek(0))
 
-                tempo = x
-                expression =SetTempo(tempo,source)
-            else:
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected number after '^'",self.log_tk())
+    # Parse SetMeasure
+    def parse_measure(self):
+        source = self.advance()
+
+        if self.match(TokenType.NUM):
+            x = int(self.advance().value)
+
+            if self.expect(TokenType.SLASH) is None:
+                self.error(Code.MEASURE_SLASH, self.peek(0), self.peek(0).value)
                 self.restore_to(TokenType.SPACE)
 
-        # Parse Bar
-        elif self.match(TokenType.PIPE):
-            expression =Bar(self.advance())
+            over = 4 # only read with no errors
+            if self.match(TokenType.NUM):
+                over = int(self.advance().value)
+            else:
+                self.error(Code.MEASURE_NUMBER, self.peek(0), self.peek(0).value)
+                self.restore_to(TokenType.SPACE)
 
-        # Parse SetInterval
-        elif self.match(TokenType.NUM):
-            # it's a duration
-            expression =SetInterval(self.advance())
+            return SetMeasure(x,over,source)
+
+        err_source = self.peek(0)
+        self.error(Code.MEASURE_BANG, self.peek(0), self.peek(0).value)
+        self.restore_to(TokenType.SPACE)
+        return errExpr(err_source)
+
+    # Parse SetTempo
+    def parse_tempo(self):
+        source = self.advance()
+
+        if self.match(TokenType.NUM):
+            x = int(self.advance().value)
+
+            tempo = x
+            return SetTempo(tempo,source)
+
+        err_source = self.peek(0)
+        self.error(Code.TEMPO_NUMBER, self.peek(0), self.peek(0).value)
+        self.restore_to(TokenType.SPACE)
+        return errExpr(err_source)
+
+    # Parse Bar
+    def parse_bar(self):
+        return Bar(self.advance())
+
+    # Parse SetInterval
+    def parse_interval(self):
+        # it's a duration
+        return SetInterval(self.advance())
+
+    # Parse Repetition, it's a postfix operator so it always comes after an expression
+    def parse_repetition(self):
+        source = self.advance()
+        n = int(self.advance().value)
+        return Repetition(n,source)
+
+    # Parse ReleaseNote, postfix too
+    def parse_release(self):
+        source = self.advance()
+        return ReleaseNote(source)
+
+    # Parse Note or chord
+    def parse_note(self):
+        # parse notes
+        note_p = self.advance()
+
+        semitone = 0 # placeholder for default value
+        octave = -1 # placeholder for default value
+        duration = -1 # placeholder for default value
+        # notes are the most common expression, look at the type of the next
+        # token once per step instead of calling match() for every suffix
+        kind = self.peek(0).type
+
+        # parse semitones
+        while kind == TokenType.PLUS or kind == TokenType.DASH:
+            semitone += 1 if kind == TokenType.PLUS else -1
+            self.advance()
+            kind = self.peek(0).type
 
+        if kind == TokenType.DOT:
+            self.advance()
+            if self.match(TokenType.NUM):
+                octave = int(self.advance().value)
+            kind = self.peek(0).type
+
+        if kind == TokenType.SLASH:
+            # parsing chord
+            self.advance() #consume slash
+            curr_note = Note(note_p,semitone,octave,duration)
+            notes = [curr_note]
+            self.push_expr()
+            while self.peek(0).type not in [TokenType.NL, TokenType.SPACE]:
+                note = self.parse_expr()
+                if isinstance(note,Note):
+                    notes.append(note)
+                    self.pop_expr()
+                    return Chord(notes,note_p)
+
+                elif isinstance(note,Chord):
+                    notes.extend(note.notes)
+                    self.pop_expr()
+                    return Chord(notes,note_p)
+
+                elif isinstance(note,Ident):
+                    notes.append(note)
+                    self.pop_expr()
+                    return Chord(notes,note_p)
 
-# compound expressions
+                else:
+                    self.error(Code.CHORD_NOTE, self.peek(0), note)
+            self.pop_expr()
+            kind = self.peek(0).type
 
-        # Parse Repetition
-        elif self.match(TokenType.ASTERISK):
-            source = self.advance()
-            n = int(self.advance().value)
-            if self.stack[-1] == ParseState.EXPR:
-                expression = Repetition(n,source)
-            else:
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Repetition postfix operator can only be used after an expression{self.log_tk()}")
+        if kind == TokenType.COLON:
+            self.advance()
 
-        # Parse ReleaseNote
-        elif self.match(TokenType.CLOSE_PAREN):
-            source = self.advance()
-            if self.stack[-1] == ParseState.EXPR:
-                expression = ReleaseNote(source)
-            else:
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Close paren postfix operator can only be used after an expression{self.log_tk()}")
+            if self.match(TokenType.NUM):
+                x = self.advance()
+                duration = float(x.value)
+                if self.match(TokenType.SLASH):
+                    self.advance()
+                    over = self.expect(TokenType.NUM)
+                    if over is not None:
+                        # kept exact, it becomes a number of ticks when lowering
+                        duration = Fraction(int(x.value),int(over.value))
 
-        # Parse HoldNote
-        elif self.match(TokenType.OPEN_PAREN):
-            #parse hold
-            source = self.advance()
-            note = self.parse_expr()
-            if isinstance(note,Note) or isinstance(note,Chord) or isinstance(note,Ident):
-                expression =HoldNote(note,source)
-            else:
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected note or identifier after open parenthesis{self.log_tk()}")
-                self.retore_to_space()
-
-        # Parse ExprGroup
-        elif self.match(TokenType.OPEN_BRACKET):
-
-            source = self.advance()
-            self.skip_whitespace()
-            exprs = []
-            # gotta parse a expr group
-            while not self.match(TokenType.CLOSE_BRACKET):
-                exprs.append(self.parse_expr())
-                self.skip_whitespace() #whitespace doesn't matter within a expr group
-            
-            self.advance() # skip close bracket
+            elif self.match(TokenType.SLASH):
+                self.advance() #consume slash token
 
-            # space doesn't matter after parsing an expr
-            self.skip_space()
-            
-            expression =ExprGroup(exprs,source)
-
-
-        # Parse ident or chord
-        elif self.match(TokenType.ALPHANUM):
-            ident = self.advance()
-
-            if ident.value not in self.idents.keys():
-                self.idents[ident.value] = ident
-
-            if self.match(TokenType.SLASH):
-                # parsing chord
-                self.advance()
-                curr_ident = Ident(ident)
-                notes = [curr_note]
-                while self.peek(0).type not in [TokenType.NL, TokenType.SPACE]:
-                    ident = self.parse_expr()
-                    if isinstance(ident,Note):
-                        notes.append(ident)
-                        self.stack.pop()
-                        return Chord(notes,ident)
-                    
-                    if isinstance(ident,Chord):
-                        notes.extend(ident.notes)
-                        self.stack.pop()
-                        return Chord(notes,ident)
+                if self.match(TokenType.NUM):
+                    duration = Fraction(1,int(self.advance().value))
+                else:
+                    self.error(Code.SLASH_NUMBER, self.peek(0), self.peek(0).value)
+                    self.restore_to(TokenType.SPACE)
 
-                    if isinstance(ident,Ident):
-                        notes.append(ident)
-                        self.stack.pop()
-                        return Chord(notes,ident)
+            else :
+                self.error(Code.NOTE_DURATION, self.peek(0), self.peek(0).value)
 
+        return Note(note_p,semitone,octave,duration)
 
-                    self.err_list.append(f"{SyntaxErr(self.peek(0))}Chords can only be formed from notes,using \"{ident.value}\" is not valid")
-                    self.restore_to(TokenType.SPACE)
-            
-            # parse Macro appl
-            elif self.match(TokenType.OPEN_PAREN):
-                self.advance()
-                self.skip_space()
-                args = []
-                while True:
-                    args.append(self.parse_expr())
-                    
-                    self.skip_whitespace()
 
-                    if self.expect(TokenType.CLOSE_PAREN):
-                        break
-                    
-                    if self.expect(TokenType.COMMA):
-                        continue
-                    else:
-                        self.err_list.append(f"{SyntaxErr(self.peek(0))}Expected comma or close parenthesis after expression in argument list",self.log_tk())
-                        self.restore_to(TokenType.CLOSE_PAREN)
+# compound expressions
 
-                self.stack.pop() # preserve parse stack state
-                return MacroCall(ident,args)
-            elif self.match(TokenType.SPACE):
-                pass
-            elif self.match(TokenType.NL):
-                pass
-            elif self.match(TokenType.CLOSE_PAREN):
-                pass
-            else :
-                self.err_list.append(f"{SyntaxErr(self.peek(0))}Unexpected token after identifier{self.peek(0).value}")
-                expresion = errExpr(self.peek(0))
-                self.restore_to(TokenType.SPACE)
+    # Parse HoldNote
+    def parse_hold(self):
+        #parse hold
+        source = self.advance()
+        self.push_expr()
+        note = self.parse_expr()
+        self.pop_expr()
+        if isinstance(note,Note) or isinstance(note,Chord) or isinstance(note,Ident):
+            return HoldNote(note,source)
+
+        err_source = self.peek(0)
+        self.error(Code.HOLD_NOTE, self.peek(0), self.peek(0).value)
+        self.restore_to(TokenType.SPACE)
+        return errExpr(err_source)
+
+    # Parse ExprGroup
+    def parse_group(self):
+        source = self.advance()
+        self.skip_whitespace()
+        exprs = []
+        self.push_expr()
+        # gotta parse a expr group
+        while not self.match(TokenType.CLOSE_BRACKET):
+            exprs.append(self.parse_expr())
+            self.skip_whitespace() #whitespace doesn't matter within a expr group
+        self.pop_expr()
 
-            # if it doesn't match anything else, it's just an identifier
-            expression =Ident(ident)
+        self.advance() # skip close bracket
 
-        
-        # Parse Note or chord
-        elif self.peek(0).type in NOTES:
-            # parse notes
-            note_p = self.advance()
-
-            semitone = 0 # placeholder for default value
-            octave = -1 # placeholder for default value
-            duration = -1 # placeholder for default value
-            # parse semitones 
-            while True:
-                if self.match(TokenType.PLUS):
-                    semitone +=1
-                    self.advance()
-                elif self.match(TokenType.DASH):
-                    semitone -=1
-                    self.advance()
-                else:
-                    break
+        # space doesn't matter after parsing an expr
+        self.skip_space()
 
+        return ExprGroup(exprs,source)
 
-            if self.match(TokenType.DOT):
-                self.advance()
-                if self.match(TokenType.NUM):
-                    octave = int(self.advance().value)
-
-            if self.match(TokenType.SLASH):
-                # parsing chord
-                self.advance() #consume slash
-                curr_note = Note(note_p,semitone,octave,duration)
-                notes = [curr_note]
-                while self.peek(0).type not in [TokenType.NL, TokenType.SPACE]:
-                    note = self.parse_expr()
-                    if isinstance(note,Note):
-                        notes.append(note)
-                        self.stack.pop()
-                        return Chord(notes,note_p)
-                    
-                    elif isinstance(note,Chord):
-                        notes.extend(note.notes)
-                        self.stack.pop()
-                        return Chord(notes,note_p)
+    # Parse ident or chord
+    def parse_ident(self):
+        ident = self.advance()
+        self.used[ident.value] = True
 
-                    elif isinstance(note,Ident):
-                        notes.append(note)
-                        self.stack.pop()
-                        return Chord(notes,note_p)
+        if ident.value not in self.idents.keys():
+            self.idents[ident.value] = ident
 
-                    else:
-                        self.err_list.append(f"{SyntaxErr(self.peek(0))}Chords can only be formed from notes,using {note} is not valid, notes= {notes}, curr{self.peek(0)}")
-                        
+        if self.match(TokenType.SLASH):
+            # parsing chord
+            self.advance()
+            curr_ident = Ident(ident)
+            notes = [curr_note]
+            self.push_expr()
+            while self.peek(0).type not in [TokenType.NL, TokenType.SPACE]:
+                ident = self.parse_expr()
+                if isinstance(ident,Note):
+                    notes.append(ident)
+                    self.pop_expr()
+                    return Chord(notes,ident)
+
+                if isinstance(ident,Chord):
+                    notes.extend(ident.notes)
+                    self.pop_expr()
+                    return Chord(notes,ident)
+
+                if isinstance(ident,Ident):
+                    notes.append(ident)
+                    self.pop_expr()
+                    return Chord(notes,ident)
+
+
+                self.error(Code.CHORD_NOTE, self.peek(0), ident)
+                self.restore_to(TokenType.SPACE)
+            self.pop_expr()
 
-            if self.match(TokenType.COLON):
-                self.advance()
+        # parse Macro appl
+        elif self.match(TokenType.OPEN_PAREN):
+            self.advance()
+            self.skip_space()
+            args = []
+            self.push_expr()
+            while True:
+                args.append(self.parse_expr())
 
-                if self.match(TokenType.NUM):
-                    duration = float(self.advance().value)
-                    if self.match(TokenType.SLASH):
-                        self.advance()
-                        over = self.expect(TokenType.NUM)
-                        if over is not None:
-                            duration = duration / int(over.value)
+                self.skip_whitespace()
 
-                elif self.match(TokenType.SLASH):
-                    self.advance() #consume slash token
+                if self.expect(TokenType.CLOSE_PAREN):
+                    break
 
-                    if self.match(TokenType.NUM):
-                        duration = Fraction(1,int(self.advance().value))
-                    else:
-                        self.err_list.append(f"{SyntaxErr(self.peek(0))}After slash expected a number",self.log_tk())
-                        self.restore_to(TokenType.SPACE)
+                if self.expect(TokenType.COMMA):
+                    continue
+                else:
+                    self.error(Code.ARGUMENT_LIST, self.peek(0), self.peek(0).value)
+                    self.restore_to(TokenType.CLOSE_PAREN)
 
-                else :
-                    self.err_list.append(f"{SyntaxErr(self.peek(0))}After colon in note definition expected a number",self.log_tk())
-            
-            expression =Note(note_p,semitone,octave,duration)
-        elif self.match(TokenType.EOF):
+            self.pop_expr() # preserve parse stack state
+            return MacroCall(ident,args)
+        elif self.match(TokenType.SPACE):
             pass
+        elif self.match(TokenType.NL):
+            pass
+        elif self.match(TokenType.CLOSE_PAREN):
+            pass
+        else :
+            self.error(Code.IDENT_TOKEN, self.peek(0), self.peek(0).value)
+            self.restore_to(TokenType.SPACE)
 
-        else:
-            self.err_list.append(f"{SyntaxErr(self.peek(0))}Unexpected token while parsing expressions: {self.peek(0).value} ")
-
-        top = self.stack.pop()
-        if top != ParseState.EXPR:
-            self.dump_state()
-            raise ValueError(f"Expected expr on top of the stack, got {top} instead")
+        # if it doesn't match anything else, it's just an identifier
+        return Ident(ident)
 
-        if expression is None:
-            self.dump_state()
-            raise ValueError(f"Expression must not be none",self.log_tk())
+    def parse_eof(self):
+        pass
 
-        return expression
+    def parse_unexpected(self):
+        self.error(Code.EXPRESSION_TOKEN, self.peek(0), self.peek(0).value)
 
 
 # helper parser functions
     def skip_space(self):
-        self.log(f"skip space after {self.peek(0)}")
+        if self.trace_level >= TraceLevel.DEBUG:
+            self.log("skip space after %s", self.peek(0))
         while self.peek(0).type == TokenType.SPACE:
             self.advance()
 
     def skip_whitespace(self):
-        self.log(f"skip whitespace after {self.peek(0)}")
+        if self.trace_level >= TraceLevel.DEBUG:
+            self.log("skip whitespace after %s", self.peek(0))
         while self.peek(0).type == TokenType.SPACE or self.peek(0).type == TokenType.NL:
             self.advance()
 
     def skip_newlines(self):
-        self.log(f"skip newline after {self.peek(0)}")
         """Skip any newline tokens"""
+        if self.trace_level >= TraceLevel.DEBUG:
+            self.log("skip newline after %s", self.peek(0))
         while self.peek(0).type == TokenType.NL:
             self.advance()
 
-    def log_tk(self):
-        return f", got token \"{self.peek(0).value}\" instead\n"
-
     def dump_state(self):
         print(self.stack)
         print("Recent tokens")
@@ -744,7 +854,7 @@ class Parser:
             print(tk)
 
         print("Recent logs:")
-        for log in self.log_list[-10:]:
+        for log in self.format_logs()[-10:]:
             print(log)
 
         print("Errors found:")
@@ -754,8 +864,18 @@ class Parser:
 # error recovery parser functions
     def restore_stmt(self):
        
-        self.log(f"restore statement from error at {self.peek(0)}")
-        if self.peek(0).type == TokenType.OPEN_BRACKET:
+        if self.trace_level >= TraceLevel.ERROR:
+            self.log("restore statement from error at %s", self.peek(0), level=TraceLevel.ERROR)
+        if self.peek(0).type == TokenType.COLON:
+            # the error is at the colon itself, stopping there would find the
+            # same error again
+            self.advance()
+        elif self.peek(0).type == TokenType.OPEN_BRACKET:
+            # jump straight to the matching bracket when it's already known
+            close = self.index.matching_bracket(self.pos) if self.index is not None else None
+            if close is not None:
+                self.pos = close
+            else:
                 self.restore_to(TokenType.CLOSE_BRACKET)
         while self.peek(0).type != TokenType.NL and \
                 self.peek(0).type != TokenType.COLON and \
@@ -764,15 +884,8 @@ class Parser:
 
 
     def restore_to(self,*args):
-        self.log(f"restore to {args} from error at {self.peek(0)}")
-        while self.peek(0).type not in args:
+        if self.trace_level >= TraceLevel.ERROR:
+            self.log("restore to %s from error at %s", args, self.peek(0), level=TraceLevel.ERROR)
+        while self.peek(0).type not in args and self.peek(0).type != TokenType.EOF:
             self.advance()
 
-
-# helper err functions
-def SyntaxErr(token):
-    return f"Syntax Error({token.line},{token.column}):"
-
-def Ident_err(token):
-    return f"Identifier Error({token.line},{token.column}):"
-
@@ -0,0 +1,7 @@
+# NumPy for the compiler modules, use: from numeric import np
+#
+# numpy loads the standard ast module, see stdlib.py
+from stdlib import standard_library
+
+with standard_library():
+    import numpy as np
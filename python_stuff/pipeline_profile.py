@@ -0,0 +1,88 @@
+# Time and memory of every stage of the compiler, for compiler.py --profile
+#
+# Every stage records its wall time and the peak of the memory allocated
+# while it ran (tracemalloc, above what was in use when it started), plus
+# whatever counts the caller adds to its record (tokens, nodes, events).
+# A disabled profile records nothing and costs nothing, so the compiler can
+# always go through it.
+import contextlib
+import json
+import time
+import tracemalloc
+
+from ast import count_nodes
+
+# (key in the records, column title, format)
+COLUMNS = [
+    ("stage", "stage", "{:<20}"),
+    ("seconds", "ms", "{:>10.2f}"),
+    ("peak_bytes", "peak KB", "{:>10.1f}"),
+    ("tokens", "tokens", "{:>9}"),
+    ("nodes_before", "nodes in", "{:>9}"),
+    ("nodes_after", "nodes out", "{:>9}"),
+    ("events", "events", "{:>9}"),
+]
+
+class PipelineProfile:
+    def __init__(self, enabled=True, memory=True):
+        self.enabled = enabled
+        self.memory = memory and enabled
+        self.stages = []
+        self.started = False # tracemalloc was started by us
+
+    # with profile.stage("parse") as record: ... times the block, the caller
+    # can add counts to record
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        record = {"stage": name}
+        record.update(counts)
+        if not self.enabled:
+            yield record
+            return
+
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started = True
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if self.memory:
+                record["peak_bytes"] = tracemalloc.get_traced_memory()[1] - base
+            self.stages.append(record)
+
+    # node count of the tree, only when profiling (it walks the whole tree)
+    def nodes(self, ast):
+        return count_nodes(ast) if self.enabled else None
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def total_seconds(self):
+        return sum(record["seconds"] for record in self.stages)
+
+    def table(self):
+        lines = [" ".join(fmt.replace(".2f", "").replace(".1f", "").format(title) for _, title, fmt in COLUMNS)]
+        for record in self.stages + [{"stage": "total", "seconds": self.total_seconds()}]:
+            cells = []
+            for key, _, fmt in COLUMNS:
+                value = record.get(key)
+                if value is None:
+                    cells.append(fmt.replace(".2f", "").replace(".1f", "").format(""))
+                elif key == "seconds":
+                    cells.append(fmt.format(value * 1000))
+                elif key == "peak_bytes":
+                    cells.append(fmt.format(value / 1024))
+                else:
+                    cells.append(fmt.format(value))
+            lines.append(" ".join(cells))
+        return "\n".join(lines)
+
+    def to_json(self):
+        return json.dumps({"stages": self.stages, "total_seconds": self.total_seconds()}, indent=1)
@@ -0,0 +1,174 @@
+# Local compile server for the editor, run with: python server.py [--port 8765]
+#
+# POST /compile with {"session": "...", "source": "..."} answers
+# {"diagnostics": [...], "midi": "<base64 of the .mid file>"}, every
+# diagnostic is Diagnostic.to_dict() (code, severity, line, column, span,
+# args, message, tip). With "check": true it only looks for errors and
+# "midi" is null. Compiles run in one pool of worker processes, every worker
+# keeps the CompileSessions (and so the parsed statements) of the sessions it
+# compiled, a request that lands on another worker parses again. When a
+# newer request of the same session comes in, the older one is cancelled if
+# it hasn't started yet, or its result is dropped, and it answers
+# {"cancelled": true}.
+import argparse
+import base64
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from stdlib import standard_library
+with standard_library(): # asyncio loads the standard ast module
+    import asyncio
+
+from session import CompileSession
+from midiwriter import write_smf
+from diagnostics import Diagnostic
+
+MAX_BODY = 16 * 1024 * 1024
+SESSIONS_PER_WORKER = 32
+
+# compile sessions of a worker process, least recently used first
+sessions = OrderedDict()
+
+# compiled once by every worker when the server starts, the first compile of
+# a process fills the tables and caches of the compiler (instruments, bytecode
+# of the lowering) and is much slower than the next ones
+WARM_UP_SOURCE = "piano: :1/4 do re mi fa |\n"
+
+def warm_up():
+    session = CompileSession()
+    session.compile(WARM_UP_SOURCE)
+    write_smf(session.events)
+
+def compile_in_worker(session_id, source, check=False):
+    session = sessions.pop(session_id, None)
+    if session is None:
+        session = CompileSession()
+    sessions[session_id] = session
+    if len(sessions) > SESSIONS_PER_WORKER:
+        sessions.popitem(last=False)
+
+    try:
+        program = session.check(source) if check else session.compile(source)
+    except Exception as error:
+        # the session may be half updated, start over next time
+        del sessions[session_id]
+        return {"diagnostics": [Diagnostic.from_exception(error).to_dict()], "midi": None}
+
+    result = {
+        "diagnostics": program.err_list.to_json(),
+        "midi": None,
+        "parsed": session.parsed,
+        "reused": session.reused,
+    }
+    if len(program.err_list) == 0 and not check:
+        result["midi"] = base64.b64encode(bytes(write_smf(session.events))).decode("ascii")
+    return result
+
+
+class CompileServer:
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(workers)
+        self.pending = {}  # session id -> future of its last request
+        self.sequence = {} # session id -> number of its last request
+
+    # starts the workers (one process per submit while none is idle) and has
+    # each of them compile the warm up score
+    def warm_up(self):
+        for _ in range(self.workers):
+            self.pool.submit(warm_up)
+
+    async def compile(self, session_id, source, check=False):
+        seq = self.sequence[session_id] = self.sequence.get(session_id, 0) + 1
+        previous = self.pending.pop(session_id, None)
+        if previous is not None:
+            previous.cancel() # only works if it didn't start yet
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, compile_in_worker, session_id, source, check)
+        self.pending[session_id] = future
+        try:
+            result = await future
+        except asyncio.CancelledError:
+            if self.sequence[session_id] == seq:
+                raise # this request itself was cancelled
+            result = None
+        finally:
+            if self.pending.get(session_id) is future:
+                del self.pending[session_id]
+
+        if self.sequence[session_id] != seq:
+            return {"cancelled": True}
+        return result
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            method, path = request_line.decode("latin-1").split(" ")[:2]
+            if method == "OPTIONS":
+                await self.respond(writer, 204, None)
+            elif method != "POST" or path != "/compile":
+                await self.respond(writer, 404, {"error": f"{method} {path} not found"})
+            else:
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "request too large"})
+                    return
+                request = json.loads(await reader.readexactly(length))
+                result = await self.compile(str(request.get("session", "")), request["source"],
+                                            bool(request.get("check", False)))
+                await self.respond(writer, 200, result)
+        except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError) as error:
+            await self.respond(writer, 400, {"error": f"bad request: {error}"})
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        reason = {200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            # the editor runs on another port in development
+            f"Access-Control-Allow-Origin: *\r\n"
+            f"Access-Control-Allow-Methods: POST, OPTIONS\r\n"
+            f"Access-Control-Allow-Headers: Content-Type\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        self.warm_up()
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description="Compile server for the editor")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("-j", "--workers", type=int, default=2, help="number of compile processes")
+    args = arg_parser.parse_args()
+
+    server = CompileServer(args.workers)
+    listener = await server.serve(args.host, args.port)
+    print(f"Compile server listening on http://{args.host}:{args.port}/compile")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
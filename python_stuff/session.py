@@ -0,0 +1,262 @@
+# Incremental compilation, for editors that compile the same document again
+# after every change.
+#
+# The source is split in top level statements (titles, macros, tracks and
+# movements). Every statement is lexed and parsed on its own and kept with
+# its text as key, so after an edit only the statements that changed are
+# parsed again. A statement is parsed as if it started on line 1, when it is
+# reused on another line its tokens and errors are moved there. Movements
+# are expanded again only if they changed or one of
+# the macros they use (directly or not) changed, and tracks are rendered
+# again only if one of their movements was expanded again.
+from lexer import Tokenizer
+from new_parser import Parser
+from ast import *
+from simplify import *
+from midigen import render_track, merge_tracks, check_program
+from lowering import ticks_per_quarter_for
+from midiwriter import write_smf_file
+
+
+# Returns (line, text) for every top level statement of source. The source
+# is tokenized once: a statement ends at the first newline token after it
+# that isn't inside a [ ] group, the groups are skipped with the bracket
+# matching of the TokenIndex (an unclosed one goes on to the end of the
+# file, like for the parser). Empty and comment lines between statements are
+# left out, the text of a statement is its whole lines. The tokenizer never
+# reads the last character of a text, so a statement ending at a newline
+# gets one more: its own newline is then a token, like in the whole source.
+def split_statements(source):
+    tokenizer = Tokenizer(source)
+    tokens = tokenizer.tokenize()
+    brackets = tokenizer.index.brackets
+    lines = source.split("\n")
+    statements = []
+    start = None # line of the first token of the statement
+    end = len(tokens) - 2 # the NL and EOF tokens added after the source
+    i = 0
+    while i < end:
+        token_type = tokens[i].type
+        if token_type == TokenType.NL:
+            if start is not None:
+                statements.append((start, "\n".join(lines[start - 1:tokens[i].line]) + "\n\n"))
+                start = None
+        elif token_type != TokenType.SPACE:
+            if start is None:
+                start = tokens[i].line
+            if token_type == TokenType.OPEN_BRACKET:
+                i = brackets.get(i, end)
+                continue
+        i += 1
+
+    if start is not None:
+        # the rest of the source, as it is so the last character is read the
+        # same way (the tokenizer never starts a token on it)
+        statements.append((start, "\n".join(lines[start - 1:])))
+    return statements
+
+
+# One statement parsed on its own, with the repeats and groups already
+# resolved (they don't depend on other statements). key tells it apart from
+# other statements with the same text.
+class Statement:
+    def __init__(self, text, key):
+        tokenizer = Tokenizer(text)
+        self.tokens = tokenizer.tokenize()
+        program = Parser(self.tokens, index=tokenizer.index).parse()
+        parsed = len(program.err_list)
+        resolve_repeats(program)
+        flatten_expr_group(program)
+
+        self.key = key
+        self.text = text
+        self.line = 1 # where its tokens and errors are
+        self.metadata = program.metadata
+        self.macros = program.macros
+        # without a track statement the parser puts the movements in a
+        # global track, they really belong to the last track before them
+        self.has_track = tokenizer.index.has_track()
+        self.tracks = program.tracks
+        # a full compile finds the errors of the repeats after parsing the
+        # whole file, they go after the parse errors of all the statements
+        self.errors = program.err_list[:parsed]
+        self.repeat_errors = program.err_list[parsed:]
+        self.deps = program.deps
+
+    # puts the tokens (and so the ast) and the errors at line
+    def move(self, line):
+        offset = line - self.line
+        if offset == 0:
+            return
+        for token in self.tokens:
+            token.line += offset
+        for error in self.errors + self.repeat_errors:
+            if error.line is not None:
+                error.line += offset
+        self.line = line
+
+
+class CompileSession:
+    def __init__(self):
+        self.statements = {} # text -> Statements with that text, in order
+        self.serial = 0      # for the keys of new statements
+        self.expanded = {}   # movement key -> (expressions with the macros inlined, errors)
+        self.rendered = {}   # track key -> ((events, errors) from render_track, lines of its statements)
+        self.macro_cache = MacroCache() # bodies of the macro calls, kept while the macros don't change
+
+        self.program = None
+        self.events = None
+
+        # what the last compile had to do again, and what it reused
+        self.parsed = 0
+        self.reused = 0
+        self.expansions = 0
+        self.renders = 0
+
+    # Compiles source, returns the program with the macros resolved and keeps
+    # its events in self.events
+    def compile(self, source):
+        program, movements = self.prepare(source)
+        self.events = self.render(program, movements)
+        self.program = program
+        return program
+
+    # Like compile, but only looks for errors: the bars are checked without
+    # generating the events
+    def check(self, source):
+        program, movements = self.prepare(source)
+        program.err_list.extend(check_program(program))
+        self.events = None
+        self.program = program
+        return program
+
+    # parses what changed and expands the macros, returns the program and
+    # its movements (see link)
+    def prepare(self, source):
+        self.parsed = self.reused = self.expansions = self.renders = 0
+
+        statements = []
+        unused = {text: list(found) for text, found in self.statements.items()}
+        for line, text in split_statements(source):
+            found = unused.get(text)
+            if found:
+                statement = found.pop(0)
+                self.reused += 1
+            else:
+                self.serial += 1
+                statement = Statement(text, (text, self.serial))
+                self.parsed += 1
+            statement.move(line)
+            statements.append(statement)
+
+        self.statements = {}
+        for statement in statements:
+            self.statements.setdefault(statement.text, []).append(statement)
+
+        program, movements = self.link(statements)
+        self.expand(program, movements)
+        return program, movements
+
+    # puts the statements together in a program, with the same checks across
+    # statements as the parser. Returns the program and, for every track,
+    # (statement, index in the statement, movement) for each of its movements
+    def link(self, statements):
+        linker = Parser([])
+        movements = []
+        errors = DiagnosticList()
+        self.macro_statements = {} # macro name -> statement defining it
+        for statement in statements:
+            # the parser declares a macro before parsing its body
+            linker.err_list = DiagnosticList()
+            for macro in statement.macros:
+                linker.declare_macro(macro.name)
+            errors.extend(linker.err_list)
+            errors.extend(statement.errors)
+            linker.err_list = DiagnosticList()
+
+            linker.metadata.extend(statement.metadata)
+            for macro in statement.macros:
+                linker.add_macro(macro, statement.deps.macros[macro.name.value])
+                self.macro_statements[macro.name.value] = statement
+
+            index = 0
+            for t_id, track in enumerate(statement.tracks):
+                if statement.has_track:
+                    linker.tracks.append(Track(track.name, [], track.source))
+                for m_id, movement in enumerate(track.movements):
+                    linker.add_movement(Movement(movement.instrument, movement.tag, movement.expressions),
+                                        statement.deps.movements[(t_id, m_id)])
+                    while len(movements) < len(linker.tracks):
+                        movements.append([])
+                    movements[-1].append((statement, index, movement))
+                    index += 1
+
+            errors.extend(linker.err_list)
+        for statement in statements:
+            errors.extend(statement.repeat_errors)
+
+        if not linker.tracks:
+            linker.tracks.append(Track("global", [], None))
+        while len(movements) < len(linker.tracks):
+            movements.append([])
+
+        program = Program(linker.metadata, linker.macros, linker.tracks, None, linker.idents, errors,
+                          deps=linker.deps)
+        return program, movements
+
+    # keys of the macro statements a movement depends on, so it is expanded
+    # again when one of them changes
+    def dependencies(self, program, t_id, m_id):
+        keys = []
+        for name in program.deps.closure(program.deps.movements[(t_id, m_id)]):
+            statement = self.macro_statements.get(name)
+            if statement is not None:
+                keys.append(statement.key)
+        return tuple(sorted(keys))
+
+    # The errors of the macros themselves are found by the expander every
+    # time. Movements with errors are expanded every time too, their errors
+    # have the lines of the statements when they were found.
+    def expand(self, program, movements):
+        expander = MacroExpander(program, self.macro_cache)
+        errors = list(expander.errors)
+        expanded = {}
+        self.movement_keys = []
+        for t_id, track in enumerate(program.tracks):
+            keys = []
+            for m_id, (statement, index, movement) in enumerate(movements[t_id]):
+                key = (statement.key, index, self.dependencies(program, t_id, m_id))
+                entry = self.expanded.get(key)
+                if entry is None or entry[1]:
+                    found = len(expander.errors)
+                    entry = (expander.expand(movement.expressions), expander.errors[found:])
+                    self.expansions += 1
+                expanded[key] = entry
+                track.movements[m_id].expressions = entry[0]
+                errors.extend(entry[1])
+                keys.append(key)
+            self.movement_keys.append(keys)
+        self.expanded = expanded
+        add_errors(program, errors)
+
+    def render(self, program, movements):
+        rendered = []
+        cache = {}
+        # a new duration anywhere can change the ticks of every track
+        ticks_per_quarter = ticks_per_quarter_for(program)
+        for t_id, track in enumerate(program.tracks):
+            key = (t_id, track.name, ticks_per_quarter, tuple(self.movement_keys[t_id]))
+            lines = tuple(statement.line for statement, _, _ in movements[t_id])
+            result, rendered_lines = self.rendered.get(key, (None, None))
+            # the errors have the lines of the statements when they were found
+            if result is None or (result[1] and rendered_lines != lines):
+                result = render_track(track, t_id, ticks_per_quarter)
+                self.renders += 1
+            cache[key] = (result, lines)
+            rendered.append(result)
+        self.rendered = cache
+        return merge_tracks(program, rendered)
+
+    def write(self, output):
+        if self.events is not None and len(self.program.err_list) == 0:
+            write_smf_file(self.events, output)
@@ -1,30 +1,36 @@
 from new_parser import Parser
 from ast import *
 from lexer import *
-import copy
+from collections import OrderedDict
 
 
+# Splices the expressions of every [...] group (nested ones too) into the
+# list that contains them, for macro bodies and movements. Every list is
+# rebuilt once, so this is linear in the number of expressions.
 def flatten_expr_group(program):
-    while True:
-        modified = False
-        for m_id,macro in enumerate(program.macros):
-            for e_id,expr in enumerate(macro.body):
-                if isinstance(expr, ExprGroup):
-                    macro.body = macro.body[:e_id] + expr.exprs + macro.body[e_id+1:]
-                    modified = True
-                    break 
-
-        # resolve repeats in movements
-        for t_id,track in enumerate(program.tracks):
-            for m_id,mov in enumerate(track.movements):
-                for e_id,expr in enumerate(mov.expressions):
-                    if isinstance(expr,ExprGroup):
-                        mov.expressions = mov.expressions[:e_id] + expr.exprs + mov.expressions[e_id+1:]
-                        modified = True
-                        break
-
-        if not modified:
-            break
+    for macro in program.macros:
+        macro.body = flatten_exprs(macro.body)
+
+    for track in program.tracks:
+        for mov in track.movements:
+            mov.expressions = flatten_exprs(mov.expressions)
+
+# uses its own stack instead of recursion, groups can be nested deeper than
+# the recursion limit
+def flatten_exprs(exprs):
+    flat = []
+    stack = [iter(exprs)]
+    while stack:
+        for expr in stack[-1]:
+            if isinstance(expr, ExprGroup):
+                stack.append(iter(expr.exprs))
+                break
+            if isinstance(expr, Loop):
+                expr = Loop(flatten_exprs(expr.exprs), expr.times, expr.source)
+            flat.append(expr)
+        else:
+            stack.pop()
+    return flat
     
 def print_list(list,indent):
     for item in list:
@@ -34,14 +40,14 @@ def print_list(list,indent):
 def resolve_repeats(program):
     # Process macros
     for macro in program.macros:
-        macro.body = resolve_in_list(macro.body)
+        macro.body = resolve_in_list(macro.body,program.err_list)
 
     # Process tracks
     for track in program.tracks:
         for movement in track.movements:
-            movement.expressions = resolve_in_list(movement.expressions)
+            movement.expressions = resolve_in_list(movement.expressions,program.err_list)
 
-def resolve_in_list(expr_list):
+def resolve_in_list(expr_list,errors):
     new_exprs = []
     i = 0
     while i < len(expr_list):
@@ -49,116 +55,300 @@ def resolve_in_list(expr_list):
         
         if isinstance(expr, ExprGroup):
             # Recursively process nested groups
-            expr.exprs = resolve_in_list(expr.exprs)
+            expr.exprs = resolve_in_list(expr.exprs,errors)
             new_exprs.append(expr)
             i += 1
         elif isinstance(expr, Repetition):
             # Ensure repetition follows an expression
             if not new_exprs:
-                raise SyntaxError(f"Invalid repetition at start of expression list: {expr}")
-                
+                errors.append(Diagnostic.at(Code.REPETITION_START,expr.source,expr.times))
+                i += 1
+                continue
+
             # Get target expression and repeat count
             target = new_exprs.pop()
             count = expr.times
-            
-            expanded = [copy.deepcopy(target) for _ in range(count)]
-                
-            new_exprs.extend(expanded)
+
+            # the target is kept once, not copied count times
+            new_exprs.append(Loop([target], count, expr.source))
             i += 1
         else:
             new_exprs.append(expr)
             i += 1
             
     return new_exprs
-def resolve_macros(program):
-    
+def resolve_macros(program,cache=None):
+    expander = MacroExpander(program,cache)
+
     # iterate through movements in the ast and find macros
     for t_id,track in enumerate(program.tracks):
         for m_id,mov in enumerate(track.movements):
-            while True: # iterate until no more modifications were made
-                mov_body = copy.copy(mov.expressions) #make a shallow copy of the expr list
-                was_modified = False
-
-                for e_id,expr in enumerate(mov_body):
-                    if isinstance(expr,Ident):
-                        maps = program.ident_dic[expr.source.value]
-                        macro = None
-
-                        try:
-                            macro = program.macros[maps-1]
-                        except:
-                            raise ValueError(f"Unknown idenfitier: {expr}")
-
-                        mov_body = mov_body[:e_id] + inline_macro_body(macro,program) + mov_body[e_id+1:]
-                        was_modified = True
-                        break
-
-
-                    if isinstance(expr,MacroCall):
-                        maps = program.ident_dic[expr.name.value]
-                        macro = None
-                        try:
-                            macro = program.macros[maps-1]
-                        except:
-                            raise ValueError(f"Unknown macro: {expr}")
-
-                        new_macro = apply_macro(macro,expr.arguments,program)
-                        mov_body = mov_body[:e_id] + inline_macro_body(new_macro,program) + mov_body[e_id+1:]
-                        was_modified = True
-                        break
-
-                mov.expressions = mov_body
-                if not was_modified:
-                    break
+            mov.expressions = expander.expand(mov.expressions)
 
-    pass
+    add_errors(program,expander.errors)
 
-def apply_macro(macro,args,program):
-    arg_map = {}
-    new_macro = copy.deepcopy(macro)
+# the same error can be found again in every call of a macro, it's only
+# reported once
+def add_errors(program,errors):
+    for error in errors:
+        if error not in program.err_list:
+            program.err_list.append(error)
 
-    if len(macro.parameters) != len(args):
-        raise ValueError(f"Expected {len(macro.parameters)} arguments, got only {len(args)}")
+# Inlines macros in one pass. The macros are expanded in dependency order,
+# every macro without parameters exactly once, and uses of it splice that
+# memoized body (the nodes are shared, like loop bodies). Macros with
+# parameters are expanded at every call, after the arguments are in.
+#
+# Errors (unknown identifiers, cycles, wrong number of arguments) are added
+# to self.errors and the expression is left out, the errors of the macros
+# are found when the expander is made.
+class MacroExpander:
+    def __init__(self,program,cache=None):
+        self.program = program
+        self.bodies = {} # macro index -> expanded body
+        self.cache = cache if cache is not None else MacroCache()
+        self.cache.use_macros(program.macros)
+        self.errors = []
 
-    for i,param in enumerate(macro.parameters):
-        arg_map[param.value] = args[i]
+        order,self.cyclic = macro_order(program,self.errors)
+        for m_id in order:
+            macro = program.macros[m_id]
+            if not macro.parameters and m_id not in self.cyclic:
+                self.bodies[m_id] = self.expand(macro.body)
 
-    arg_keys = arg_map.keys()
-    for e_id,expr in enumerate(macro.body):
-        if expr.source.value in arg_keys:
-            new_macro.body = new_macro.body[:e_id] + [arg_map[expr.source.value]] + new_macro.body[e_id+1:]
+    def expand(self,exprs):
+        new_exprs = []
+        for expr in exprs:
+            if isinstance(expr,Ident):
+                m_id = macro_index(self.program,expr.source.value)
+                if m_id is None:
+                    self.errors.append(Diagnostic.at(Code.UNKNOWN_IDENTIFIER,expr.source,expr.source.value))
+                elif m_id in self.cyclic:
+                    pass # already reported
+                elif m_id in self.bodies:
+                    new_exprs.extend(self.bodies[m_id])
+                else:
+                    # a macro with parameters used without arguments
+                    new_exprs.extend(self.expand(self.program.macros[m_id].body))
 
+            elif isinstance(expr,MacroCall):
+                m_id = macro_index(self.program,expr.name.value)
+                if m_id is None:
+                    self.errors.append(Diagnostic.at(Code.UNKNOWN_IDENTIFIER,expr.name,expr.name.value))
+                elif m_id not in self.cyclic:
+                    new_exprs.extend(self.instantiate(self.program.macros[m_id],expr))
 
+            elif isinstance(expr,Loop):
+                # loops are shared, they get a new body
+                new_exprs.append(Loop(self.expand(expr.exprs),expr.times,expr.source))
 
-    return new_macro
+            else:
+                new_exprs.append(expr)
 
-def inline_macro_body(macro,program):
+        return new_exprs
 
-    macro_body = copy.copy(macro.body)
+    # expanded body of macro for a call, calls with the same arguments share
+    # one body through the cache. The body of a hit holds the argument nodes
+    # of the call it was expanded for, they are swapped for the ones of this
+    # call so errors point at its notes.
+    def instantiate(self,macro,call):
+        args = call.arguments
+        if len(macro.parameters) != len(args):
+            self.errors.append(Diagnostic.at(Code.MACRO_ARITY,call.name,macro.name.value,len(macro.parameters),len(args)))
+            return ()
 
-    for e_id,expr in enumerate(macro.body):
-        if isinstance(expr,Ident):
-            maps = program.ident_dic[expr.source.value]
-            new_macro = None
+        key = (macro,tuple(expr_key(arg) for arg in args))
+        entry = self.cache.get(key)
+        if entry is None:
+            found = len(self.errors)
+            new_macro = apply_macro(macro,args,self.program)
+            body = tuple(self.expand(new_macro.body))
+            # bodies with errors aren't kept, so every call reports them
+            if len(self.errors) == found:
+                self.cache.put(key,(body,args))
+            return body
 
-            try:
-                new_macro = program.macros[maps-1]
-            except:
-                raise ValueError(f"Unknown idenfitier: {expr}")
-            
-            macro_body = macro.body[:e_id] + inline_macro_body(new_macro,program) + macro.body[e_id+1:]
+        body,cached_args = entry
+        if all(arg is cached for arg,cached in zip(args,cached_args)):
+            return body
+        pairs = {}
+        for cached,arg in zip(cached_args,args):
+            pair_nodes(cached,arg,pairs)
+        return tuple(replace_nodes(body,pairs))
+
+# LRU cache of expanded macro bodies, keyed by (macro, argument keys), with
+# the arguments they were expanded with. The bodies are shared between all
+# the calls, they must not be modified.
+#
+# A body also depends on the macros it calls, so the entries are only good
+# for the macros they were expanded with. A cache kept between compiles
+# (CompileSession) is emptied when the program's macros aren't the same
+# objects as the last time.
+class MacroCache:
+    def __init__(self,maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.macros = []
+        self.hits = 0
+        self.misses = 0
+
+    def use_macros(self,macros):
+        if len(macros) != len(self.macros) or any(new is not old for new,old in zip(macros,self.macros)):
+            self.entries.clear()
+            self.macros = list(macros)
+
+    def get(self,key):
+        body = self.entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self,key,body):
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.macros = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"MacroCache(size={len(self.entries)}/{self.maxsize}, hits={self.hits}, misses={self.misses})"
+
+# hashable value of an argument expression, two arguments written the same
+# way get the same key wherever they are in the source
+def expr_key(value):
+    if isinstance(value,Token):
+        return value.value
+    if isinstance(value,(list,tuple)):
+        return tuple(expr_key(item) for item in value)
+    if isinstance(value,(ASTNode,Fraction)):
+        return (type(value).__name__,) + tuple(
+            (name,expr_key(item)) for name,item in vars(value).items() if name != "source")
+    return value
+
+# Maps (by id) every node of old to the node at the same place in new, two
+# arguments with the same expr_key have the same shape
+def pair_nodes(old,new,pairs):
+    pairs[id(old)] = new
+    for name,value in vars(old).items():
+        if isinstance(value,ASTNode):
+            pair_nodes(value,getattr(new,name),pairs)
+        elif isinstance(value,list):
+            for old_item,new_item in zip(value,getattr(new,name)):
+                if isinstance(old_item,ASTNode):
+                    pair_nodes(old_item,new_item,pairs)
+
+# body with the nodes of pairs replaced, the loops, chords and held notes
+# around them are rebuilt and the rest is shared
+def replace_nodes(body,pairs):
+    return [replace_node(expr,pairs) for expr in body]
+
+def replace_node(expr,pairs):
+    new = pairs.get(id(expr))
+    if new is not None:
+        return new
+    if isinstance(expr,Loop):
+        exprs = replace_nodes(expr.exprs,pairs)
+        if any(new is not old for new,old in zip(exprs,expr.exprs)):
+            return Loop(exprs,expr.times,expr.source)
+    elif isinstance(expr,Chord):
+        notes = replace_nodes(expr.notes,pairs)
+        if any(new is not old for new,old in zip(notes,expr.notes)):
+            return Chord(notes,expr.source)
+    elif isinstance(expr,HoldNote):
+        note = replace_node(expr.note,pairs)
+        if note is not expr.note:
+            return HoldNote(note,expr.source)
+    return expr
+
+# index in program.macros of the macro called name, None if it isn't one
+def macro_index(program,name):
+    maps = program.ident_dic.get(name)
+    if not isinstance(maps,int) or not 0 < maps <= len(program.macros):
+        return None
+    return maps-1
+
+# Orders the macros so that every macro comes after the ones it uses.
+# Returns the order and the set of macros in a cycle (that end up using
+# themselves), every cycle is added to errors once.
+def macro_order(program,errors):
+    # the graph already leaves out the parameters, they shadow macros
+    deps = []
+    for macro in program.macros:
+        uses = [macro_index(program,name) for name in program.deps.macros.get(macro.name.value,())]
+        deps.append([m_id for m_id in uses if m_id is not None])
+
+    order = []
+    cyclic = set()
+    state = [0] * len(program.macros) # 0: not visited, 1: in progress, 2: done
+    for root in range(len(program.macros)):
+        if state[root] != 0:
             continue
 
-        if isinstance(expr,MacroCall):
-            maps = program.ident_dic[expr.name]
-            new_macro = None
+        # depth first, with an explicit stack for long chains of macros
+        state[root] = 1
+        stack = [(root,iter(deps[root]))]
+        while stack:
+            m_id,children = stack[-1]
+            for child in children:
+                if state[child] == 1:
+                    path = [node for node,_ in stack]
+                    cycle = path[path.index(child):] + [child]
+                    names = " -> ".join(program.macros[i].name.value for i in cycle)
+                    name = program.macros[child].name
+                    errors.append(Diagnostic.at(Code.MACRO_CYCLE,name,name.value,names))
+                    cyclic.update(cycle)
+                    continue
+
+                if state[child] == 0:
+                    state[child] = 1
+                    stack.append((child,iter(deps[child])))
+                    break
+            else:
+                stack.pop()
+                state[m_id] = 2
+                order.append(m_id)
+
+    return order,cyclic
+
+# the number of arguments is checked by the caller
+def apply_macro(macro,args,program):
+    arg_map = {}
+
+    for i,param in enumerate(macro.parameters):
+        arg_map[param.value] = args[i]
 
-            try:
-                new_macro = program.macros[maps-1]
-            except:
-                raise ValueError(f"Unknown macro: {expr}") 
+    # the body is rebuilt, the nodes of the macro are never modified
+    return Macro(macro.name,macro.parameters,substitute_args(macro.body,arg_map))
 
-            another_macro = apply_macro(macro,program)
-            macro_body = macro.body[:e_id] + inline_macro_body(another_macro,program) + macro.body[e_id+1:]
+# replaces the parameters of a macro body by the arguments, in loops, the
+# arguments of macro calls, chords and held notes too
+def substitute_args(body,arg_map):
+    return [substitute_arg(expr,arg_map) for expr in body]
 
-    return macro_body
+def substitute_arg(expr,arg_map):
+    if isinstance(expr,Loop):
+        return Loop(substitute_args(expr.exprs,arg_map),expr.times,expr.source)
+    if isinstance(expr,MacroCall):
+        return MacroCall(expr.name,substitute_args(expr.arguments,arg_map))
+    if isinstance(expr,Chord):
+        notes = []
+        for note in substitute_args(expr.notes,arg_map):
+            # a chord passed for a note of the chord adds all its notes
+            notes.extend(note.notes if isinstance(note,Chord) else [note])
+        return Chord(notes,expr.source)
+    if isinstance(expr,HoldNote):
+        return HoldNote(substitute_arg(expr.note,arg_map),expr.source)
+    if expr.source.value in arg_map:
+        return arg_map[expr.source.value]
+    return expr
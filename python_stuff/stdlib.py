@@ -0,0 +1,40 @@
+# Imports of standard library (and third party) modules that need the
+# standard ast module, use:
+#
+#   with standard_library():
+#       import asyncio
+#
+# The compiler has its own ast.py. When running from this directory it comes
+# first in the path, so a library doing "import ast" gets the compiler's
+# module, and once the standard one is loaded the compiler's "from ast
+# import *" gets that one. Inside the block this directory is out of the
+# path and the standard ast is imported, after it "ast" is the compiler's
+# module again. Modules imported in the block keep their reference to the
+# standard one.
+import contextlib
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def is_compiler_ast(module):
+    file_name = getattr(module, "__file__", None)
+    return file_name is not None and os.path.dirname(os.path.abspath(file_name)) == HERE
+
+@contextlib.contextmanager
+def standard_library():
+    path = sys.path[:]
+    compiler_ast = sys.modules.get("ast")
+    if is_compiler_ast(compiler_ast):
+        del sys.modules["ast"]
+    else:
+        compiler_ast = None
+    sys.path[:] = [entry for entry in path if os.path.abspath(entry or ".") != HERE]
+    try:
+        yield
+    finally:
+        sys.path[:] = path
+        if not is_compiler_ast(sys.modules.get("ast")):
+            sys.modules.pop("ast", None)
+        if compiler_ast is not None:
+            sys.modules["ast"] = compiler_ast
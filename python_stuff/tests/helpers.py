@@ -0,0 +1,15 @@
+# Helpers shared by the tests, the test scripts put the compiler directory in
+# the path before importing this
+from lexer import Tokenizer
+from new_parser import Parser
+from simplify import resolve_repeats, flatten_expr_group, resolve_macros
+
+
+# the ast of source with the macros resolved, ready to generate its events
+def compile_ast(source):
+    tokenizer = Tokenizer(source)
+    ast = Parser(tokenizer.tokenize(), index=tokenizer.index).parse()
+    resolve_repeats(ast)
+    flatten_expr_group(ast)
+    resolve_macros(ast)
+    return ast
@@ -1,7 +1,7 @@
 # Example usage with sample input
 from lexer import *
 from new_parser import *
-from ai_ast import *
+from ast import *
 def main():
     source = """
     title:"My Music Composition"
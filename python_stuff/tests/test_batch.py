@@ -0,0 +1,91 @@
+# Tests for batch compilation, run with: python tests/test_batch.py
+import os
+import sys
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from batch import *
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, "sub"))
+    shutil.copy(os.path.join(HERE, "..", "twinkle.mtex"), root)
+    shutil.copy(os.path.join(HERE, "..", "cart.mtex"), os.path.join(root, "sub"))
+    with open(os.path.join(root, "broken.mtex"), "w") as f:
+        f.write("piano: do re mi\nconcert: do\n")
+
+
+def run(pattern, out_dir=None, force=False):
+    reports = []
+    summary = compile_batch(pattern, out_dir, workers=2, force=force,
+                            report=lambda file_name, status, message: reports.append((os.path.basename(file_name), status)))
+    return summary, sorted(reports)
+
+
+def test_directory():
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(os.path.join(root, "src"))
+        out = os.path.join(root, "out")
+        summary, reports = run(os.path.join(root, "src"), out)
+        assert (summary["files"], summary["compiled"], summary["failed"]) == (3, 2, 1)
+        assert reports == [("broken.mtex", "failed"), ("cart.mtex", "ok"), ("twinkle.mtex", "ok")]
+        assert "not supported" in summary["errors"]["broken.mtex"][0]
+        assert os.path.exists(os.path.join(out, "twinkle.mid"))
+        assert os.path.exists(os.path.join(out, "sub", "cart.mid"))
+        assert not os.path.exists(os.path.join(out, "broken.mid"))
+
+        # unchanged files that built are skipped, failed ones are tried again
+        summary, reports = run(os.path.join(root, "src"), out)
+        assert (summary["compiled"], summary["skipped"], summary["failed"]) == (0, 2, 1)
+
+        with open(os.path.join(root, "src", "twinkle.mtex"), "a") as f:
+            f.write("\n# edited\n")
+        summary, reports = run(os.path.join(root, "src"), out)
+        assert (summary["compiled"], summary["skipped"]) == (1, 1)
+        assert ("twinkle.mtex", "ok") in reports
+
+        # a deleted output is built again
+        os.remove(os.path.join(out, "sub", "cart.mid"))
+        summary, reports = run(os.path.join(root, "src"), out)
+        assert ("cart.mtex", "ok") in reports
+
+        summary, reports = run(os.path.join(root, "src"), out, force=True)
+        assert summary["compiled"] == 2
+
+
+def test_compiler_change():
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(os.path.join(root, "src"))
+        out = os.path.join(root, "out")
+        run(os.path.join(root, "src"), out)
+
+        # built by another compiler, or with other options: built again
+        manifest_path = os.path.join(out, MANIFEST)
+        manifest = load_manifest(manifest_path)
+        manifest["twinkle.mtex"]["compiler"] = "0" * 16
+        manifest[os.path.join("sub", "cart.mtex")]["options"] = {"format": 0}
+        save_manifest(manifest_path, manifest)
+        summary, reports = run(os.path.join(root, "src"), out)
+        assert (summary["compiled"], summary["skipped"]) == (2, 0)
+
+        summary, reports = run(os.path.join(root, "src"), out)
+        assert (summary["compiled"], summary["skipped"]) == (0, 2)
+
+
+def test_glob():
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root)
+        summary, reports = run(os.path.join(root, "*.mtex"))
+        assert summary["files"] == 2
+        assert os.path.exists(os.path.join(root, "twinkle.mid"))
+        assert os.path.exists(os.path.join(root, MANIFEST))
+
+
+if __name__ == "__main__":
+    test_directory()
+    test_compiler_change()
+    test_glob()
+    print("batch tests passed")
@@ -0,0 +1,98 @@
+# Tests for the build cache, run with: python tests/test_buildcache.py
+import os
+import sys
+import time
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import buildcache
+from buildcache import *
+from compiler import compile_file
+from midi_ir import EventTable, EventKind
+
+
+def test_keys():
+    cache = BuildCache("unused")
+    key = cache.key(b"piano: do re mi\n", {"format": 1})
+    assert key == cache.key(b"piano: do re mi\n", {"format": 1})
+    assert key != cache.key(b"piano: do re fa\n", {"format": 1})
+    assert key != cache.key(b"piano: do re mi\n", {"format": 0})
+
+
+def test_version_follows_the_modules():
+    here = os.path.dirname(HERE)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in os.listdir(here):
+            if name.endswith(".py"):
+                with open(os.path.join(here, name), "rb") as src, open(os.path.join(directory, name), "wb") as dst:
+                    dst.write(src.read())
+        assert compiler_version(directory) == compiler_version()
+
+        # a module added after the cache was written still counts
+        with open(os.path.join(directory, "lowering.py"), "ab") as module:
+            module.write(b"\n# changed\n")
+        buildcache._versions.pop(directory) # computed once per process
+        assert compiler_version(directory) != compiler_version()
+
+
+def test_put_get():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = BuildCache(directory, store_events=True)
+        key = cache.key(b"source")
+        assert cache.get(key) is None
+
+        events = EventTable()
+        events.add_note(0, 960, 0, 0, 60, 100)
+        cache.put(key, b"MThd...", events)
+        assert cache.get(key) == b"MThd..."
+        assert list(cache.get_events(key)) == list(events)
+        assert (cache.hits, cache.misses) == (1, 1)
+        # nothing left behind by the atomic writes
+        assert not [name for name in os.listdir(os.path.join(directory, key[:2])) if name.endswith(".tmp")]
+
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = BuildCache(directory, max_bytes=2500)
+        keys = [cache.key(bytes([i])) for i in range(3)]
+        for i, key in enumerate(keys[:2]):
+            cache.put(key, b"x" * 1000)
+            os.utime(cache.path(key, ".mid"), (time.time() - 100 + i, time.time() - 100 + i))
+
+        cache.get(keys[0]) # now the most recently used
+        cache.put(keys[2], b"x" * 1000)
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+
+
+def test_compile_file():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = BuildCache(os.path.join(directory, "cache"))
+        source = os.path.join(HERE, "..", "cart.mtex")
+        first, second = os.path.join(directory, "a.mid"), os.path.join(directory, "b.mid")
+        assert compile_file(source, first, cache=cache) == []
+        assert compile_file(source, second, cache=cache) == []
+        assert (cache.hits, cache.misses) == (1, 1)
+        with open(first, "rb") as a, open(second, "rb") as b:
+            assert a.read() == b.read()
+
+        # the resolution comes from the score, the cached file keeps it
+        source = os.path.join(directory, "sevenths.mtex")
+        with open(source, "w") as f:
+            f.write("piano: :1/7 do re mi fa sol la si do:1/4\n")
+        for output in (first, second):
+            assert compile_file(source, output, cache=cache) == []
+            with open(output, "rb") as f:
+                assert int.from_bytes(f.read()[12:14], "big") == 6720
+        assert (cache.hits, cache.misses) == (2, 2)
+
+
+if __name__ == "__main__":
+    test_keys()
+    test_version_follows_the_modules()
+    test_put_get()
+    test_eviction()
+    test_compile_file()
+    print("buildcache tests passed")
@@ -0,0 +1,113 @@
+# Tests for the structured errors, run with: python tests/test_diagnostics.py
+import os
+import sys
+import json
+import pickle
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lexer import Tokenizer, Token, TokenType
+from new_parser import Parser, TokenStream
+from diagnostics import *
+
+
+def parse(source):
+    tokenizer = Tokenizer(source)
+    parser = Parser(tokenizer.tokenize(), index=tokenizer.index)
+    parser.parse()
+    return parser.err_list
+
+
+def test_rendering():
+    token = Token("x", 3, 7, TokenType.ALPHANUM)
+    diagnostic = Diagnostic.at(Code.TEMPO_NUMBER, token, token.value)
+    assert (diagnostic.line, diagnostic.column, diagnostic.span) == (3, 7, 1)
+    assert str(diagnostic) == "Syntax Error(3,7): Expected number after '^', got token \"x\" instead"
+
+    # the tip goes after the message, errors about the whole program have no
+    # location
+    diagnostic = Diagnostic(Code.EMPTY)
+    assert str(diagnostic).startswith("Compilation error: All tracks cannot be empty.\n|\n| Tip:")
+    assert diagnostic == Diagnostic(Code.EMPTY)
+
+
+def test_to_dict():
+    errors = parse("piano: do\npiano: re\n")
+    assert len(errors) == 1
+    data = json.loads(json.dumps(errors.to_json()))[0]
+    assert data["code"] == Code.INSTRUMENT_REUSED and data["severity"] == Severity.ERROR
+    assert (data["line"], data["column"], data["span"]) == (2, 0, 5)
+    # tokens in the args are sent as their text
+    assert data["args"] == ["<Token ALPHANUM 'piano' at 2:0>", "(1, 1)"]
+    assert data["message"].startswith("Instrument <Token ALPHANUM 'piano'")
+    assert data["tip"].startswith("| Tip: to have the same instrument")
+
+
+def test_parser_errors():
+    assert [(error.code, error.line, error.column) for error in parse("title do\npiano: ^x do | !3/4 v=y re\n")] == [
+        (Code.TITLE_COLON, 1, 6),
+        (Code.TEMPO_NUMBER, 2, 8),
+        (Code.VOLUME_NUMBER, 2, 22),
+    ]
+    # recovering from these used to hang or fail
+    assert [error.code for error in parse("m(a,) = a\npiano: m(do)\n")] == [Code.MACRO_TRAILING_COMMA]
+    assert [error.code for error in parse("piano: (|\n")] == [Code.HOLD_NOTE]
+    assert [error.code for error in parse("title: do\n")] == [Code.TITLE_STRING]
+
+    # a statement starting with ":" is reported once, the next ones are read
+    source = "piano: do re\n :1/4\nviolin: mi\n"
+    tokenizer = Tokenizer(source)
+    program = Parser(tokenizer.tokenize(), index=tokenizer.index).parse()
+    assert [(error.code, error.line) for error in program.err_list] == [(Code.STATEMENT_START, 2)]
+    assert [movement.instrument.value for track in program.tracks for movement in track.movements] == ["piano", "violin"]
+
+
+def test_same_errors_from_the_stream():
+    source = "do re\npiano: ^x do\n= x\n"
+    tokenizer = Tokenizer(source)
+    stream_errors = Parser(TokenStream(tokenizer.iter_tokens())).parse().err_list
+    assert stream_errors == parse(source) and len(stream_errors) == 3
+
+
+def test_from_exception():
+    try:
+        Tokenizer("piano: do\n  re ~ mi\n").tokenize()
+    except SyntaxError as error:
+        diagnostic = Diagnostic.from_exception(error)
+    assert (diagnostic.code, diagnostic.line, diagnostic.column, diagnostic.span) == (Code.UNRECOGNIZED_CHARACTER, 2, 5, 1)
+    assert str(diagnostic) == "Syntax Error(2,5): Unrecognized character '~'"
+
+    diagnostic = Diagnostic.from_exception(KeyError("x"))
+    assert diagnostic.code == Code.INTERNAL and diagnostic.line is None
+    assert str(diagnostic) == "Internal error: KeyError: 'x'"
+
+
+def test_cap():
+    errors = DiagnosticList(limit=3)
+    for column in range(5):
+        errors.append(Diagnostic(Code.EXPRESSION_TOKEN, 1, column, 1, ("?",)))
+    assert len(errors) == 4 and errors.dropped == 2 and errors.full()
+    assert str(errors[-1]) == "Compilation error: stopped after 3 errors"
+
+    # the parser stops reading after that
+    source = "do re mi\n" * 1000
+    tokenizer = Tokenizer(source)
+    parser = Parser(TokenStream(tokenizer.iter_tokens()))
+    errors = parser.parse().err_list
+    assert len(errors) == MAX_ERRORS + 1 and errors[-1].code == Code.TOO_MANY_ERRORS
+    assert parser.pos < len(source.split())
+
+    # kept when sent to another process
+    copy = pickle.loads(pickle.dumps(errors))
+    assert copy == errors and copy.full()
+
+
+if __name__ == "__main__":
+    test_rendering()
+    test_to_dict()
+    test_parser_errors()
+    test_same_errors_from_the_stream()
+    test_from_exception()
+    test_cap()
+    print("diagnostics tests passed")
@@ -0,0 +1,130 @@
+# Parity tests for the table driven Tokenizer against the reference
+# char-by-char tokenizer, run with: python tests/test_lexer.py
+import os
+import sys
+import glob
+import random
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lexer import *
+from char_tokenizer import CharTokenizer
+
+
+def token_tuples(tokens):
+    return [(tk.value, tk.line, tk.column, tk.type) for tk in tokens]
+
+
+def assert_parity(source):
+    try:
+        expected = token_tuples(CharTokenizer(source).tokenize())
+    except TypeError:
+        # the reference tokenizer crashes on a comment or spaces at the very
+        # end of the file, there is no stream to compare with
+        return
+    except SyntaxError as err:
+        try:
+            Tokenizer(source).tokenize()
+        except SyntaxError as new_err:
+            assert str(err) == str(new_err), (str(err), str(new_err))
+            return
+        raise AssertionError(f"expected SyntaxError for {source!r}")
+
+    got = token_tuples(Tokenizer(source).tokenize())
+    assert got == expected, f"token stream differs for {source!r}"
+
+    compact = token_tuples(Tokenizer(source).tokenize_compact())
+    assert compact == expected, f"compact token stream differs for {source!r}"
+
+
+def test_example_files():
+    files = glob.glob(os.path.join(HERE, "..", "*.mtex"))
+    files += glob.glob(os.path.join(HERE, "..", "..", "grammar", "*.mtex"))
+    assert files
+
+    for file_name in files:
+        with open(file_name) as f:
+            assert_parity(f.read())
+
+
+def test_edge_cases():
+    sources = [
+        "",
+        "\n",
+        "do",
+        "do r",
+        "do re\n",
+        "do\tre  mi\n",
+        "12ms 4m 3msx\n",
+        "title: \"a \\\"quoted\\\" title\"\n",
+        "\"unterminated\n string",
+        "\"ends in backslash\\\\",
+        "\"multi\nline\" do\n",
+        "# comment\ndo # another\n",
+        "x = [ do re ]*2 | !4/4 :1/4 >2 <1 ^120 +do -re (do/mi) v=50;\n",
+        "café ½ do\n",
+        "2² do\n",
+        "do @ re\n",
+        "do\r\nre\n",
+    ]
+    for source in sources:
+        assert_parity(source)
+
+
+def test_random_sources():
+    pieces = [
+        "do", "re", "mi", "fa", "sol", "la", "si", "r", "track", "title",
+        "v", "macro_1", "x2", "12", "4ms", " ", "\t", "  ", "\n", "# c\n",
+        "\"str\"", "\"a\\\"b\"", "{", "}", "(", ")", "[", "]", ":", ",", "|",
+        "/", "!", "=", "'", ".", "-", ">", "<", "^", "*", ";", "+",
+    ]
+    rng = random.Random(42)
+    for _ in range(2000):
+        source = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        assert_parity(source + "\n")
+
+
+def test_mapped_source():
+    sources = [
+        "do re\n",
+        "do re",
+        "title: \"two\nlines\"\npiano: do # comment\n\n",
+        "",
+    ]
+    for file_name in glob.glob(os.path.join(HERE, "..", "*.mtex")):
+        with open(file_name) as f:
+            sources.append(f.read())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "score.mtex")
+        for source in sources:
+            for newline in ("\n", "\r\n", "\r"):
+                with open(path, "w", newline=newline) as f:
+                    f.write(source)
+
+                expected = token_tuples(Tokenizer(source).tokenize())
+                mapped = load_source(path, mapped=True)
+                try:
+                    got = token_tuples(Tokenizer(mapped).tokenize_compact())
+                finally:
+                    if isinstance(mapped, MappedSource):
+                        mapped.close()
+                assert got == expected, f"mapped token stream differs for {source!r}"
+
+        # the newlines of a file can be mixed, text mode reads them all as \n
+        with open(path, "wb") as f:
+            f.write(b'title: "a\rb\r\nc"\rpiano: do\r\nre # x\rmi\n')
+        with open(path) as f:
+            expected = token_tuples(Tokenizer(f.read()).tokenize())
+        with load_source(path, mapped=True) as mapped:
+            assert token_tuples(Tokenizer(mapped).tokenize_compact()) == expected
+
+
+if __name__ == "__main__":
+    test_example_files()
+    test_edge_cases()
+    test_random_sources()
+    test_mapped_source()
+    print("lexer tests passed")
@@ -0,0 +1,80 @@
+# Tests for the lowering of movements to note arrays, run with: python tests/test_lowering.py
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from simplify import *
+from lowering import *
+from helpers import compile_ast
+
+
+def lower(source):
+    ast = compile_ast(source)
+    assert ast.err_list == []
+    return lower_movement(ast.tracks[0].movements[0])
+
+
+def test_notes():
+    lowered = lower("piano: do re mi.5 fa+ | sol :1/8 la si:1/2 r do/mi/sol v=60 do 2 re\n")
+    assert lowered.pitches.tolist() == [48, 50, 64, 54, 55, 57, 59, 48, 48, 52, 55, 48, 50]
+    # the notes of a chord start together, "do 2" waits 2 quarters
+    assert lowered.starts.tolist() == [0, 3840, 7680, 11520, 15360, 19200, 19680, 21600, 22080,
+                                       22080, 22080, 22560, 24480]
+    assert lowered.durations.tolist() == [3840] * 5 + [480, 1920] + [480] * 6
+    assert lowered.velocities.tolist() == [100] * 7 + [0, 100, 100, 100, 60, 60]
+    assert lowered.bar_ends.tolist() == [4] and lowered.bar_measures.tolist() == [[4, 4]]
+
+
+def test_state_changes():
+    # the semitone of mi is lowered for the rest of the movement, the
+    # octave shifts apply to the notes after them
+    lowered = lower("piano: -mi mi re+ [ do mi ]*2 <1 do >2 do\n")
+    assert lowered.pitches.tolist() == [51, 51, 48, 51, 48, 51, 36, 60]
+    assert lowered.starts.tolist() == [i * 3840 for i in range(8)]
+
+
+def test_exact_ticks():
+    # 1/12 is a triplet of eighths, 320 ticks, with no drift after many of them
+    lowered = lower("piano: :1/12 [ do re mi ]*100 do:1/8 re\n")
+    assert lowered.starts.tolist() == [i * 320 for i in range(301)] + [300 * 320 + 480]
+    assert set(lowered.durations.tolist()) == {320, 480}
+
+    # sevenths don't fit in 960 ticks per quarter, the resolution grows so
+    # they do
+    ast = compile_ast("piano: :1/7 do re mi fa sol la si do:1/4\n")
+    ticks_per_quarter = ticks_per_quarter_for(ast)
+    assert ticks_per_quarter == 6720
+    lowered = lower_movement(ast.tracks[0].movements[0], ticks_per_quarter)
+    assert lowered.starts.tolist() == [i * 3840 for i in range(8)]
+    assert lowered.durations.tolist()[-1] == 6720
+
+
+def test_empty():
+    lowered = lower("piano: v=80\n")
+    assert len(lowered) == 0 and lowered.starts.dtype == np.int64
+
+
+def test_out_of_range():
+    # octave 4 plus 9 is 13, si is pitch 167 there. The rest only needs a
+    # valid byte, it isn't an error
+    lowered = lower("piano: do >9 si r <9 v=300 re\n")
+    assert [(error.code, error.line, error.column, error.args) for error in lowered.errors] == [
+        (Code.PITCH_RANGE, 1, 13, ("si", 167)),
+        (Code.VOLUME_RANGE, 1, 21, (300,)),
+    ]
+    assert lowered.pitches.max() <= 127
+
+    # the lowest and the highest pitches
+    lowered = lower("piano: <4 do >10 sol\n")
+    assert lowered.errors == [] and lowered.pitches.tolist() == [0, 127]
+
+
+if __name__ == "__main__":
+    test_notes()
+    test_state_changes()
+    test_exact_ticks()
+    test_empty()
+    test_out_of_range()
+    print("lowering tests passed")
@@ -0,0 +1,90 @@
+# Tests for the event table, run with: python tests/test_midi_ir.py
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lexer import *
+from new_parser import *
+from simplify import *
+from midigen import gen_events
+from midi_ir import *
+from helpers import compile_ast
+
+
+def compile_events(source, workers=1):
+    return gen_events(compile_ast(source), workers)
+
+
+def test_events_are_time_sorted():
+    events = compile_events("piano: do re\nviolin: :1/2 mi\n")
+    quarter = events.ticks_per_quarter
+
+    assert list(events.ticks) == sorted(events.ticks)
+    assert events.texts == ["global"]
+    assert [row[2:5] for row in events if row[3] == EventKind.PROGRAM_CHANGE] == [
+        (0, EventKind.PROGRAM_CHANGE, 0), (1, EventKind.PROGRAM_CHANGE, 40)]
+
+    notes = [(tick, channel, kind, pitch) for tick, track, channel, kind, pitch, velocity in events
+             if kind in (EventKind.NOTE_ON, EventKind.NOTE_OFF)]
+    assert notes == [
+        (0, 0, EventKind.NOTE_ON, 48),
+        (0, 1, EventKind.NOTE_ON, 52),
+        (2 * quarter, 1, EventKind.NOTE_OFF, 52),
+        # the note off comes before the note on of the same tick
+        (4 * quarter, 0, EventKind.NOTE_OFF, 48),
+        (4 * quarter, 0, EventKind.NOTE_ON, 50),
+        (8 * quarter, 0, EventKind.NOTE_OFF, 50),
+    ]
+
+
+def test_loops_are_unrolled():
+    events = compile_events("piano: [ do re ]*3\n")
+    ons = [pitch for tick, track, channel, kind, pitch, velocity in events if kind == EventKind.NOTE_ON]
+    assert ons == [48, 50] * 3
+
+
+MULTI_TRACK = 'track "a":\npiano: do re mi\nviolin: sol la\n\ntrack "b":\nguitar: [ do mi ]*4\n'
+
+
+def test_multi_track_channels():
+    events = compile_events(MULTI_TRACK)
+    assert events.texts == ["a", "b"]
+    programs = [(track, channel, program) for tick, track, channel, kind, program, velocity in events
+                if kind == EventKind.PROGRAM_CHANGE]
+    # channels are numbered across the tracks
+    assert programs == [(0, 0, 0), (0, 1, 40), (1, 2, 24)]
+
+
+def test_parallel_tracks():
+    serial = compile_events(MULTI_TRACK)
+    parallel = compile_events(MULTI_TRACK, workers=2)
+    assert list(serial) == list(parallel)
+    assert serial.texts == parallel.texts
+
+
+def test_percussion_channel_is_skipped():
+    ast = compile_ast("".join(f"piano \"{i}\": do\n" for i in range(11)))
+    events = gen_events(ast)
+    channels = [channel for tick, track, channel, kind, data1, data2 in events if kind == EventKind.PROGRAM_CHANGE]
+    assert channels == [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 11]
+    assert ast.err_list == []
+
+
+def test_triplet_bars():
+    # 12 triplets of eighths make exactly a 4/4 bar, one of them doesn't
+    ast = compile_ast("piano: !4/4 :1/12 do re mi do re mi do re mi do re mi | do |\n")
+    gen_events(ast)
+    assert len(ast.err_list) == 1
+    assert "Measure error(1,59)" in str(ast.err_list[0]) and "got 0.3333333333333333 notes" in str(ast.err_list[0])
+
+
+if __name__ == "__main__":
+    test_events_are_time_sorted()
+    test_loops_are_unrolled()
+    test_multi_track_channels()
+    test_parallel_tracks()
+    test_percussion_channel_is_skipped()
+    test_triplet_bars()
+    print("midi ir tests passed")
@@ -0,0 +1,111 @@
+# Tests for the midi file writer, run with: python tests/test_midiwriter.py
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lexer import *
+from new_parser import *
+from simplify import *
+from midigen import gen_events, write_midiutil
+from midiwriter import *
+from helpers import compile_ast
+
+
+def compile_events(file_name):
+    with open(os.path.join(HERE, "..", file_name)) as f:
+        source = f.read()
+    return gen_events(compile_ast(source))
+
+
+def read_vlq(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, pos
+
+
+# decodes a midi file to its header and, for every chunk, a list of
+# (tick, status, data) with absolute ticks and running status expanded
+def decode(data):
+    header = data[:14]
+    chunks = []
+    pos = 14
+    while pos < len(data):
+        assert data[pos:pos + 4] == b"MTrk"
+        end = pos + 8 + int.from_bytes(data[pos + 4:pos + 8], "big")
+        pos += 8
+        tick = 0
+        running = None
+        events = []
+        while pos < end:
+            delta, pos = read_vlq(data, pos)
+            tick += delta
+            if data[pos] == 0xff:
+                length, start = read_vlq(data, pos + 2)
+                events.append((tick, (0xff, data[pos + 1]), bytes(data[start:start + length])))
+                pos = start + length
+                running = None
+                continue
+            if data[pos] & 0x80:
+                running = data[pos]
+                pos += 1
+            size = 1 if running >> 4 in (0xc, 0xd) else 2
+            events.append((tick, running, bytes(data[pos:pos + size])))
+            pos += size
+        chunks.append(events)
+    return header, chunks
+
+
+def midiutil_bytes(events):
+    with tempfile.TemporaryDirectory() as folder:
+        output = os.path.join(folder, "out.mid")
+        write_midiutil(events, output)
+        with open(output, "rb") as f:
+            return f.read()
+
+
+def test_vlq():
+    assert vlq(0) == b"\x00"
+    assert vlq(0x7f) == b"\x7f"
+    assert vlq(0x80) == b"\x81\x00"
+    assert vlq(0x3fff) == b"\xff\x7f"
+    assert vlq(0x4000) == b"\x81\x80\x00"
+    assert vlq(0x0fffffff) == b"\xff\xff\xff\x7f"
+
+
+def test_parity_with_midiutil():
+    for file_name in ["twinkle.mtex", "cart.mtex"]:
+        events = compile_events(file_name)
+        expected = midiutil_bytes(events)
+        written = write_smf(events)
+
+        assert decode(written) == decode(expected), file_name
+        # running status leaves out most of the status bytes
+        assert len(written) < len(expected)
+
+
+def test_format_0():
+    events = compile_events("cart.mtex")
+    header, chunks = decode(write_smf(events, format=0))
+    assert header[8:12] == b"\x00\x00\x00\x01"
+
+    _, format_1 = decode(write_smf(events))
+    # the same events, but only one end of track
+    end = chunks[0].pop()
+    assert end[1] == (0xff, 0x2f)
+    merged = [event for chunk in format_1 for event in chunk[:-1]]
+    assert sorted(chunks[0], key=repr) == sorted(merged, key=repr)
+    assert [tick for tick, status, data in chunks[0]] == list(events.ticks)
+
+
+if __name__ == "__main__":
+    test_vlq()
+    test_parity_with_midiutil()
+    test_format_0()
+    print("midiwriter tests passed")
@@ -0,0 +1,142 @@
+# Parser tests, run with: python tests/test_parser.py
+import os
+import sys
+import glob
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lexer import *
+from new_parser import *
+
+
+def example_sources():
+    sources = []
+    for file_name in sorted(glob.glob(os.path.join(HERE, "..", "*.mtex"))):
+        with open(file_name) as f:
+            sources.append(f.read())
+    return sources
+
+
+def parse_list(source):
+    parser = Parser(Tokenizer(source).tokenize())
+    return parser, parser.parse()
+
+
+def parse_stream(source, window=8):
+    parser = Parser(TokenStream(Tokenizer(source).iter_tokens(), window))
+    return parser, parser.parse()
+
+
+def test_stream_matches_list():
+    for source in example_sources():
+        try:
+            list_parser, list_ast = parse_list(source)
+        except ValueError:
+            # internal parser errors (test.mtex), nothing to compare
+            continue
+
+        stream_parser, stream_ast = parse_stream(source)
+        assert traverse_ast(stream_ast, 0) == traverse_ast(list_ast, 0)
+        assert stream_parser.err_list == list_parser.err_list
+
+
+def test_compact_buffer_matches_list():
+    for source in example_sources():
+        try:
+            list_parser, list_ast = parse_list(source)
+        except ValueError:
+            continue
+
+        compact_parser = Parser(Tokenizer(source).tokenize_compact())
+        compact_ast = compact_parser.parse()
+        assert traverse_ast(compact_ast, 0) == traverse_ast(list_ast, 0)
+        assert compact_parser.err_list == list_parser.err_list
+
+
+def test_stream_window_is_bounded():
+    source = "piano: " + "do re mi | " * 2000 + "\n"
+    stream = TokenStream(Tokenizer(source).iter_tokens(), 16)
+    Parser(stream).parse()
+    # old tokens were dropped from the window while parsing
+    assert stream.start > 0
+    assert len(stream.window) <= 16
+    assert stream[-1].type == TokenType.EOF
+
+
+def test_trace_is_off_by_default():
+    source = "piano: do re mi\n"
+    parser = Parser(Tokenizer(source).tokenize())
+    parser.parse()
+    assert len(parser.log_list) == 0
+
+    parser = Parser(Tokenizer(source * 100).tokenize(), TraceLevel.DEBUG, trace_size=10)
+    parser.parse()
+    logs = parser.format_logs()
+    assert len(logs) == 10
+    assert logs[-1] == "finished parsing program"
+
+    parser = Parser(Tokenizer(source).tokenize(), TraceLevel.INFO)
+    parser.parse()
+    assert parser.format_logs()[0].startswith("new iteration of statement loop at <Token")
+
+
+def test_tracks_and_index():
+    source = "title: \"t\"\nverse = [ do re ]\ntrack \"a\":\npiano: verse\ntrack:\nviolin: [ [ mi ] fa ]\n"
+    tokenizer = Tokenizer(source)
+    tokens = tokenizer.tokenize()
+    ast = Parser(tokens, index=tokenizer.index).parse()
+
+    assert [track.name for track in ast.tracks] == ["a", "main"]
+    assert [len(track.movements) for track in ast.tracks] == [1, 1]
+
+    index = ast.index
+    assert index.complete and index.has_track()
+    assert [tokens[i].value for i in index.tracks] == ["track", "track"]
+    assert [tokens[i].value for i in index.titles] == ["title"]
+    assert [tokens[i].value for i in index.macros] == ["verse"]
+    for open_pos, close_pos in index.brackets.items():
+        assert tokens[open_pos].type == TokenType.OPEN_BRACKET
+        assert tokens[close_pos].type == TokenType.CLOSE_BRACKET
+    assert len(index.brackets) == 3
+
+    # no track statement, everything goes to the global track
+    ast = Parser(Tokenizer("piano: do\nviolin: re\n").tokenize()).parse()
+    assert [track.name for track in ast.tracks] == ["global"]
+    assert len(ast.tracks[0].movements) == 2
+
+
+def test_restore_skips_to_matching_bracket():
+    source = "[ do [ re ] mi ]\npiano: do\n"
+    tokenizer = Tokenizer(source)
+    parser = Parser(tokenizer.tokenize(), index=tokenizer.index)
+    ast = parser.parse()
+    assert len(parser.err_list) == 1
+    assert len(ast.tracks[0].movements) == 1
+
+
+def test_dependency_graph():
+    source = "c = do\nb = c c\nriff (x) = x b\ntrack:\npiano: riff(re)\ntrack:\nviolin: [ b ]*2\nguitar: mi\n"
+    ast = Parser(Tokenizer(source).tokenize()).parse()
+    deps = ast.deps
+
+    # the parameter x is not a dependency of riff
+    assert deps.macros == {"c": [], "b": ["c"], "riff": ["b"]}
+    assert deps.movements == {(0, 0): ["riff"], (1, 0): ["b"], (1, 1): []}
+    assert deps.closure(["riff"]) == {"riff", "b", "c"}
+
+    macros, movements = deps.dependents("c")
+    assert macros == {"b", "riff"}
+    assert sorted(movements) == [(0, 0), (1, 0)]
+    assert deps.dependents("riff") == (set(), [(0, 0)])
+
+
+if __name__ == "__main__":
+    test_stream_matches_list()
+    test_compact_buffer_matches_list()
+    test_stream_window_is_bounded()
+    test_trace_is_off_by_default()
+    test_tracks_and_index()
+    test_restore_skips_to_matching_bracket()
+    test_dependency_graph()
+    print("parser tests passed")
@@ -0,0 +1,75 @@
+# Tests for compiler.py --profile, run with: python tests/test_profile.py
+import os
+import sys
+import io
+import json
+import contextlib
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from compiler import compile_file, main
+from pipeline_profile import PipelineProfile
+from ast import count_nodes
+from lexer import Tokenizer
+from new_parser import Parser
+
+STAGES = ["read", "tokenize", "parse", "resolve_repeats", "flatten_expr_group", "resolve_macros", "generate", "write"]
+
+
+def test_count_nodes():
+    tokenizer = Tokenizer("piano: do re mi\n")
+    ast = Parser(tokenizer.tokenize(), index=tokenizer.index).parse()
+    # program, track, movement and the 3 notes
+    assert count_nodes(ast) == 6
+
+
+def test_stages():
+    profile = PipelineProfile()
+    with tempfile.TemporaryDirectory() as directory:
+        errors = compile_file(os.path.join(HERE, "..", "cart.mtex"), os.path.join(directory, "cart.mid"), profile=profile)
+    profile.stop()
+    assert errors == []
+    assert [record["stage"] for record in profile.stages] == STAGES
+
+    records = {record["stage"]: record for record in profile.stages}
+    assert records["tokenize"]["tokens"] > 0
+    assert records["generate"]["events"] > 0
+    assert records["resolve_repeats"]["nodes_before"] == records["parse"]["nodes_after"]
+    assert records["resolve_macros"]["nodes_before"] == records["flatten_expr_group"]["nodes_after"]
+    for record in profile.stages:
+        assert record["seconds"] >= 0 and record["peak_bytes"] >= 0
+
+    table = profile.table().split("\n")
+    assert len(table) == len(STAGES) + 2 and table[-1].startswith("total")
+    assert json.loads(profile.to_json())["stages"] == profile.stages
+
+
+def test_disabled():
+    profile = PipelineProfile(enabled=False)
+    with profile.stage("parse") as record:
+        pass
+    assert profile.stages == [] and profile.nodes(None) is None
+
+
+def test_cli():
+    with tempfile.TemporaryDirectory() as directory:
+        report = os.path.join(directory, "profile.json")
+        sys.argv = ["compiler.py", os.path.join(HERE, "..", "twinkle.mtex"), os.path.join(directory, "twinkle.mid"),
+                    "--profile", "--profile-json", report]
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main()
+        assert "Program:" not in out.getvalue() # the ast is only dumped with --dump-ast
+        assert "nodes in" in out.getvalue()
+        with open(report) as f:
+            assert [record["stage"] for record in json.load(f)["stages"]] == STAGES
+
+
+if __name__ == "__main__":
+    test_count_nodes()
+    test_stages()
+    test_disabled()
+    test_cli()
+    print("profile tests passed")
@@ -0,0 +1,95 @@
+# Tests for the compile server, run with: python tests/test_server.py
+import os
+import sys
+import json
+import base64
+import asyncio
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from server import *
+
+
+async def post(port, payload, path="/compile"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+async def run(test, workers=2):
+    server = CompileServer(workers)
+    listener = await server.serve("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        await test(port)
+    finally:
+        listener.close()
+        server.close()
+
+
+def test_compile():
+    async def test(port):
+        status, result = await post(port, {"session": "a", "source": "piano: do re mi\n"})
+        assert status == 200
+        assert result["diagnostics"] == []
+        assert base64.b64decode(result["midi"])[:4] == b"MThd"
+
+        # the same session is warm in the worker, the statement isn't parsed
+        # again
+        status, result = await post(port, {"session": "a", "source": "piano: do re mi\n"})
+        assert (result["parsed"], result["reused"]) == (0, 1)
+
+        status, result = await post(port, {"session": "a", "source": "piano: do re mi\nconcert: fa\n"})
+        assert result["midi"] is None
+        assert [(d["line"], d["column"]) for d in result["diagnostics"]] == [(2, 0)]
+
+        # only looking for errors, nothing is generated
+        status, result = await post(port, {"session": "a", "source": "piano: :1/4 do re | mi\n", "check": True})
+        assert result["midi"] is None
+        assert [(d["line"], d["column"]) for d in result["diagnostics"]] == [(1, 18)]
+
+        # the tokenizer raises on characters it doesn't know, sent with their position
+        status, result = await post(port, {"session": "a", "source": "piano: do\nviolin: ~ re\n"})
+        assert [(d["code"], d["line"], d["column"], d["span"]) for d in result["diagnostics"]] == \
+               [("unrecognized-character", 2, 8, 1)]
+
+        status, result = await post(port, {"source": "piano: do\n"}, path="/other")
+        assert status == 404
+        status, result = await post(port, {"session": "a"})
+        assert status == 400
+    # a single worker, every request finds the session it left
+    asyncio.run(run(test, workers=1))
+
+
+def test_superseded_requests_are_cancelled():
+    async def test(port):
+        big = "piano: [ do re mi fa ]*2000\n"
+        results = await asyncio.gather(*[
+            post(port, {"session": "b", "source": big + f"violin: {note}\n"})
+            for note in ["do", "re", "mi"]])
+        assert [result.get("cancelled", False) for status, result in results] == [True, True, False]
+        assert results[2][1]["diagnostics"] == []
+    asyncio.run(run(test))
+
+
+def test_runs_as_a_script():
+    # from its directory the compiler's ast.py comes first in the path,
+    # asyncio must still get the standard one
+    directory = os.path.dirname(HERE)
+    done = subprocess.run([sys.executable, "server.py", "--help"], cwd=directory, capture_output=True, text=True)
+    assert done.returncode == 0, done.stderr
+    assert done.stdout.startswith("usage: server.py")
+
+
+if __name__ == "__main__":
+    test_compile()
+    test_superseded_requests_are_cancelled()
+    test_runs_as_a_script()
+    print("server tests passed")
@@ -0,0 +1,173 @@
+# Tests for incremental compilation, run with: python tests/test_session.py
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from session import *
+from midigen import gen_events
+from helpers import compile_ast
+
+
+def read_example(file_name):
+    with open(os.path.join(HERE, "..", file_name)) as f:
+        return f.read()
+
+
+def full_compile(source):
+    ast = compile_ast(source)
+    return ast, gen_events(ast)
+
+
+def check_same_as_full_compile(session, source):
+    ast, events = full_compile(source)
+    assert list(session.events) == list(events)
+    assert session.events.texts == events.texts
+    assert session.program.err_list == ast.err_list
+
+
+def test_split_statements():
+    source = 'title: "x"\n\n# comment\nverse = [ do\n  re # ]\n]\npiano: verse "[" mi\n'
+    assert split_statements(source) == [
+        (1, 'title: "x"\n\n'),
+        (4, "verse = [ do\n  re # ]\n]\n\n"),
+        (7, 'piano: verse "[" mi\n'),
+    ]
+    # an unclosed string or bracket goes on to the end
+    assert split_statements('piano: do\ntitle: "x\n\nre') == [(1, "piano: do\n\n"), (2, 'title: "x\n\nre')]
+    assert split_statements("m = [ do\n\npiano: m\n") == [(1, "m = [ do\n\npiano: m\n")]
+
+
+def test_examples():
+    for file_name in ["twinkle.mtex", "cart.mtex", "err.mtex"]:
+        source = read_example(file_name)
+        session = CompileSession()
+        session.compile(source)
+        check_same_as_full_compile(session, source)
+
+
+def test_syntax_errors():
+    sources = [
+        "piano: do re\n :1/4\nviolin: mi\n",
+        "m(x) \n re :1/4\npiano: do\n",
+        "m = \n ( \n re *2\n",
+        "m(x) \n m(x)\npiano: m(do)\n",
+        "violin: *2 mi \n ( piano: ] ] do\n\n",
+        "m = [ do\n\npiano: m ]\n",
+        'piano: do\ntitle "x\n  track |\n do',
+        "track \n *2 \n piano: do m(x) re\n",
+    ]
+    for source in sources:
+        session = CompileSession()
+        session.compile(source)
+        assert session.program.err_list
+        check_same_as_full_compile(session, source)
+
+
+def test_edit_one_movement():
+    source = read_example("twinkle.mtex")
+    session = CompileSession()
+    session.compile(source)
+    statements = session.parsed
+
+    edited = source.replace("do/mi/sol | sol/si/re", "do/mi/la | sol/si/re")
+    session.compile(edited)
+    assert (session.parsed, session.reused) == (1, statements - 1)
+    assert (session.expansions, session.renders) == (1, 1)
+    check_same_as_full_compile(session, edited)
+
+
+def test_edit_macro():
+    source = "a = do re\nb = mi\ntrack \"x\":\npiano: a\nviolin: b\ntrack \"y\":\nguitar: [ a ]*2\n"
+    session = CompileSession()
+    session.compile(source)
+
+    edited = source.replace("a = do re", "a = fa re")
+    session.compile(edited)
+    # only the movements using a are expanded, violin is reused
+    assert (session.parsed, session.expansions, session.renders) == (1, 2, 2)
+    check_same_as_full_compile(session, edited)
+
+    session.compile(edited)
+    assert (session.parsed, session.expansions, session.renders) == (0, 0, 0)
+
+
+def test_insert_lines():
+    source = read_example("err.mtex")
+    session = CompileSession()
+    session.compile(source)
+    statements = session.parsed
+
+    # every statement moves down, none of them is parsed again and the
+    # errors follow them
+    edited = "\n\n" + source
+    session.compile(edited)
+    assert (session.parsed, session.reused) == (0, statements)
+    check_same_as_full_compile(session, edited)
+
+    session.compile(source)
+    assert session.parsed == 0
+    check_same_as_full_compile(session, source)
+
+
+def test_repeated_statements():
+    source = "a = do\nb = re\npiano: :1/4 a b a |\na = do\n"
+    session = CompileSession()
+    session.compile(source)
+    edited = "a = do\n" + source
+    session.compile(edited)
+    # the two "a = do" are reused, a third one is parsed
+    assert (session.parsed, session.reused) == (1, 4)
+    check_same_as_full_compile(session, edited)
+
+
+def test_macro_cache():
+    source = "a = do\nriff (x) = x a\npiano: riff(re) riff(mi)\nviolin: riff(re)\n"
+    session = CompileSession()
+    session.compile(source)
+    assert (session.macro_cache.hits, session.macro_cache.misses) == (1, 2)
+
+    # the bodies are found again for the movement that changed
+    edited = source.replace("violin: riff(re)", "violin: riff(re) riff(mi)")
+    session.compile(edited)
+    assert (session.macro_cache.hits, session.macro_cache.misses) == (3, 2)
+    check_same_as_full_compile(session, edited)
+
+    # a macro called by riff changed, its bodies are expanded again
+    edited = edited.replace("a = do", "a = fa")
+    session.compile(edited)
+    assert session.macro_cache.misses == 4
+    check_same_as_full_compile(session, edited)
+
+
+def test_macro_errors():
+    source = "a = b\nb = do a\nriff (x) = x nope\npiano: riff(do) a\nviolin: riff(do) riff(re,mi)\n"
+    session = CompileSession()
+    for edited in [source, source, "\n" + source, source.replace("b = do a", "b = do")]:
+        session.compile(edited)
+        check_same_as_full_compile(session, edited)
+    assert [error.code for error in session.program.err_list] == [Code.UNKNOWN_IDENTIFIER, Code.MACRO_ARITY]
+
+
+def test_check():
+    session = CompileSession()
+    source = "piano: :1/4 do re mi fa | do |\nconcert: do\n"
+    program = session.check(source)
+    assert session.events is None
+    ast, events = full_compile(source)
+    assert program.err_list == ast.err_list and len(ast.err_list) == 2
+
+
+if __name__ == "__main__":
+    test_split_statements()
+    test_examples()
+    test_syntax_errors()
+    test_edit_one_movement()
+    test_edit_macro()
+    test_insert_lines()
+    test_repeated_statements()
+    test_macro_cache()
+    test_macro_errors()
+    test_check()
+    print("session tests passed")
@@ -0,0 +1,110 @@
+# Tests for the simplify passes, run with: python tests/test_simplify.py
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lexer import *
+from new_parser import *
+from simplify import *
+from validate import validate
+from helpers import compile_ast
+
+
+def played(ast, mov_id=0):
+    return [expr.value.value for expr in unroll(ast.tracks[0].movements[mov_id].expressions)]
+
+
+def test_repeats_are_not_copied():
+    ast = compile_ast("verse = [ do re [ mi ]*2 ]\npiano: [ verse ]*64 fa\n")
+    exprs = ast.tracks[0].movements[0].expressions
+
+    assert len(exprs) == 2
+    loop = exprs[0]
+    assert isinstance(loop, Loop) and loop.times == 64
+    assert played(ast) == ["do", "re", "mi", "mi"] * 64 + ["fa"]
+
+
+def test_macro_arguments_in_loops():
+    ast = compile_ast("riff (a, b) = [ a do ]*2 b\npiano: riff(re,mi)\n")
+    assert played(ast) == ["re", "do", "re", "do", "mi"]
+
+
+def test_nested_macros_expand_once():
+    ast = compile_ast("c = do\nb = c c\na = b b\npiano: a a\n")
+    exprs = ast.tracks[0].movements[0].expressions
+    assert played(ast) == ["do"] * 8
+    # the body of a is memoized, both uses share its nodes
+    assert exprs[0] is exprs[4]
+
+
+def test_macro_cycle():
+    ast = compile_ast("a = b\nb = do a\npiano: a re\n")
+    assert [error.code for error in ast.err_list] == [Code.MACRO_CYCLE]
+    assert "a -> b -> a" in str(ast.err_list[0]) or "b -> a -> b" in str(ast.err_list[0])
+    # the macros of the cycle are left out
+    assert played(ast) == ["re"]
+
+
+def test_macro_errors():
+    ast = compile_ast("riff (x) = x nope\npiano: riff(do) riff(do) riff(re,mi) other *2 fa\n")
+    assert [(error.code, error.line, error.column) for error in ast.err_list] == [
+        (Code.UNKNOWN_IDENTIFIER, 1, 13), # once for both calls
+        (Code.MACRO_ARITY, 2, 25),
+        (Code.UNKNOWN_IDENTIFIER, 2, 37),
+    ]
+    assert str(ast.err_list[1]) == "Macro error(2,25): macro \"riff\" takes 1 arguments, got 2"
+
+    ast = compile_ast("piano: *2 do\n")
+    assert [error.code for error in ast.err_list] == [Code.REPETITION_START]
+    assert played(ast) == ["do"]
+
+
+def test_macro_instances_are_cached():
+    tokenizer = Tokenizer("riff (a, b) = a do b\npiano: riff(re,mi) riff(re,mi) riff(fa,mi) riff(re,mi)\n")
+    ast = Parser(tokenizer.tokenize(), index=tokenizer.index).parse()
+    cache = MacroCache(maxsize=1)
+    resolve_macros(ast, cache)
+
+    assert played(ast) == ["re", "do", "mi"] * 2 + ["fa", "do", "mi"] + ["re", "do", "mi"]
+    # riff(fa,mi) evicts riff(re,mi), so the last call misses again
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert len(cache) == 1
+
+
+def test_cached_bodies_keep_the_call_positions():
+    ast = compile_ast("riff (x) = >9 x do\npiano: riff(si)\nviolin: riff(si)\n")
+    for m_id, line in enumerate([2, 3]):
+        notes = [expr for expr in unroll(ast.tracks[0].movements[m_id].expressions) if isinstance(expr, Note)]
+        assert [(note.value.value, note.value.line) for note in notes] == [("si", line), ("do", 1)]
+
+    # and so do the errors found after expanding
+    errors = validate(ast)
+    assert [(error.code, error.line, error.column) for error in errors] == [
+        (Code.PITCH_RANGE, 2, 12), (Code.PITCH_RANGE, 1, 16),
+        (Code.PITCH_RANGE, 3, 13), (Code.PITCH_RANGE, 1, 16),
+    ]
+
+
+def test_nested_macro_arguments():
+    ast = compile_ast("inner (a) = a a\nouter (y) = inner(y) re/y (y)\npiano: outer(do) outer(mi)\n")
+    assert ast.err_list == []
+    exprs = ast.tracks[0].movements[0].expressions
+    assert [expr.value.value for expr in exprs[:2]] == ["do", "do"]
+    assert [note.value.value for note in exprs[2].notes] == ["re", "do"]
+    assert exprs[3].note.value.value == "do"
+    assert [expr.value.value for expr in exprs[5:7]] == ["mi", "mi"]
+    assert [note.value.value for note in exprs[7].notes] == ["re", "mi"]
+
+
+if __name__ == "__main__":
+    test_repeats_are_not_copied()
+    test_macro_arguments_in_loops()
+    test_nested_macros_expand_once()
+    test_macro_cycle()
+    test_macro_errors()
+    test_macro_instances_are_cached()
+    test_cached_bodies_keep_the_call_positions()
+    test_nested_macro_arguments()
+    print("simplify tests passed")
@@ -0,0 +1,68 @@
+# Tests for the validation pass, run with: python tests/test_validate.py
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from simplify import *
+from validate import *
+from midigen import gen_events
+from compiler import compile_file
+from helpers import compile_ast
+
+SOURCE = """piano: !4/4 :1/4 do re mi fa | do re mi | do:1/2 re | [ do re ]*2 | do
+violin: !3/4 :1/4 do re mi | do/mi 2 re | do re | !2/4 do re | :1/12 do re mi do re mi |
+"""
+
+
+def test_bars():
+    errors = validate(compile_ast(SOURCE))
+    assert [(error.code, error.line, error.args) for error in errors] == [
+        (Code.BAR_LENGTH, 1, (4, 4, 3)),
+        (Code.BAR_LENGTH, 1, (4, 4, 3)),
+        (Code.BAR_LENGTH, 2, (3, 4, 2)),
+    ]
+    # the chord bar is right: do and mi start together, re 2 quarters after
+    # them, triplets fill the 2/4 bar exactly
+    assert (errors[0].line, errors[0].column, errors[0].span) == (1, 40, 1)
+    assert str(errors[0]) == "Measure error(1,40): The measure is 4/4, for this bar got 3 notes instead"
+
+
+def test_same_errors_as_generating():
+    ast = compile_ast(SOURCE)
+    errors = validate(ast)
+    gen_events(ast)
+    assert ast.err_list == errors
+
+
+def test_check_writes_nothing():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "bars.mtex")
+        with open(source, "w") as f:
+            f.write(SOURCE)
+        errors = compile_file(source, check=True)
+        assert len(errors) == 3 and str(errors[0]).startswith("Measure error(1,40)")
+        assert os.listdir(directory) == ["bars.mtex"]
+
+
+def test_unknown_instrument():
+    ast = compile_ast("piano: :1/4 do | re\nkazoo: !2/4 :1/4 do\n")
+    errors = validate(ast)
+    assert [(error.code, error.line) for error in errors] == [(Code.BAR_LENGTH, 1), (Code.UNKNOWN_INSTRUMENT, 2)]
+    gen_events(ast)
+    assert ast.err_list == errors
+
+
+def test_no_bars():
+    assert validate(compile_ast("piano: do re mi\n")) == []
+
+
+if __name__ == "__main__":
+    test_bars()
+    test_same_errors_as_generating()
+    test_check_writes_nothing()
+    test_unknown_instrument()
+    test_no_bars()
+    print("validate tests passed")
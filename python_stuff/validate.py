@@ -0,0 +1,57 @@
+# Checks of a program that don't need its midi events, so editors can
+# validate a document without generating it (compiler.py --check, the
+# CompileSession), they are the errors midigen finds while generating.
+#
+# The movements are lowered to note arrays (see lowering.py) and the length
+# of every bar is the difference of the cumulative ticks at its two ends, all
+# the bars of a movement are checked against their measure at once.
+from numeric import np
+from ast import *
+from lowering import lower_movement, ticks_per_quarter_for
+from instruments import midi_instruments
+
+# quarter notes in ticks, an int when it is a whole number
+def bar_quarters(ticks, ticks_per_quarter):
+    if ticks % ticks_per_quarter == 0:
+        return ticks // ticks_per_quarter
+    return ticks / ticks_per_quarter
+
+
+# Diagnostics (Code.BAR_LENGTH) of the bars of a lowered movement that don't
+# hold as many quarter notes as their measure says, the args are the
+# measure and the quarters in the bar
+def validate_bars(lowered):
+    if len(lowered.bar_sources) == 0:
+        return []
+
+    # ticks from the start of the movement to the start of every note, and
+    # to the end of the last one
+    elapsed = np.concatenate(([0], np.cumsum(lowered.deltas)))
+    ends = elapsed[lowered.bar_ends]
+    starts = np.concatenate(([0], ends[:-1]))
+    lengths = ends - starts
+    expected = lowered.bar_measures[:, 0] * lowered.ticks_per_quarter
+
+    errors = []
+    for i in np.flatnonzero(lengths != expected).tolist():
+        x, over = lowered.bar_measures[i].tolist()
+        quarters = bar_quarters(int(lengths[i]), lowered.ticks_per_quarter)
+        errors.append(Diagnostic.at(Code.BAR_LENGTH, lowered.bar_sources[i], x, over, quarters))
+    return errors
+
+def instrument_error(movement):
+    return Diagnostic.at(Code.UNKNOWN_INSTRUMENT, movement.instrument, movement.instrument.value)
+
+# Unknown instruments, notes out of range and bar errors of every movement of a program with its
+# macros resolved, in the order of the movements
+def validate(ast):
+    ticks_per_quarter = ticks_per_quarter_for(ast)
+    errors = []
+    for track in ast.tracks:
+        for movement in track.movements:
+            if movement.instrument.value not in midi_instruments:
+                errors.append(instrument_error(movement))
+            lowered = lower_movement(movement, ticks_per_quarter)
+            errors.extend(lowered.errors)
+            errors.extend(validate_bars(lowered))
+    return errors